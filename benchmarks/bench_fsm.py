@@ -0,0 +1,79 @@
+"""Стоимость операций FSM: MemoryStorage против SQLiteStorage.
+
+Для каждого хранилища замеряются get_state, set_state, get_data и set_data
+по --users ключам, в микросекундах на операцию. Чтение SQLiteStorage идёт
+из кэша в памяти, поэтому отдельно замеряется холодное чтение: новый
+экземпляр хранилища читает те же ключи с диска. Запись на диск идёт фоном,
+её время (flush) печатается отдельно.
+
+    python -m benchmarks.bench_fsm [--users 2000] [--rounds 5]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from fsm_storage import SQLiteStorage
+
+BOT_ID = 123456
+STATE = "Form:waiting_text"
+DATA = {"model": "chadai", "temperature": 0.7, "draft": "Напиши короткое поздравление"}
+
+
+def make_keys(users: int):
+    return [StorageKey(bot_id=BOT_ID, chat_id=user_id, user_id=user_id) for user_id in range(1, users + 1)]
+
+
+# ====== ЗАМЕР ====== #
+async def measure(operation, keys, rounds: int) -> float:
+    """Среднее время одной операции, мкс"""
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for key in keys:
+            await operation(key)
+    return (time.perf_counter() - started) / (len(keys) * rounds) * 1e6
+
+
+async def bench(name: str, storage, keys, rounds: int):
+    results = {
+        "set_state": await measure(lambda key: storage.set_state(key, STATE), keys, rounds),
+        "get_state": await measure(storage.get_state, keys, rounds),
+        "set_data": await measure(lambda key: storage.set_data(key, DATA), keys, rounds),
+        "get_data": await measure(storage.get_data, keys, rounds),
+    }
+    print(f"{name:>8}: " + ", ".join(f"{op} {us:6.1f} мкс" for op, us in results.items()))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+    keys = make_keys(args.users)
+
+    memory = MemoryStorage()
+    await bench("Memory", memory, keys, args.rounds)
+    await memory.close()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_name = os.path.join(directory, "fsm.db")
+        storage = SQLiteStorage(db_name)
+        await bench("SQLite", storage, keys, args.rounds)
+        started = time.perf_counter()
+        await storage.flush()
+        print(f"{'flush':>8}: {args.users} ключей за {(time.perf_counter() - started) * 1000:.0f} мс")
+        await storage.close()
+
+        # Новый экземпляр с пустым кэшем: каждое первое чтение идёт в базу
+        cold = SQLiteStorage(db_name)
+        get_state = await measure(cold.get_state, keys, 1)
+        print(f"{'холодное':>8}: get_state {get_state:6.1f} мкс")
+        await cold.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
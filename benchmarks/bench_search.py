@@ -0,0 +1,97 @@
+"""Задержка inline-поиска товаров на большом каталоге.
+
+Заполняет временную базу --products товарами из случайных слов, строит
+ProductIndex и прогоняет запросы так, как их присылает Telegram при
+наборе: каждое нажатие - новый запрос ("ч", "ча", "чай", "чай з", ...).
+Один запрос - то, что делает обработчик inline_search: search и сборка
+inline_results. Первый проход идёт по пустым кэшам, второй повторяет
+те же запросы; кэш индекса держит 1000 запросов, поэтому при большом
+--queries повтор попадает в него лишь частично. Максимум обычно - полный
+проход сборщика мусора по объектам индекса, а не сам поиск.
+
+    python -m benchmarks.bench_search [--products 100000] [--queries 300] [--limit 50]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from typing import List
+
+from database import Database
+from product_search import ProductIndex, inline_results
+
+ADJECTIVES = ["красный", "зелёный", "большой", "малый", "свежий", "ароматный", "сладкий", "крепкий",
+              "лёгкий", "домашний", "летний", "зимний", "classic", "premium", "organic", "мягкий"]
+NOUNS = ["чай", "кофе", "сок", "шоколад", "печенье", "мёд", "варенье", "сыр", "хлеб", "орех",
+         "кружка", "термос", "пакет", "набор", "сироп", "джем", "зефир", "пастила", "какао", "молоко"]
+DETAILS = ["с мятой", "с лимоном", "без сахара", "в банке", "в подарочной упаковке", "на развес",
+           "из Индии", "из Кении", "с корицей", "с ванилью", "ручной работы", "для офиса"]
+
+
+def make_name(rng: random.Random, i: int) -> str:
+    return f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {rng.choice(DETAILS)} {i % 997}"
+
+
+def fill(db: Database, products: int, rng: random.Random):
+    rows = []
+    for i in range(products):
+        name = make_name(rng, i)
+        description = f"{rng.choice(DETAILS)}, {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)}. Артикул T{i:06d}"
+        rows.append((f"T{i:06d}", name, description, rng.randint(50, 5000), None))
+    db.upsert_products(rows)
+
+
+def typing(text: str) -> List[str]:
+    """Запросы, которые придут, пока пользователь набирает text"""
+    return [text[:end] for end in range(1, len(text) + 1) if not text[end - 1].isspace()]
+
+
+# ====== ЗАМЕР ====== #
+def run(index: ProductIndex, queries: List[str], limit: int) -> List[float]:
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        products, _ = index.search(query, 0, limit)
+        inline_results(products, "bench_bot")
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def report(name: str, latencies: List[float]):
+    ordered = sorted(latencies)
+    p50 = ordered[len(ordered) // 2]
+    p99 = ordered[max(int(len(ordered) * 0.99) - 1, 0)]
+    print(f"{name:>10}: {len(ordered)} запросов, p50 {p50 * 1000:6.2f} мс, "
+          f"p99 {p99 * 1000:6.2f} мс, макс {ordered[-1] * 1000:6.2f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=300, help="сколько фраз набрать")
+    parser.add_argument("--limit", type=int, default=50, help="результатов на страницу")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        db = Database(os.path.join(directory, "shop.db"))
+        fill(db, args.products, rng)
+
+        index = ProductIndex(db)
+        started = time.perf_counter()
+        index.rebuild()
+        print(f"{'индекс':>10}: {args.products} товаров за {time.perf_counter() - started:.2f}с")
+
+        phrases = [" ".join(rng.sample([rng.choice(ADJECTIVES), rng.choice(NOUNS), rng.choice(DETAILS)],
+                                       rng.randint(1, 2)))
+                   for _ in range(args.queries)]
+        queries = [query for phrase in phrases for query in typing(phrase)]
+        report("первый", run(index, queries, args.limit))
+        report("повтор", run(index, queries, args.limit))
+        db.connection.close()
+
+
+if __name__ == "__main__":
+    main()
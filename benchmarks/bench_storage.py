@@ -0,0 +1,131 @@
+"""Пропускная способность хранилища под одновременной нагрузкой.
+
+Сравнивает прежнюю схему (новое sqlite3.connect на каждый вызов прямо
+в корутине) со Storage. Одно «обновление» - то, что делает handle_text:
+прочитать настройки пользователя и записать ответ в историю. Кроме
+обновлений в секунду печатается самая большая задержка цикла событий -
+на столько в худшем случае замирали все остальные чаты.
+
+    python -m benchmarks.bench_storage [--updates 2000] [--users 200] [--concurrency 100]
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+
+from storage import Storage
+
+PROMPT = "Напиши короткое поздравление с днём рождения"
+RESPONSE = "С днём рождения! " * 40
+
+
+# ====== ПРЕЖНЯЯ СХЕМА ====== #
+def legacy_init(db_name: str):
+    with sqlite3.connect(db_name) as conn:
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            model TEXT NOT NULL,
+            temperature REAL NOT NULL,
+            prompt TEXT NOT NULL,
+            response TEXT NOT NULL
+        )
+        """)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS user_settings (
+            user_id INTEGER PRIMARY KEY,
+            model TEXT NOT NULL DEFAULT 'chadai',
+            temperature REAL NOT NULL DEFAULT 0.7
+        )
+        """)
+
+
+def legacy_get_user_settings(db_name: str, user_id: int):
+    with sqlite3.connect(db_name) as conn:
+        row = conn.execute("SELECT model, temperature FROM user_settings WHERE user_id = ?", (user_id,)).fetchone()
+        if row:
+            return {"model": row[0], "temperature": row[1]}
+        conn.execute("INSERT INTO user_settings (user_id, model, temperature) VALUES (?, ?, ?)",
+                     (user_id, "chadai", 0.7))
+        return {"model": "chadai", "temperature": 0.7}
+
+
+def legacy_add_to_history(db_name: str, user_id: int, model: str, temperature: float, prompt: str, response: str):
+    with sqlite3.connect(db_name) as conn:
+        conn.execute(
+            "INSERT INTO history (user_id, model, temperature, prompt, response) VALUES (?, ?, ?, ?, ?)",
+            (user_id, model, temperature, prompt, response)
+        )
+
+
+# ====== ЗАМЕР ====== #
+async def _loop_lag(stop: asyncio.Event, result: list):
+    # Наибольшее опоздание таймера на 1 мс - насколько цикл событий был занят
+    worst = 0.0
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.001)
+        worst = max(worst, time.perf_counter() - started - 0.001)
+    result.append(worst)
+
+
+async def _run(update, updates: int, users: int, concurrency: int):
+    limit = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with limit:
+            await update(i % users)
+
+    await asyncio.gather(*(one(i) for i in range(updates)))
+
+
+async def bench(name: str, update, updates: int, users: int, concurrency: int, finish=None):
+    stop, lag = asyncio.Event(), []
+    ticker = asyncio.create_task(_loop_lag(stop, lag))
+    started = time.perf_counter()
+    await _run(update, updates, users, concurrency)
+    if finish is not None:
+        # Для Storage считаем и дозапись очереди истории на диск
+        await finish()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await ticker
+    print(f"{name:>8}: {updates / elapsed:8.0f} обновлений/с, "
+          f"всего {elapsed:.2f}с, макс. задержка цикла {lag[0] * 1000:.0f} мс")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        legacy_db = os.path.join(directory, "legacy.db")
+        legacy_init(legacy_db)
+
+        async def legacy_update(user_id: int):
+            settings = legacy_get_user_settings(legacy_db, user_id)
+            legacy_add_to_history(legacy_db, user_id, settings["model"], settings["temperature"], PROMPT, RESPONSE)
+
+        await bench("до", legacy_update, args.updates, args.users, args.concurrency)
+
+        storage = Storage(os.path.join(directory, "storage.db"), default_model="chadai")
+        await storage.init()
+
+        async def storage_update(user_id: int):
+            settings = await storage.get_user_settings(user_id)
+            await storage.add_to_history(user_id, settings["model"], settings["temperature"], PROMPT, RESPONSE)
+
+        await bench("Storage", storage_update, args.updates, args.users, args.concurrency,
+                    finish=storage.history_writer.flush)
+        await storage.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,217 @@
+"""Задержка и пропускная способность приёма обновлений: polling против вебхука.
+
+Поднимает локальный сервер, изображающий Bot API, и прогоняет через
+aiogram одни и те же обновления двумя путями:
+
+- polling: обновления копятся на «сервере Telegram» и забираются
+  длинным опросом getUpdates, как это делает dp.start_polling;
+- webhook: «Telegram» сам отправляет каждое обновление POST-запросом
+  в WebhookServer.
+
+Обработчик имитирует работу бота (ожидание ввода-вывода --work секунд).
+Задержка - от появления обновления у Telegram до начала обработки.
+«Telegram» и бот работают в одном процессе, поэтому при высокой частоте
+в результат вебхука входит и стоимость отправки POST-запросов.
+
+    python -m benchmarks.bench_updates [--updates 2000] [--rate 500] [--work 0.05]
+"""
+import argparse
+import asyncio
+import json
+import socket
+import time
+from typing import Dict, List
+
+import aiohttp
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import Message
+from aiohttp import web
+
+from webhook import SECRET_HEADER, WebhookServer
+
+TOKEN = "123456:BENCHMARKxxxxxxxxxxxxxxxxxxxxxxxxxx"
+SECRET = "bench-secret"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+
+def make_update(update_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": update_id % 1000 + 1, "type": "private"},
+            "from": {"id": update_id % 1000 + 1, "is_bot": False, "first_name": "User"},
+            "text": "привет",
+        },
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# ====== ПОДДЕЛЬНЫЙ BOT API ====== #
+class FakeBotAPI:
+    """Минимальный Bot API: getMe, getUpdates с длинным опросом, set/deleteWebhook"""
+
+    def __init__(self):
+        self.pending: List[dict] = []
+        self._arrived = asyncio.Event()
+        self._runner = None
+
+    def push(self, update: dict):
+        self.pending.append(update)
+        self._arrived.set()
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        port = free_port()
+        await web.TCPSite(self._runner, "127.0.0.1", port).start()
+        return f"http://127.0.0.1:{port}"
+
+    async def close(self):
+        await self._runner.cleanup()
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        if method == "getMe":
+            return self._ok(BOT_USER)
+        if method == "getUpdates":
+            return self._ok(await self._get_updates(int(params.get("offset", 0)), float(params.get("timeout", 0))))
+        return self._ok(True)
+
+    async def _get_updates(self, offset: int, timeout: float) -> List[dict]:
+        # Подтверждённые обновления (update_id < offset) Telegram больше не отдаёт
+        self.pending = [update for update in self.pending if update["update_id"] >= offset]
+        if not self.pending and timeout:
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.pending[:100]
+
+    @staticmethod
+    def _ok(result) -> web.Response:
+        return web.Response(text=json.dumps({"ok": True, "result": result}), content_type="application/json")
+
+
+# ====== ЗАМЕР ====== #
+class Meter:
+    def __init__(self, total: int):
+        self.total = total
+        self.sent: Dict[int, float] = {}
+        self.latencies: List[float] = []
+        self.finished = asyncio.Event()
+
+    def handled(self, update_id: int):
+        self.latencies.append(time.perf_counter() - self.sent[update_id])
+        if len(self.latencies) == self.total:
+            self.finished.set()
+
+    def report(self, name: str, elapsed: float):
+        ordered = sorted(self.latencies)
+        p50 = ordered[len(ordered) // 2]
+        p95 = ordered[int(len(ordered) * 0.95) - 1]
+        print(f"{name:>8}: {self.total / elapsed:7.0f} обновлений/с, "
+              f"задержка p50 {p50 * 1000:6.1f} мс, p95 {p95 * 1000:6.1f} мс, макс {ordered[-1] * 1000:6.1f} мс")
+
+
+def make_dispatcher(meter: Meter, work: float) -> Dispatcher:
+    dp = Dispatcher()
+
+    @dp.message()
+    async def handler(message: Message):
+        meter.handled(message.message_id)
+        await asyncio.sleep(work)
+
+    return dp
+
+
+async def produce(deliver, updates: int, rate: float, meter: Meter):
+    """Выдать updates обновлений с частотой rate в секунду"""
+    interval = 1 / rate
+    started = time.perf_counter()
+    deliveries = []
+    for update_id in range(1, updates + 1):
+        delay = started + update_id * interval - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        meter.sent[update_id] = time.perf_counter()
+        deliveries.append(asyncio.ensure_future(deliver(make_update(update_id))))
+    await asyncio.gather(*deliveries)
+
+
+async def bench_polling(updates: int, rate: float, work: float):
+    api = FakeBotAPI()
+    base = await api.start()
+    bot = Bot(TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(base)))
+    meter = Meter(updates)
+    dp = make_dispatcher(meter, work)
+
+    async def deliver(update: dict):
+        api.push(update)
+
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, polling_timeout=10))
+    await asyncio.sleep(0.5)  # Дать опросу начаться
+    started = time.perf_counter()
+    await produce(deliver, updates, rate, meter)
+    await meter.finished.wait()
+    meter.report("polling", time.perf_counter() - started)
+
+    await dp.stop_polling()
+    await polling
+    await api.close()
+
+
+async def bench_webhook(updates: int, rate: float, work: float):
+    api = FakeBotAPI()
+    base = await api.start()
+    bot = Bot(TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(base)))
+    meter = Meter(updates)
+    server = WebhookServer(make_dispatcher(meter, work), bot, SECRET, queue_size=updates)
+    port = free_port()
+    running = asyncio.create_task(server.run("127.0.0.1", port, f"http://127.0.0.1:{port}"))
+    await asyncio.sleep(0.5)
+
+    url = f"http://127.0.0.1:{port}{server.path}"
+    async with aiohttp.ClientSession(headers={SECRET_HEADER: SECRET}) as telegram:
+        async def deliver(update: dict):
+            async with telegram.post(url, json=update) as response:
+                response.raise_for_status()
+
+        started = time.perf_counter()
+        await produce(deliver, updates, rate, meter)
+        await meter.finished.wait()
+        meter.report("webhook", time.perf_counter() - started)
+
+    running.cancel()
+    try:
+        await running
+    except asyncio.CancelledError:
+        pass
+    await api.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=500, help="обновлений в секунду")
+    parser.add_argument("--work", type=float, default=0.05, help="время обработки одного обновления, с")
+    args = parser.parse_args()
+
+    await bench_polling(args.updates, args.rate, args.work)
+    await bench_webhook(args.updates, args.rate, args.work)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
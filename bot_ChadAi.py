@@ -1,21 +1,71 @@
-
 import logging
-import aiohttp
-import sqlite3
 import asyncio
+import time
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
-from typing import Dict, Any
+from typing import AsyncIterator, Optional
+
+from cache import LRUCache, ResponseCache
+from http_client import APIClient
+from storage import Storage
+from retention import HistoryRetention
+from rollups import PERIODS, UsageRollups, format_usage_report
+from singleflight import SingleFlight
+from providers import ChadGPTProvider, ProviderRegistry, format_providers_report
+from resilience import ResiliencePolicy
+from scheduler import FairScheduler, QueueFull
+from streaming import StreamingReply, queue_position_updater
+from metrics import ActivityTracker, metrics
+from webhook import WEBHOOK, WebhookServer, run_mode
+from history_view import (
+    FULL, HISTORY_PREFIX, OLDER, SEARCH_PREFIX, format_history_page,
+    format_search_results, history_page_keyboard, parse_history_callback, parse_search_callback,
+    search_key, search_keyboard, send_history_entry
+)
+from sharding import ShardSupervisor
+from ratelimit import RateLimiter, RateLimitMiddleware
+from broadcast import Broadcaster, format_progress
 
 # ====== НАСТРОЙКИ ====== #
 BOT_TOKEN = ''
+ADMIN_ID = 521188043
 CHAD_API_KEY = ''
 CHAD_API_URL = 'https://ask.chadgpt.ru/api/public/gpt-4o-mini'
 DB_NAME = "bot_history.db"
+HISTORY_PAGE_SIZE = 5  # Записей истории на странице
+SEARCH_PAGE_SIZE = 5  # Результатов поиска на странице
+HISTORY_COMPRESS_THRESHOLD = 1024  # Ответы длиннее (байт) хранятся сжатыми, None - не сжимать
+HISTORY_MAX_ROWS_PER_USER = 1000  # None - без ограничения
+HISTORY_MAX_AGE_DAYS = 365  # None - хранить всегда
+HISTORY_RETENTION_INTERVAL = 3600  # Секунд между проходами очистки
+USAGE_ROLLUP_INTERVAL = 300  # Секунд между обновлениями сводок для /stats
 REQUEST_TIMEOUT = 25  # Секунд
+CONNECT_TIMEOUT = 5  # Секунд
+SETTINGS_CACHE_SIZE = 10000  # Пользователей в кэше настроек
+STREAMING = True  # Показывать ответ по мере генерации
+STREAM_EDIT_INTERVAL = 1.0  # Секунд между редактированиями сообщения
+MAX_RETRIES = 2  # Повторов при сетевых ошибках и 429/5xx
+HEDGE_REQUESTS = False  # Дублировать запрос, если ответ дольше обычного (p95)
+MAX_CONCURRENT_REQUESTS = 8  # Одновременных запросов к API
+MAX_QUEUE_DEPTH = 200  # Запросов в очереди, дальше - отказ
+MAX_QUEUED_PER_USER = 3
+RESPONSE_CACHE = True  # Кэшировать ответы на одинаковые запросы
+RESPONSE_CACHE_TTL = 24 * 3600  # Секунд
+RESPONSE_CACHE_MAX_BYTES = 50 * 1024 * 1024
+RESPONSE_CACHE_MAX_TEMPERATURE = 0.8  # Выше - ответы не кэшируются (None - кэшировать всегда)
+UPDATES_MODE = "polling"  # "polling" или "webhook", переопределяется флагом --webhook/--polling
+WEBHOOK_BASE_URL = ""  # Публичный https-адрес бота
+WEBHOOK_SECRET = ""  # Секрет для заголовка X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_HOST = "0.0.0.0"
+WEBHOOK_PORT = 8080
+WEBHOOK_QUEUE_SIZE = 1000  # Принятых, но ещё не обработанных обновлений
+OUTBOUND_RATE = 28  # Сообщений в секунду от бота всего (на процесс); лимит Telegram - около 30
+OUTBOUND_PER_CHAT_RATE = 1  # Сообщений в секунду в один чат
+BROADCAST_BATCH_SIZE = 25  # Получателей в порции: одновременных отправок рассылки и строк в одной транзакции
+WORKERS = 1  # Процессов-обработчиков; больше 1 - обновления распределяются по user_id (только polling)
 
 # Настройка логгирования
 logging.basicConfig(
@@ -30,97 +80,30 @@ logger = logging.getLogger(__name__)
 
 # ====== ИНИЦИАЛИЗАЦИЯ БОТА И ДИСПЕТЧЕРА ====== #
 bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+bot.session.middleware(RateLimitMiddleware(RateLimiter(OUTBOUND_RATE, per_chat_rate=OUTBOUND_PER_CHAT_RATE)))
 dp = Dispatcher()
 
 # ====== БАЗА ДАННЫХ ====== #
-def init_db():
-    """Инициализация базы данных"""
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            model TEXT NOT NULL,
-            temperature REAL NOT NULL,
-            prompt TEXT NOT NULL,
-            response TEXT NOT NULL
-        )
-        """)
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS user_settings (
-            user_id INTEGER PRIMARY KEY,
-            model TEXT NOT NULL DEFAULT 'chadai',
-            temperature REAL NOT NULL DEFAULT 0.7
-        )
-        """)
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_history_user_id ON history (user_id)")
-        conn.commit()
-
-def get_user_settings(user_id: int) -> Dict[str, Any]:
-    """Получение настроек пользователя"""
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT model, temperature FROM user_settings WHERE user_id = ?", (user_id,))
-        settings = cursor.fetchone()
-        
-        if settings:
-            return {"model": settings[0], "temperature": settings[1]}
-        
-        default_settings = {"model": "chadai", "temperature": 0.7}
-        cursor.execute(
-            "INSERT INTO user_settings (user_id, model, temperature) VALUES (?, ?, ?)",
-            (user_id, default_settings["model"], default_settings["temperature"])
-        )
-        conn.commit()
-        return default_settings
-
-def update_user_setting(user_id: int, key: str, value: Any):
-    """Обновление настроек пользователя"""
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            f"UPDATE user_settings SET {key} = ? WHERE user_id = ?",
-            (value, user_id)
-        )
-        conn.commit()
-
-def add_to_history(user_id: int, model: str, temperature: float, prompt: str, response: str):
-    """Добавление записи в историю"""
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-        INSERT INTO history (user_id, model, temperature, prompt, response)
-        VALUES (?, ?, ?, ?, ?)
-        """, (user_id, model, temperature, prompt, response))
-        conn.commit()
-
-def get_user_history(user_id: int, limit: int = 5):
-    """Получение истории пользователя"""
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-        SELECT timestamp, model, temperature, prompt, response 
-        FROM history 
-        WHERE user_id = ? 
-        ORDER BY timestamp DESC 
-        LIMIT ?
-        """, (user_id, limit))
-        return cursor.fetchall()
-
-def clear_user_history(user_id: int):
-    """Очистка истории пользователя"""
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM history WHERE user_id = ?", (user_id,))
-        conn.commit()
-        return cursor.rowcount
+storage = Storage(
+    DB_NAME,
+    default_model="chadai",
+    settings_cache=LRUCache(SETTINGS_CACHE_SIZE),
+    compress_threshold=HISTORY_COMPRESS_THRESHOLD
+)
+retention = HistoryRetention(
+    storage,
+    max_rows_per_user=HISTORY_MAX_ROWS_PER_USER,
+    max_age_days=HISTORY_MAX_AGE_DAYS,
+    interval=HISTORY_RETENTION_INTERVAL
+)
+rollups = UsageRollups(storage, interval=USAGE_ROLLUP_INTERVAL)
+search_queries = LRUCache(10000)  # Ключ из callback_data кнопок поиска -> текст запроса
+broadcaster = Broadcaster(bot, storage, batch_size=BROADCAST_BATCH_SIZE)
 
 # ====== КЛАВИАТУРЫ ====== #
-def get_main_keyboard(user_id: int):
+async def get_main_keyboard(user_id: int):
     """Основная клавиатура"""
-    settings = get_user_settings(user_id)
+    settings = await storage.get_user_settings(user_id)
     return ReplyKeyboardMarkup(
         keyboard=[
             [KeyboardButton(text="ChadAI" if settings["model"] != "chadai" else "✅ ChadAI")],
@@ -150,62 +133,107 @@ def get_settings_keyboard():
 
 # ====== CHADGPT API ====== #
 class ChadGPTAPI:
-    def __init__(self):
-        self.session = None
-    
-    async def ensure_session(self):
-        if self.session is None or self.session.closed:
-            self.session = aiohttp.ClientSession(
-                timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT))
+    def __init__(self, registry: ProviderRegistry, provider: str = "chadai",
+                 cache: Optional[ResponseCache] = None):
+        self.registry = registry
+        self.provider = provider
+        self.cache = cache
+        self.flights = SingleFlight()
     
     async def close(self):
-        if self.session:
-            await self.session.close()
+        await self.registry.http.close()
     
     async def generate_response(self, prompt: str, temperature: float) -> str:
+        if self.cache:
+            cached = await self.cache.get(prompt, CHAD_API_URL, temperature)
+            if cached:
+                return cached
+
+        key = ResponseCache.make_key(prompt, CHAD_API_URL, temperature)
         try:
-            await self.ensure_session()
-            
-            request_json = {
-                "message": prompt,
-                "api_key": CHAD_API_KEY
-            }
-
-            async with self.session.post(
-                CHAD_API_URL,
-                json=request_json
-            ) as response:
-                
-                if response.status != 200:
-                    logger.error(f"HTTP Error {response.status}")
-                    return None
-                
-                data = await response.json()
-                
-                if data.get('is_success', False):
-                    return data['response']
-                else:
-                    logger.error(f"API Error: {data.get('error_message', 'Unknown error')}")
-                    return None
-                    
-        except Exception as e:
-            logger.error(f"ChadGPT API Error: {str(e)}")
+            return await self.flights.do(
+                key, lambda: self._generate(prompt, temperature), timeout=REQUEST_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.error("ChadGPT API Error: timeout")
             return None
 
+    async def stream_response(self, prompt: str, temperature: float) -> AsyncIterator[str]:
+        """Потоковая генерация: отдаёт фрагменты ответа по мере получения.
+
+        Если генерация оборвалась, выбрасывает исключение после уже отданных фрагментов.
+        """
+        if self.cache:
+            cached = await self.cache.get(prompt, CHAD_API_URL, temperature)
+            if cached:
+                yield cached
+                return
+
+        key = ResponseCache.make_key(prompt, CHAD_API_URL, temperature)
+        # Ошибку посреди потока не глотаем: вызывающий должен знать, что ответ неполный
+        async for chunk in self.flights.stream(
+                key, lambda: self._generate_stream(prompt, temperature), timeout=REQUEST_TIMEOUT):
+            yield chunk
+
+    async def _generate(self, prompt: str, temperature: float) -> str:
+        """Один запрос к API на все склеенные вызовы, результат сохраняется в кэш"""
+        started = time.monotonic()
+        response = await self._request(prompt, temperature)
+        if response and self.cache:
+            await self.cache.set(prompt, CHAD_API_URL, temperature, response, time.monotonic() - started)
+        return response
+
+    async def _generate_stream(self, prompt: str, temperature: float) -> AsyncIterator[str]:
+        started = time.monotonic()
+        chunks = []
+        async for chunk in self._stream(prompt, temperature):
+            chunks.append(chunk)
+            yield chunk
+
+        response = "".join(chunks)
+        if response and self.cache:
+            await self.cache.set(prompt, CHAD_API_URL, temperature, response, time.monotonic() - started)
+
+    async def _request(self, prompt: str, temperature: float) -> str:
+        return await self.registry.generate(self.provider, prompt, temperature)
+
+    async def _stream(self, prompt: str, temperature: float) -> AsyncIterator[str]:
+        async for chunk in self.registry.stream(self.provider, prompt, temperature):
+            yield chunk
+
 # Инициализация API
-chad_api = ChadGPTAPI()
+response_cache = ResponseCache(
+    storage,
+    ttl=RESPONSE_CACHE_TTL,
+    max_bytes=RESPONSE_CACHE_MAX_BYTES,
+    max_temperature=RESPONSE_CACHE_MAX_TEMPERATURE
+)
+api_client = APIClient(
+    connect_timeout=CONNECT_TIMEOUT,
+    read_timeout=REQUEST_TIMEOUT,
+    policy=ResiliencePolicy(retries=MAX_RETRIES, hedge=HEDGE_REQUESTS)
+)
+registry = ProviderRegistry(api_client)
+registry.register(ChadGPTProvider("chadai", CHAD_API_URL, CHAD_API_KEY, "gpt-4o-mini"))
+chad_api = ChadGPTAPI(registry, cache=response_cache if RESPONSE_CACHE else None)
+
+scheduler = FairScheduler(
+    max_concurrency=MAX_CONCURRENT_REQUESTS,
+    max_queue=MAX_QUEUE_DEPTH,
+    max_per_user=MAX_QUEUED_PER_USER
+)
+activity = ActivityTracker()  # Активные пользователи за час и запросы за минуту
 
 # ====== ОБРАБОТЧИКИ ====== #
 @dp.message(Command("start"))
 async def cmd_start(message: Message):
-    settings = get_user_settings(message.from_user.id)
+    settings = await storage.get_user_settings(message.from_user.id)
     await message.answer(
         "✨ <b>Чат-бот с ChadGPT</b> готов к работе!\n\n"
         f"Текущие настройки:\n"
         f"• Модель: <b>{settings['model'].upper()}</b>\n"
         f"• Креативность: <b>{settings['temperature']}</b>\n\n"
         "Отправьте мне сообщение, и я постараюсь на него ответить.",
-        reply_markup=get_main_keyboard(message.from_user.id)
+        reply_markup=await get_main_keyboard(message.from_user.id)
     )
 
 @dp.message(Command("help"))
@@ -221,16 +249,76 @@ async def cmd_help(message: Message):
 
 @dp.message(Command("status"))
 async def cmd_status(message: Message):
+    cache_stats = storage.settings_cache.stats()
+    ttft = metrics.summary("llm_ttft_seconds")
+    outbound_wait = metrics.summary("telegram_queue_wait_seconds")
+    response_stats = response_cache.stats()
+    flight_stats = chad_api.flights.stats()
+    queue_stats = scheduler.stats()
+    storage_stats = await storage.get_storage_stats()
     await message.answer(
         "🟢 <b>Бот работает нормально</b>\n\n"
         "Последние действия:\n"
-        f"• Пользователей в базе: {len(get_all_users())}\n"
-        f"• Всего запросов: {get_total_requests()}"
+        f"• Пользователей в базе: {await storage.get_users_count()}\n"
+        f"• Всего запросов: {await storage.get_total_requests()}\n"
+        f"• Активных за час: {activity.active_users()}, запросов за минуту: {activity.requests_per_window()}\n"
+        f"• Кэш настроек: {cache_stats['hits']} попаданий / {cache_stats['misses']} промахов\n"
+        f"• Кэш ответов: {response_stats['hit_ratio']:.0%} попаданий, сэкономлено {response_stats['saved_seconds']:.0f}с\n"
+        f"• Склеено одинаковых запросов: {flight_stats['coalesced']}\n"
+        f"• Запросов в работе: {queue_stats['active']}, в очереди: {queue_stats['waiting']}, "
+        f"ожидают записи в историю: {storage.history_writer.pending_count()}\n"
+        f"• База: {storage_stats['db_bytes'] / 1024 / 1024:.1f} МБ, сжатием сэкономлено "
+        f"{storage_stats['history_bytes_saved'] / 1024 / 1024:.1f} МБ, удалено старых записей: {storage_stats['history_rows_expired']}"
+        + (f"\n• Время до первого ответа: p50 {ttft['p50']:.2f}с, p95 {ttft['p95']:.2f}с" if ttft["count"] else "")
+        + (
+            f"\n• Отправка в Telegram: ожидание p95 {outbound_wait['p95']:.2f}с, "
+            f"ответов 429: {metrics.counter('telegram_429'):.0f}, "
+            f"склеено правок: {metrics.counter('telegram_edits_coalesced'):.0f}"
+            if outbound_wait["count"] else ""
+        )
     )
 
+@dp.message(Command("providers"), lambda message: message.from_user.id == ADMIN_ID)
+async def cmd_providers(message: Message):
+    await message.answer(format_providers_report(registry))
+
+@dp.message(Command("stats"), lambda message: message.from_user.id == ADMIN_ID)
+async def cmd_stats(message: Message, command: CommandObject):
+    period = (command.args or "day").strip().lower()
+    if period not in PERIODS:
+        await message.answer(f"Использование: <code>/stats [{'|'.join(PERIODS)}]</code>")
+        return
+    await message.answer(await format_usage_report(storage, period))
+
+@dp.message(Command("broadcast"), lambda message: message.from_user.id == ADMIN_ID)
+async def cmd_broadcast(message: Message):
+    source = message.reply_to_message
+    if source is None:
+        await message.answer("Ответьте командой /broadcast на сообщение, которое нужно разослать")
+        return
+    status = await message.answer("📣 Запускаю рассылку...")
+    await broadcaster.start(source.chat.id, source.message_id, status.chat.id, status.message_id)
+
+@dp.message(Command("broadcast_status"), lambda message: message.from_user.id == ADMIN_ID)
+async def cmd_broadcast_status(message: Message, command: CommandObject):
+    broadcast_id = int(command.args) if command.args and command.args.strip().isdigit() else None
+    progress = await broadcaster.progress(broadcast_id)
+    await message.answer(format_progress(progress) if progress else "Рассылок ещё не было")
+
+@dp.message(Command("broadcast_cancel"), lambda message: message.from_user.id == ADMIN_ID)
+async def cmd_broadcast_cancel(message: Message, command: CommandObject):
+    active = broadcaster.active()
+    broadcast_id = int(command.args) if command.args and command.args.strip().isdigit() else None
+    if broadcast_id is None and len(active) == 1:
+        broadcast_id = active[0]
+    if broadcast_id is None or not await broadcaster.cancel(broadcast_id):
+        await message.answer(f"Идущие рассылки: {', '.join(map(str, active)) or 'нет'}")
+        return
+    await message.answer(format_progress(await broadcaster.progress(broadcast_id)))
+
 @dp.message(F.text == "🛠 Настройки")
 async def show_settings(message: Message):
-    settings = get_user_settings(message.from_user.id)
+    settings = await storage.get_user_settings(message.from_user.id)
     await message.answer(
         f"⚙️ <b>Текущие настройки:</b>\n"
         f"• Модель: <b>{settings['model'].upper()}</b>\n"
@@ -242,9 +330,9 @@ async def show_settings(message: Message):
 @dp.callback_query(F.data == "increase_temp")
 async def increase_temperature(callback: CallbackQuery):
     user_id = callback.from_user.id
-    settings = get_user_settings(user_id)
+    settings = await storage.get_user_settings(user_id)
     new_temp = min(1.0, round(settings["temperature"] + 0.1, 1))
-    update_user_setting(user_id, "temperature", new_temp)
+    await storage.update_user_setting(user_id, "temperature", new_temp)
     await callback.message.edit_text(
         f"⚙️ <b>Креативность увеличена до:</b> {new_temp}",
         reply_markup=get_settings_keyboard()
@@ -254,9 +342,9 @@ async def increase_temperature(callback: CallbackQuery):
 @dp.callback_query(F.data == "decrease_temp")
 async def decrease_temperature(callback: CallbackQuery):
     user_id = callback.from_user.id
-    settings = get_user_settings(user_id)
+    settings = await storage.get_user_settings(user_id)
     new_temp = max(0.0, round(settings["temperature"] - 0.1, 1))
-    update_user_setting(user_id, "temperature", new_temp)
+    await storage.update_user_setting(user_id, "temperature", new_temp)
     await callback.message.edit_text(
         f"⚙️ <b>Креативность уменьшена до:</b> {new_temp}",
         reply_markup=get_settings_keyboard()
@@ -266,8 +354,7 @@ async def decrease_temperature(callback: CallbackQuery):
 @dp.callback_query(F.data == "reset_settings")
 async def reset_settings(callback: CallbackQuery):
     user_id = callback.from_user.id
-    update_user_setting(user_id, "model", "chadai")
-    update_user_setting(user_id, "temperature", 0.7)
+    await storage.reset_user_settings(user_id)
     await callback.message.edit_text(
         "⚙️ <b>Настройки сброшены к значениям по умолчанию:</b>\n"
         "• Модель: CHADAI\n"
@@ -278,56 +365,146 @@ async def reset_settings(callback: CallbackQuery):
 
 @dp.message(F.text == "📜 История")
 async def show_history(message: Message):
-    history = get_user_history(message.from_user.id)
-    if not history:
+    rows, has_newer, has_older = await storage.get_history_page(message.from_user.id, limit=HISTORY_PAGE_SIZE)
+    if not rows:
         await message.answer("📭 История запросов пуста")
         return
     
-    text = "📜 <b>Последние запросы:</b>\n\n"
-    for i, (timestamp, model, temp, prompt, response) in enumerate(history, 1):
-        text += (
-            f"{i}. <i>{timestamp}</i>\n"
-            f"• Модель: <b>{model.upper()}</b>\n"
-            f"• Креативность: <b>{temp}</b>\n"
-            f"• Запрос: <i>{prompt[:50]}{'...' if len(prompt) > 50 else ''}</i>\n\n"
-        )
+    await message.answer(
+        format_history_page(rows),
+        reply_markup=history_page_keyboard(rows, has_newer, has_older)
+    )
+
+@dp.callback_query(F.data.startswith(f"{HISTORY_PREFIX}:"))
+async def history_page_handler(callback: CallbackQuery):
+    parsed = parse_history_callback(callback.data)
+    if parsed is None:
+        await callback.answer()
+        return
+    action, entry_id = parsed
+    user_id = callback.from_user.id
     
-    await message.answer(text)
+    if action == FULL:
+        entry = await storage.get_history_entry(user_id, entry_id)
+        if entry is None:
+            await callback.answer("Запись не найдена")
+            return
+        await send_history_entry(callback.message, entry)
+        await callback.answer()
+        return
+    
+    if action == OLDER:
+        page = await storage.get_history_page(user_id, before_id=entry_id, limit=HISTORY_PAGE_SIZE)
+    else:
+        page = await storage.get_history_page(user_id, after_id=entry_id, limit=HISTORY_PAGE_SIZE)
+    rows, has_newer, has_older = page
+    if not rows:
+        await callback.answer("Больше записей нет")
+        return
+    await callback.message.edit_text(
+        format_history_page(rows),
+        reply_markup=history_page_keyboard(rows, has_newer, has_older)
+    )
+    await callback.answer()
 
 @dp.callback_query(F.data == "clear_history")
 async def clear_history_handler(callback: CallbackQuery):
-    deleted_count = clear_user_history(callback.from_user.id)
+    deleted_count = await storage.clear_user_history(callback.from_user.id)
     await callback.message.answer(
         f"✅ Удалено {deleted_count} записей из истории" if deleted_count > 0 
         else "📭 История уже пуста"
     )
     await callback.answer()
 
+@dp.message(Command("search"))
+async def cmd_search(message: Message, command: CommandObject):
+    query = (command.args or "").strip()
+    if not query:
+        await message.answer("🔎 Использование: <code>/search текст</code>")
+        return
+    key = search_key(query)
+    search_queries.set(key, query)
+    rows, has_more = await storage.search_history(message.from_user.id, query, limit=SEARCH_PAGE_SIZE)
+    if not rows:
+        await message.answer("🔎 Ничего не найдено")
+        return
+    await message.answer(
+        format_search_results(query, rows, 0),
+        reply_markup=search_keyboard(rows, key, 0, SEARCH_PAGE_SIZE, has_more)
+    )
+
+@dp.callback_query(F.data.startswith(f"{SEARCH_PREFIX}:"))
+async def search_page_handler(callback: CallbackQuery):
+    parsed = parse_search_callback(callback.data)
+    query = search_queries.get(parsed[1]) if parsed else None
+    if query is None:
+        await callback.answer("Поиск устарел, повторите /search")
+        return
+    offset, key = parsed
+    rows, has_more = await storage.search_history(callback.from_user.id, query, offset, SEARCH_PAGE_SIZE)
+    if not rows:
+        await callback.answer("Больше результатов нет")
+        return
+    await callback.message.edit_text(
+        format_search_results(query, rows, offset),
+        reply_markup=search_keyboard(rows, key, offset, SEARCH_PAGE_SIZE, has_more)
+    )
+    await callback.answer()
+
+@dp.message(Command("reindex"), lambda message: message.from_user.id == ADMIN_ID)
+async def cmd_reindex(message: Message):
+    status = await message.answer("🔄 Перестраиваю поисковый индекс...")
+    started = time.monotonic()
+    await storage.rebuild_search_index()
+    await status.edit_text(f"✅ Поисковый индекс перестроен за {time.monotonic() - started:.1f}с")
+
 @dp.message(F.text)
 async def handle_text(message: Message):
     if message.text in ["ChadAI", "🎨 Креативность:", "📜 История", "🛠 Настройки"]:
         return
     
     user_id = message.from_user.id
+    activity.touch(user_id)
     processing_msg = await message.answer("🔄 Обрабатываю запрос...")
     
     try:
-        settings = get_user_settings(user_id)
-        response = await chad_api.generate_response(message.text, settings["temperature"])
+        settings = await storage.get_user_settings(user_id)
+        header = f"📝 <b>Результат (креативность {settings['temperature']}):</b>\n\n"
+        async with scheduler.slot(user_id, on_wait=queue_position_updater(processing_msg)):
+            started = time.monotonic()
+            if STREAMING:
+                reply = StreamingReply(processing_msg, header=header, edit_interval=STREAM_EDIT_INTERVAL)
+                try:
+                    async for chunk in chad_api.stream_response(message.text, settings["temperature"]):
+                        await reply.feed(chunk)
+                except Exception as e:
+                    logger.error(f"ChadGPT API Error: {str(e)}")
+                    if reply.text:
+                        # Неполный ответ показываем с пометкой, но в историю не пишем
+                        await reply.abort()
+                        return
+                response = reply.text
+            else:
+                response = await chad_api.generate_response(message.text, settings["temperature"])
+            latency = time.monotonic() - started
         
         if response:
-            add_to_history(
+            await storage.add_to_history(
                 user_id=user_id,
                 model=settings["model"],
                 temperature=settings["temperature"],
                 prompt=message.text,
-                response=response
-            )
-            #used_words = response_data.get('used_words_count', 'N/A')
-            await processing_msg.edit_text(
-                f"📝 <b>Результат (креативность {settings['temperature']}):</b>\n\n{response}"
-                #f"📊 Использовано слов: {used_words}"
+                response=response,
+                latency=latency
             )
+            if STREAMING:
+                await reply.finish()
+            else:
+                #used_words = response_data.get('used_words_count', 'N/A')
+                await processing_msg.edit_text(
+                    f"{header}{response}"
+                    #f"📊 Использовано слов: {used_words}"
+                )
         else:
             await processing_msg.edit_text(
                 "❌ Не удалось получить ответ от сервиса.\n"
@@ -337,44 +514,51 @@ async def handle_text(message: Message):
                 "3. Повторить позже"
             )
             
+    except QueueFull:
+        await processing_msg.edit_text(
+            "😔 Сейчас слишком много запросов.\n"
+            "Попробуйте повторить через минуту."
+        )
     except Exception as e:
         logger.error(f"Error handling message: {str(e)}", exc_info=True)
         await message.answer("⚠️ Произошла критическая ошибка. Администратор уведомлен.")
 
-# ====== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ====== #
-def get_all_users():
-    """Получить список всех пользователей"""
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT DISTINCT user_id FROM user_settings")
-        return cursor.fetchall()
-
-def get_total_requests():
-    """Получить общее количество запросов"""
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM history")
-        return cursor.fetchone()[0]
-
 # ====== ЗАПУСК И ЗАВЕРШЕНИЕ ====== #
-async def on_startup():
+async def on_startup(worker_index: int = 0):
     """Действия при запуске"""
-    init_db()
+    await storage.init()
+    # При нескольких процессах фоновое обслуживание базы и прерванные
+    # рассылки ведёт только первый
+    if worker_index == 0:
+        retention.start()
+        rollups.start()
+        if await broadcaster.resume():
+            logger.info("Resumed unfinished broadcasts")
     logger.info("Database initialized")
     logger.info("Starting bot...")
 
 async def on_shutdown():
     """Действия при завершении"""
     await chad_api.close()
+    await broadcaster.close()
+    await retention.close()
+    await rollups.close()
+    await storage.close()
     logger.info("Bot shutdown complete")
 
+dp.startup.register(on_startup)
+dp.shutdown.register(on_shutdown)
+
 async def main():
     """Основная функция"""
-    await on_startup()
-    try:
+    if run_mode(UPDATES_MODE) == WEBHOOK:
+        server = WebhookServer(dp, bot, WEBHOOK_SECRET, queue_size=WEBHOOK_QUEUE_SIZE)
+        await server.run(WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_BASE_URL)
+    else:
         await dp.start_polling(bot)
-    finally:
-        await on_shutdown()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if WORKERS > 1:
+        asyncio.run(ShardSupervisor("bot_ChadAi", BOT_TOKEN, WORKERS, prepare=storage.migrate).run())
+    else:
+        asyncio.run(main())
@@ -0,0 +1,230 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import (TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError,
+                                TelegramRetryAfter, TelegramServerError)
+
+from metrics import metrics
+from storage import Storage
+
+logger = logging.getLogger(__name__)
+
+# Статусы рассылки
+RUNNING = "running"
+DONE = "done"
+CANCELLED = "cancelled"
+# Статусы получателя
+SENT = "sent"
+BLOCKED = "blocked"  # Бот заблокирован или пользователь удалён
+FAILED = "failed"
+
+
+class BroadcastProgress:
+    """Ход рассылки для отчёта: отправлено, ошибки, скорость и оставшееся время"""
+
+    def __init__(self, broadcast_id: int, sent: int, failed: int, remaining: int):
+        self.broadcast_id = broadcast_id
+        self.status = RUNNING
+        self.sent = sent
+        self.failed = failed
+        self.remaining = remaining
+        self.started_at = time.monotonic()
+        self.done_since_start = 0
+
+    @property
+    def total(self) -> int:
+        return self.sent + self.failed + self.remaining
+
+    def rate(self) -> float:
+        """Получателей в секунду с запуска (или возобновления) рассылки"""
+        elapsed = time.monotonic() - self.started_at
+        return self.done_since_start / elapsed if elapsed > 0 else 0.0
+
+    def eta(self) -> Optional[float]:
+        rate = self.rate()
+        return self.remaining / rate if rate > 0 else None
+
+    def add(self, sent: int, failed: int):
+        self.sent += sent
+        self.failed += failed
+        self.remaining = max(self.remaining - sent - failed, 0)
+        self.done_since_start += sent + failed
+
+
+def format_progress(progress: BroadcastProgress) -> str:
+    titles = {RUNNING: "📣 Рассылка идёт", DONE: "✅ Рассылка завершена", CANCELLED: "⛔ Рассылка остановлена"}
+    text = (
+        f"{titles[progress.status]} (#{progress.broadcast_id})\n\n"
+        f"• Отправлено: {progress.sent} из {progress.total}\n"
+        f"• Не доставлено: {progress.failed}\n"
+    )
+    if progress.status == RUNNING:
+        eta = progress.eta()
+        text += f"• Скорость: {progress.rate():.1f} сообщ./с"
+        text += f", осталось ~{eta / 60:.0f} мин" if eta is not None else ""
+    return text
+
+
+class Broadcaster:
+    """Рассылка сообщения всем пользователям бота.
+
+    Получатели читаются из базы порциями по batch_size в порядке user_id,
+    и сообщение копируется всем получателям порции одновременно. Скорость
+    и повторы после RetryAfter обеспечивает RateLimitMiddleware сессии бота,
+    здесь они не дублируются; в его очереди одновременно не больше
+    batch_size сообщений рассылки, так что ответы пользователям ждут
+    недолго. Сетевые ошибки и ошибки сервера Telegram повторяются до
+    max_retries раз, любая другая ошибка отмечает получателя как
+    недоставленного, не прерывая рассылку. Результаты порции и позиция в списке
+    сохраняются одной транзакцией, поэтому после перезапуска бота рассылка
+    продолжается с места остановки (если бот упал, повторно может уйти
+    не больше одной порции). Ход рассылки раз в progress_interval секунд
+    показывается в статусном сообщении админа.
+    """
+
+    def __init__(self, bot: Bot, storage: Storage, batch_size: int = 25,
+                 max_retries: int = 3, progress_interval: float = 5):
+        self.bot = bot
+        self.storage = storage
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.progress_interval = progress_interval
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._progress: Dict[int, BroadcastProgress] = {}
+        self._stopping = False
+
+    async def start(self, from_chat_id: int, message_id: int, status_chat_id: Optional[int] = None,
+                    status_message_id: Optional[int] = None) -> int:
+        """Начать рассылку, вернуть её id"""
+        broadcast_id = await self.storage.create_broadcast(from_chat_id, message_id, status_chat_id, status_message_id)
+        self._spawn(await self.storage.get_broadcast(broadcast_id))
+        return broadcast_id
+
+    async def resume(self) -> int:
+        """Продолжить рассылки, прерванные остановкой бота, вернуть их число"""
+        broadcasts = await self.storage.get_running_broadcasts()
+        for broadcast in broadcasts:
+            if broadcast[0] not in self._tasks:
+                self._spawn(broadcast)
+        return len(broadcasts)
+
+    async def cancel(self, broadcast_id: int) -> bool:
+        """Остановить рассылку без возможности продолжить"""
+        task = self._tasks.get(broadcast_id)
+        if task is None:
+            return False
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await self.storage.set_broadcast_status(broadcast_id, CANCELLED)
+        progress = self._progress.get(broadcast_id)
+        if progress is not None:
+            progress.status = CANCELLED
+        return True
+
+    async def progress(self, broadcast_id: Optional[int] = None) -> Optional[BroadcastProgress]:
+        """Ход рассылки по id (без id - последней) или None, если такой нет"""
+        broadcast = await self.storage.get_broadcast(broadcast_id)
+        if broadcast is None:
+            return None
+        progress = self._progress.get(broadcast[0])
+        if progress is not None:
+            return progress
+        # Рассылка шла в другом процессе или до перезапуска - только итоги из базы
+        broadcast_id, _, _, _, _, status, cursor, sent, failed = broadcast
+        remaining = await self.storage.count_broadcast_recipients(cursor) if status != DONE else 0
+        progress = BroadcastProgress(broadcast_id, sent, failed, remaining)
+        progress.status = status
+        return progress
+
+    def active(self) -> List[int]:
+        """id рассылок, идущих сейчас"""
+        return list(self._tasks)
+
+    async def close(self, timeout: float = 10):
+        """Остановить рассылки при остановке бота; в базе они остаются незавершёнными.
+
+        Текущая порция дописывается (не дольше timeout секунд), чтобы после
+        перезапуска её получатели не получили сообщение второй раз.
+        """
+        self._stopping = True
+        tasks = list(self._tasks.values())
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def _spawn(self, broadcast: Tuple):
+        task = asyncio.create_task(self._run(broadcast))
+        self._tasks[broadcast[0]] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast[0], None))
+
+    async def _run(self, broadcast: Tuple):
+        broadcast_id, from_chat_id, message_id, status_chat_id, status_message_id, _, cursor, sent, failed = broadcast
+        progress = BroadcastProgress(
+            broadcast_id, sent, failed, await self.storage.count_broadcast_recipients(cursor)
+        )
+        self._progress[broadcast_id] = progress
+        last_report = 0.0
+        try:
+            while not self._stopping:
+                recipients = await self.storage.get_broadcast_recipients(cursor, self.batch_size)
+                if not recipients:
+                    break
+                results = await asyncio.gather(*(
+                    self._send(user_id, from_chat_id, message_id) for user_id in recipients
+                ))
+                cursor = recipients[-1]
+                await self.storage.record_broadcast_batch(broadcast_id, cursor, results)
+                batch_sent = sum(1 for _, status, _ in results if status == SENT)
+                progress.add(batch_sent, len(results) - batch_sent)
+                metrics.inc("broadcast_sent", batch_sent)
+                metrics.inc("broadcast_failed", len(results) - batch_sent)
+                if time.monotonic() - last_report >= self.progress_interval:
+                    last_report = time.monotonic()
+                    await self._report(progress, status_chat_id, status_message_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Статус остаётся running: рассылка продолжится после перезапуска
+            logger.error(f"Broadcast {broadcast_id} failed: {e}", exc_info=True)
+            return
+        if self._stopping:
+            logger.info(f"Broadcast {broadcast_id} paused at user {cursor}")
+            return
+        await self.storage.set_broadcast_status(broadcast_id, DONE)
+        progress.status = DONE
+        await self._report(progress, status_chat_id, status_message_id)
+        logger.info(f"Broadcast {broadcast_id} done: {progress.sent} sent, {progress.failed} failed")
+
+    async def _report(self, progress: BroadcastProgress, chat_id: Optional[int], message_id: Optional[int]):
+        if chat_id is None or message_id is None:
+            return
+        try:
+            await self.bot.edit_message_text(format_progress(progress), chat_id=chat_id, message_id=message_id)
+        except (TelegramBadRequest, TelegramRetryAfter, TelegramNetworkError):
+            pass
+
+    async def _send(self, user_id: int, from_chat_id: int, message_id: int) -> Tuple[int, str, Optional[str]]:
+        """(user_id, статус, ошибка) после отправки одному получателю"""
+        error = None
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self.bot.copy_message(user_id, from_chat_id, message_id)
+                return user_id, SENT, None
+            except TelegramForbiddenError as e:
+                return user_id, BLOCKED, e.message
+            except (TelegramBadRequest, TelegramRetryAfter) as e:
+                # RetryAfter сюда доходит, только когда middleware уже исчерпал свои повторы
+                return user_id, FAILED, e.message
+            except (TelegramNetworkError, TelegramServerError) as e:
+                error = str(e)
+                await asyncio.sleep(2 ** attempt)
+            except Exception as e:
+                # Одна неожиданная ошибка не должна прерывать всю порцию
+                logger.error(f"Broadcast to {user_id} failed: {e!r}", exc_info=True)
+                return user_id, FAILED, repr(e)
+        return user_id, FAILED, error
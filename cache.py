@@ -0,0 +1,166 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+
+class LRUCache:
+    """Ограниченный по размеру кэш с вытеснением давно не использованных ключей"""
+
+    def __init__(self, maxsize: int = 10000):
+        if maxsize <= 0:
+            raise ValueError("maxsize must be positive")
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        """Получить значение и отметить ключ как недавно использованный"""
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        """Записать значение, вытеснив самый старый ключ при переполнении"""
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        return self._data.pop(key, default)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Счётчики попаданий и промахов"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+
+class ResponseCache:
+    """Кэш ответов LLM: prompt + модель + температура -> ответ.
+
+    Два уровня: LRU в памяти и таблица response_cache в SQLite (через Storage).
+    Записи живут ttl секунд, общий размер таблицы ограничен max_bytes -
+    при превышении удаляются давно не запрошенные ответы. Время последнего
+    обращения копится в памяти и пишется в таблицу пачками по touch_batch_size
+    (и перед вытеснением), а не отдельной транзакцией на каждое попадание.
+    Запросы с температурой выше max_temperature не кэшируются.
+    """
+
+    def __init__(self, storage, memory_size: int = 1000, ttl: float = 24 * 3600,
+                 max_bytes: int = 50 * 1024 * 1024, max_temperature: Optional[float] = None,
+                 touch_batch_size: int = 100):
+        self.storage = storage
+        self.memory = LRUCache(memory_size)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_temperature = max_temperature
+        self.touch_batch_size = touch_batch_size
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self._bytes: Optional[int] = None
+        self._touched: Dict[str, float] = {}
+
+    @staticmethod
+    def make_key(prompt: str, model: str, temperature: float) -> str:
+        """Ключ кэша: нормализованный запрос, модель и температура"""
+        normalized = " ".join(prompt.lower().split())
+        return hashlib.sha256(f"{model}\n{round(temperature, 1)}\n{normalized}".encode()).hexdigest()
+
+    def cacheable(self, temperature: float) -> bool:
+        return self.max_temperature is None or temperature <= self.max_temperature
+
+    async def get(self, prompt: str, model: str, temperature: float) -> Optional[str]:
+        """Ответ из кэша или None"""
+        if not self.cacheable(temperature):
+            return None
+        key = self.make_key(prompt, model, temperature)
+        now = time.time()
+
+        entry = self.memory.get(key)
+        if entry is None:
+            entry = await self.storage.get_cached_response(key)
+            if entry is not None:
+                self.memory.set(key, entry)
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        response, created_at, latency = entry
+        if now - created_at > self.ttl:
+            self.memory.pop(key)
+            self._touched.pop(key, None)
+            await self.storage.delete_cached_response(key)
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.saved_seconds += latency
+        self._touched[key] = now
+        if len(self._touched) >= self.touch_batch_size:
+            await self.flush_access_times()
+        return response
+
+    async def flush_access_times(self):
+        """Записать накопленное время последнего обращения к ответам"""
+        if not self._touched:
+            return
+        touched, self._touched = self._touched, {}
+        await self.storage.touch_cached_responses([(at, key) for key, at in touched.items()])
+
+    async def set(self, prompt: str, model: str, temperature: float, response: str, latency: float):
+        """Сохранить ответ и время, которое ушло на его генерацию"""
+        if not self.cacheable(temperature):
+            return
+        key = self.make_key(prompt, model, temperature)
+        now = time.time()
+        size = len(response.encode())
+
+        self.memory.set(key, (response, now, latency))
+        self._touched.pop(key, None)
+        # Перезапись того же ключа меняет размер только на разницу
+        delta = await self.storage.put_cached_response(key, response, size, latency, now)
+
+        if self._bytes is None:
+            self._bytes = await self.storage.get_cached_responses_size()
+        else:
+            self._bytes += delta
+        if self._bytes > self.max_bytes:
+            # Вытесняем по свежим временам обращения
+            await self.flush_access_times()
+            # Освобождаем с запасом, чтобы не чистить таблицу на каждой записи
+            self._bytes = await self.storage.evict_cached_responses(now - self.ttl, int(self.max_bytes * 0.9))
+
+    def stats(self) -> Dict[str, Any]:
+        """Доля попаданий и сэкономленное время"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "saved_seconds": self.saved_seconds,
+            "bytes": self._bytes,
+        }
@@ -0,0 +1,112 @@
+import html
+from bisect import bisect_right
+from typing import List, Optional, Tuple
+
+from aiogram.types import InlineKeyboardMarkup
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+from cache import LRUCache
+from database import Database
+
+CATALOG_PREFIX = "catalog_"
+PRODUCT_PREFIX = "product_"
+
+
+class Catalog:
+    """Кэшированный каталог товаров поверх Database.
+
+    Снимок каталога - список id первого товара каждой страницы - строится
+    одним запросом при первом обращении. Страница читается по ключу
+    (id >= начала страницы), поэтому стоит одинаково при любом номере.
+    Готовые текст и клавиатура страниц и карточки товаров хранятся в
+    LRU-кэшах. add_product сбрасывает снимок и кэши, они перестраиваются
+    при следующем обращении.
+    """
+
+    def __init__(self, db: Database, page_size: int = 10, cache_size: int = 1000):
+        self.db = db
+        self.page_size = page_size
+        self._page_starts: Optional[List[int]] = None
+        self._pages = LRUCache(cache_size)
+        self._products = LRUCache(cache_size)
+
+    def invalidate(self):
+        """Сбросить снимок каталога после изменения товаров"""
+        self._page_starts = None
+        self._pages.clear()
+        self._products.clear()
+
+    def forget(self, product_id: int):
+        """Сбросить карточку одного товара, например после загрузки его фото"""
+        self._products.pop(product_id)
+
+    def _starts(self) -> List[int]:
+        if self._page_starts is None:
+            self._page_starts = self.db.get_page_start_ids(self.page_size)
+        return self._page_starts
+
+    def page_count(self) -> int:
+        return len(self._starts())
+
+    def page_of(self, product_id: int) -> int:
+        """Номер страницы, на которой находится товар"""
+        return max(0, bisect_right(self._starts(), product_id) - 1)
+
+    def page(self, number: int) -> Tuple[str, InlineKeyboardMarkup]:
+        """Текст и клавиатура страницы каталога"""
+        starts = self._starts()
+        number = min(max(number, 0), max(len(starts) - 1, 0))
+        cached = self._pages.get(number)
+        if cached is not None:
+            return cached
+
+        builder = InlineKeyboardBuilder()
+        if not starts:
+            page = ("📦 Каталог пока пуст", builder.as_markup())
+            self._pages.set(number, page)
+            return page
+
+        for product_id, name, price in self.db.get_products_page(starts[number], self.page_size):
+            builder.button(text=f"{name} - {price}₽", callback_data=f"{PRODUCT_PREFIX}{product_id}")
+        builder.adjust(1)
+        navigation = InlineKeyboardBuilder()
+        if number > 0:
+            navigation.button(text="◀️", callback_data=f"{CATALOG_PREFIX}{number - 1}")
+        if number < len(starts) - 1:
+            navigation.button(text="▶️", callback_data=f"{CATALOG_PREFIX}{number + 1}")
+        builder.attach(navigation)
+
+        page = (f"📦 Каталог товаров (стр. {number + 1}/{len(starts)}):", builder.as_markup())
+        self._pages.set(number, page)
+        return page
+
+    def product(self, product_id: int) -> Optional[Tuple[str, Optional[str], InlineKeyboardMarkup]]:
+        """Карточка товара: (текст, фото, клавиатура) или None, если товара нет.
+
+        Фото - file_id Telegram, если оно уже загружалось, иначе исходное значение.
+        """
+        cached = self._products.get(product_id)
+        if cached is not None:
+            return cached
+        row = self.db.get_product(product_id)
+        if row is None:
+            return None
+
+        _, name, description, price, photo, photo_file_id = row
+        builder = InlineKeyboardBuilder()
+        builder.button(text="➕ Добавить в корзину", callback_data=f"add_{product_id}")
+        builder.button(text="🔙 Назад", callback_data=f"{CATALOG_PREFIX}{self.page_of(product_id)}")
+        builder.adjust(1)
+        text = (
+            f"<b>{html.escape(name)}</b>\n\n{html.escape(description or '')}\n\n"
+            f"💰 Цена: <b>{price}₽</b>"
+        )
+        card = (text, photo_file_id or photo, builder.as_markup())
+        self._products.set(product_id, card)
+        return card
+
+    def add_product(self, name: str, description: str, price: int, photo: Optional[str]) -> int:
+        """Добавить товар и сбросить кэш каталога"""
+        product_id = self.db.add_product(name, description, price, photo)
+        self.invalidate()
+        return product_id
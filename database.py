@@ -1,7 +1,50 @@
 import sqlite3
 
+# Версия схемы хранится в PRAGMA user_version, миграция N переводит базу
+# с версии N - 1 на N. Новые миграции добавляются в конец списка.
+MIGRATIONS = [
+    # 1: корзина - одна строка на товар с количеством вместо строки на каждое нажатие
+    [
+        """
+        CREATE TABLE cart_new (
+            user_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 1 CHECK (quantity > 0),
+            PRIMARY KEY (user_id, product_id),
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (product_id) REFERENCES products (id)
+        ) WITHOUT ROWID
+        """,
+        """
+        INSERT INTO cart_new (user_id, product_id, quantity)
+        SELECT user_id, product_id, COUNT(*) FROM cart
+        WHERE user_id IS NOT NULL AND product_id IS NOT NULL
+        GROUP BY user_id, product_id
+        """,
+        "DROP TABLE cart",
+        "ALTER TABLE cart_new RENAME TO cart",
+    ],
+    # 2: артикул поставщика - по нему импорт обновляет уже загруженные товары
+    [
+        "ALTER TABLE products ADD COLUMN sku TEXT",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_products_sku ON products (sku)",
+    ],
+    # 3: file_id фото в Telegram после первой загрузки - дальше фото отправляется по нему
+    [
+        "ALTER TABLE products ADD COLUMN photo_file_id TEXT",
+        """
+        CREATE INDEX IF NOT EXISTS idx_products_photo_upload ON products (id)
+        WHERE photo IS NOT NULL AND photo_file_id IS NULL
+        """,
+    ],
+]
+
+# Строка товара для карточки и поиска
+PRODUCT_COLUMNS = "id, name, description, price, photo, photo_file_id"
+
 class Database:
     def __init__(self, db_file):
+        self.db_file = db_file
         self.connection = sqlite3.connect(db_file)
         self.cursor = self.connection.cursor()
         self._init_db()
@@ -35,6 +78,26 @@ class Database:
         )
         """)
         self.connection.commit()
+        self._migrate()
+
+    def _migrate(self):
+        # Шаг миграции и новая версия схемы - одна явная транзакция: with
+        # self.connection не откатывает DDL, и после сбоя посреди шага база
+        # осталась бы без версии, но с частью изменений
+        while True:
+            self.cursor.execute("BEGIN IMMEDIATE")
+            try:
+                version = self.cursor.execute("PRAGMA user_version").fetchone()[0]
+                if version >= len(MIGRATIONS):
+                    self.connection.rollback()
+                    return
+                for statement in MIGRATIONS[version]:
+                    self.cursor.execute(statement)
+                self.cursor.execute(f"PRAGMA user_version = {version + 1}")
+            except BaseException:
+                self.connection.rollback()
+                raise
+            self.connection.commit()
 
     def user_exists(self, user_id):
         self.cursor.execute("SELECT id FROM users WHERE id = ?", (user_id,))
@@ -50,28 +113,117 @@ class Database:
         VALUES (?, ?, ?, ?)
         """, (name, description, price, photo))
         self.connection.commit()
+        return self.cursor.lastrowid
 
     def get_products(self):
-        self.cursor.execute("SELECT * FROM products")
+        # Колонки перечислены явно: миграции добавляют новые, порядок SELECT * меняется
+        self.cursor.execute(f"SELECT {PRODUCT_COLUMNS} FROM products")
+        return self.cursor.fetchall()
+
+    def upsert_products(self, products):
+        # products: [(sku, name, description, price, photo)], одной транзакцией.
+        # Товар с известным артикулом обновляется, без артикула - всегда добавляется.
+        with self.connection:
+            self.cursor.executemany("""
+            INSERT INTO products (sku, name, description, price, photo)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (sku) DO UPDATE SET
+                name = excluded.name,
+                description = excluded.description,
+                price = excluded.price,
+                photo = COALESCE(excluded.photo, photo),
+                photo_file_id = CASE WHEN excluded.photo IS NOT photo
+                    AND excluded.photo IS NOT NULL THEN NULL ELSE photo_file_id END
+            """, products)
+        return len(products)
+
+    def get_products_to_upload(self, after_id, limit):
+        # Товары с фото, ещё не загруженным в Telegram
+        self.cursor.execute("""
+        SELECT id, photo FROM products
+        WHERE id > ? AND photo IS NOT NULL AND photo_file_id IS NULL
+        ORDER BY id LIMIT ?
+        """, (after_id, limit))
+        return self.cursor.fetchall()
+
+    def set_photo_file_id(self, product_id, file_id):
+        self.cursor.execute("UPDATE products SET photo_file_id = ? WHERE id = ?", (file_id, product_id))
+        self.connection.commit()
+
+    def get_page_start_ids(self, page_size):
+        # id первого товара каждой страницы: по ним страницы читаются по ключу, без OFFSET.
+        # Каждый page_size-й id отбирает сама база, в память попадают только они
+        self.cursor.execute("""
+        SELECT id FROM (SELECT id, ROW_NUMBER() OVER (ORDER BY id) AS number FROM products)
+        WHERE (number - 1) % ? = 0
+        ORDER BY id
+        """, (page_size,))
+        return [row[0] for row in self.cursor.fetchall()]
+
+    def get_products_page(self, start_id, limit):
+        # Для списка нужны только название и цена, описание и фото не читаем
+        self.cursor.execute(
+            "SELECT id, name, price FROM products WHERE id >= ? ORDER BY id LIMIT ?",
+            (start_id, limit)
+        )
         return self.cursor.fetchall()
 
     def get_product(self, product_id):
-        self.cursor.execute("SELECT * FROM products WHERE id = ?", (product_id,))
+        self.cursor.execute(f"SELECT {PRODUCT_COLUMNS} FROM products WHERE id = ?", (product_id,))
         return self.cursor.fetchone()
 
-    def add_to_cart(self, user_id, product_id):
-        self.cursor.execute("INSERT INTO cart (user_id, product_id) VALUES (?, ?)", (user_id, product_id))
-        self.connection.commit()
+    def add_to_cart(self, user_id, product_id, quantity=1):
+        self.add_many_to_cart(user_id, [(product_id, quantity)])
+
+    def add_many_to_cart(self, user_id, items):
+        # items: [(product_id, quantity)], всё одной транзакцией
+        with self.connection:
+            self.cursor.executemany("""
+            INSERT INTO cart (user_id, product_id, quantity) VALUES (?, ?, ?)
+            ON CONFLICT (user_id, product_id) DO UPDATE SET quantity = quantity + excluded.quantity
+            """, [(user_id, product_id, quantity) for product_id, quantity in items])
+
+    def remove_from_cart(self, user_id, product_id, quantity=None):
+        # quantity=None - убрать товар целиком
+        self.remove_many_from_cart(user_id, [(product_id, quantity)])
+
+    def remove_many_from_cart(self, user_id, items):
+        # items: [(product_id, quantity или None)], всё одной транзакцией
+        with self.connection:
+            self.cursor.executemany(
+                "DELETE FROM cart WHERE user_id = ? AND product_id = ?",
+                [(user_id, product_id) for product_id, quantity in items if quantity is None]
+            )
+            # Уменьшение до нуля и ниже убирает товар, остальные уменьшаем
+            self.cursor.executemany(
+                "DELETE FROM cart WHERE user_id = ? AND product_id = ? AND quantity <= ?",
+                [(user_id, product_id, quantity) for product_id, quantity in items if quantity is not None]
+            )
+            self.cursor.executemany(
+                "UPDATE cart SET quantity = quantity - ? WHERE user_id = ? AND product_id = ?",
+                [(quantity, user_id, product_id) for product_id, quantity in items if quantity is not None]
+            )
 
     def get_cart(self, user_id):
         self.cursor.execute("""
-        SELECT p.id, p.name, p.description, p.price 
-        FROM cart c 
-        JOIN products p ON c.product_id = p.id 
+        SELECT p.id, p.name, p.description, p.price, c.quantity
+        FROM cart c
+        JOIN products p ON c.product_id = p.id
         WHERE c.user_id = ?
+        ORDER BY p.id
         """, (user_id,))
         return self.cursor.fetchall()
 
+    def get_cart_total(self, user_id):
+        # (количество единиц, сумма) считаем в SQL, не загружая корзину
+        self.cursor.execute("""
+        SELECT COALESCE(SUM(c.quantity), 0), COALESCE(SUM(c.quantity * p.price), 0)
+        FROM cart c
+        JOIN products p ON c.product_id = p.id
+        WHERE c.user_id = ?
+        """, (user_id,))
+        return self.cursor.fetchone()
+
     def clear_cart(self, user_id):
         self.cursor.execute("DELETE FROM cart WHERE user_id = ?", (user_id,))
         self.connection.commit()
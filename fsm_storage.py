@@ -0,0 +1,189 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+SQL_CREATE_FSM = """
+CREATE TABLE IF NOT EXISTS fsm_state (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+SQL_SELECT_FSM = "SELECT state, data, updated_at FROM fsm_state WHERE key = ?"
+SQL_UPSERT_FSM = "INSERT OR REPLACE INTO fsm_state (key, state, data, updated_at) VALUES (?, ?, ?, ?)"
+SQL_DELETE_FSM = "DELETE FROM fsm_state WHERE key = ?"
+SQL_DELETE_EXPIRED_FSM = "DELETE FROM fsm_state WHERE updated_at < ?"
+
+# (state, data, data в JSON, updated_at)
+_Record = Tuple[Optional[str], Dict[str, Any], str, float]
+_EMPTY: _Record = (None, {}, "{}", 0.0)
+
+
+class SQLiteStorage(BaseStorage):
+    """Хранилище FSM в SQLite вместо MemoryStorage.
+
+    Чтение идёт из LRU-кэша в памяти, в базу обращаемся только при промахе.
+    Изменения сразу попадают в кэш, а на диск пишутся фоном: первое
+    изменение будит запись, и через flush_interval секунд всё накопленное
+    пишется одной транзакцией - несколько изменений ключа дают одну запись.
+    Пока изменений нет, фоновая задача спит. Ключ считается записанным
+    только после успешной транзакции, так что ошибка или отмена записи
+    ничего не теряют. Состояния, не менявшиеся дольше ttl секунд, считаются
+    брошенными и удаляются при очередной записи.
+
+    Кэш у каждого процесса свой, поэтому при нескольких процессах все
+    обновления пользователя должны попадать в один процесс (см. sharding).
+    """
+
+    def __init__(self, db_name: str, ttl: Optional[float] = 24 * 3600, flush_interval: float = 0.5,
+                 cache_size: int = 10000):
+        self.db_name = db_name
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self._cache = LRUCache(cache_size)
+        self._dirty: Dict[str, _Record] = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm_storage")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+        self._last_purge = 0.0
+
+    # ====== СЛУЖЕБНОЕ ====== #
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_name, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("PRAGMA busy_timeout=5000")
+            self._conn.execute(SQL_CREATE_FSM)
+            self._conn.commit()
+        return self._conn
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return ":".join(str(part) for part in (
+            key.bot_id, key.chat_id, key.user_id, key.thread_id,
+            getattr(key, "business_connection_id", None), key.destiny
+        ))
+
+    def _select(self, key: str) -> Optional[Tuple]:
+        return self._connection().execute(SQL_SELECT_FSM, (key,)).fetchone()
+
+    def _write(self, records: List[Tuple[str, _Record]], expired_before: Optional[float]):
+        conn = self._connection()
+        with conn:
+            conn.executemany(SQL_UPSERT_FSM, [
+                (key, state, data_json, updated_at)
+                for key, (state, _, data_json, updated_at) in records
+                if state is not None or data_json != "{}"
+            ])
+            conn.executemany(SQL_DELETE_FSM, [
+                (key,) for key, (state, _, data_json, _) in records
+                if state is None and data_json == "{}"
+            ])
+            if expired_before is not None:
+                conn.execute(SQL_DELETE_EXPIRED_FSM, (expired_before,))
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _expired(self, record: _Record) -> bool:
+        return self.ttl is not None and record[3] and time.time() - record[3] > self.ttl
+
+    async def _load(self, key: str) -> _Record:
+        record = self._dirty.get(key) or self._cache.get(key)
+        if record is None:
+            row = await self._run(self._select, key)
+            # Пока шёл запрос, ключ могли изменить - свежая версия важнее
+            record = self._dirty.get(key) or self._cache.get(key)
+            if record is None:
+                record = (row[0], json.loads(row[1]), row[1], row[2]) if row else _EMPTY
+                self._cache.set(key, record)
+        if self._expired(record):
+            return _EMPTY
+        return record
+
+    def _store(self, key: str, state: Optional[str], data: Dict[str, Any], data_json: str):
+        record = (state, data, data_json, time.time())
+        self._cache.set(key, record)
+        self._dirty[key] = record
+        self._changed.set()
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await self._changed.wait()
+            # Даём изменениям накопиться, чтобы записать их одной транзакцией
+            await asyncio.sleep(self.flush_interval)
+            self._changed.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"FSM storage flush failed: {e}", exc_info=True)
+                # Незаписанное осталось в _dirty, повторим через flush_interval
+                self._changed.set()
+
+    async def flush(self):
+        """Записать накопленные изменения и удалить брошенные состояния"""
+        expired_before = None
+        if self.ttl is not None and time.time() - self._last_purge >= min(self.ttl, 3600):
+            self._last_purge = time.time()
+            expired_before = self._last_purge - self.ttl
+        if not self._dirty and expired_before is None:
+            return
+        records = list(self._dirty.items())
+        await self._run(self._write, records, expired_before)
+        # Снимаем отметку, только если ключ не изменили, пока шла запись
+        for key, record in records:
+            if self._dirty.get(key) is record:
+                del self._dirty[key]
+
+    # ====== BaseStorage ====== #
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        name = self._key(key)
+        record = await self._load(name)
+        self._store(name, state.state if isinstance(state, State) else state, record[1], record[2])
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._load(self._key(key)))[0]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        name = self._key(key)
+        record = await self._load(name)
+        data = dict(data)
+        # Сериализуем сразу: несохраняемые данные должны падать в обработчике, а не при записи
+        self._store(name, record[0], data, json.dumps(data, ensure_ascii=False))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return dict((await self._load(self._key(key)))[1])
+
+    async def close(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+        await self._run(self._close)
+        self._executor.shutdown(wait=True)
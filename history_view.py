@@ -0,0 +1,155 @@
+import hashlib
+import html
+import logging
+from typing import List, Optional, Tuple
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, Message
+
+from streaming import MESSAGE_LIMIT, split_html
+
+# callback_data кнопок истории: hist:<действие>:<id записи>
+HISTORY_PREFIX = "hist"
+OLDER = "o"
+NEWER = "n"
+FULL = "f"
+PREVIEW_LENGTH = 50
+# callback_data кнопок поиска: srch:<смещение>:<ключ запроса>. Сам запрос
+# в 64 байта callback_data не помещается и хранится в кэше процесса по ключу.
+SEARCH_PREFIX = "srch"
+# Фрагмент FTS5 ограничен числом слов, а не символов: одно «слово» может
+# быть ссылкой или кодом без пробелов, поэтому режем ещё и по длине
+SNIPPET_LENGTH = 300
+
+logger = logging.getLogger(__name__)
+
+
+def history_callback(action: str, entry_id: int) -> str:
+    return f"{HISTORY_PREFIX}:{action}:{entry_id}"
+
+
+def parse_history_callback(data: str) -> Optional[Tuple[str, int]]:
+    """(действие, id) из callback_data или None, если данные испорчены"""
+    try:
+        _, action, entry_id = data.split(":")
+        return action, int(entry_id)
+    except ValueError:
+        return None
+
+
+def format_history_page(rows: List[Tuple]) -> str:
+    """Текст страницы истории из строк Storage.get_history_page"""
+    text = "📜 <b>Ваши запросы:</b>\n\n"
+    for i, (_, timestamp, model, temp, prompt, response_length) in enumerate(rows, 1):
+        preview = html.escape(prompt[:PREVIEW_LENGTH]) + ("..." if len(prompt) > PREVIEW_LENGTH else "")
+        text += (
+            f"{i}. <i>{timestamp}</i>\n"
+            f"• Модель: <b>{model.upper()}</b>\n"
+            f"• Креативность: <b>{temp}</b>\n"
+            f"• Запрос: <i>{preview}</i>\n"
+            f"• Ответ: {response_length} символов\n\n"
+        )
+    return text
+
+
+def history_page_keyboard(rows: List[Tuple], has_newer: bool, has_older: bool) -> InlineKeyboardMarkup:
+    """Кнопки «полный ответ» для каждой записи и навигация ◀️ / ▶️ по курсорам"""
+    keyboard = [
+        [InlineKeyboardButton(text=f"📄 Полный ответ #{i}", callback_data=history_callback(FULL, row[0]))]
+        for i, row in enumerate(rows, 1)
+    ]
+    navigation = []
+    if has_newer:
+        navigation.append(InlineKeyboardButton(text="◀️ Новее", callback_data=history_callback(NEWER, rows[0][0])))
+    if has_older:
+        navigation.append(InlineKeyboardButton(text="Старше ▶️", callback_data=history_callback(OLDER, rows[-1][0])))
+    if navigation:
+        keyboard.append(navigation)
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+
+def format_history_entry(entry: Tuple, escape: bool = False) -> List[str]:
+    """Запись истории целиком, разбитая на сообщения не длиннее лимита Telegram.
+
+    Ответ модели вставляется как HTML; с escape=True - как обычный текст.
+    """
+    _, timestamp, model, temp, prompt, response = entry
+    header = (
+        f"🕓 <i>{timestamp}</i> • <b>{model.upper()}</b> • креативность <b>{temp}</b>\n"
+        f"❓ <i>{html.escape(prompt)}</i>\n\n"
+    )
+    if escape:
+        response = html.escape(response)
+    return split_html(header + response, MESSAGE_LIMIT)
+
+
+async def send_history_entry(message: Message, entry: Tuple):
+    """Отправить запись истории целиком.
+
+    Если Telegram не принимает ответ модели как HTML (одиночный "<" или "&"),
+    запись отправляется заново с ответом обычным текстом.
+    """
+    try:
+        for part in format_history_entry(entry):
+            await message.answer(part)
+    except TelegramBadRequest as e:
+        logger.warning(f"History entry rejected as HTML, sending plain text: {e}")
+        for part in format_history_entry(entry, escape=True):
+            await message.answer(part)
+
+
+def search_key(query: str) -> str:
+    return hashlib.sha1(query.encode("utf-8")).hexdigest()[:16]
+
+
+def search_callback(offset: int, key: str) -> str:
+    return f"{SEARCH_PREFIX}:{offset}:{key}"
+
+
+def parse_search_callback(data: str) -> Optional[Tuple[int, str]]:
+    """(смещение, ключ запроса) из callback_data или None"""
+    try:
+        _, offset, key = data.split(":")
+        return int(offset), key
+    except ValueError:
+        return None
+
+
+def _highlighted(text: str, limit: int = SNIPPET_LENGTH) -> str:
+    # Найденные слова размечены управляющими символами, остальное экранируем.
+    # Режем до экранирования, чтобы не разорвать сущность, и закрываем выделение
+    if len(text) > limit:
+        text = text[:limit].rstrip() + "…"
+        if text.count("\x02") > text.count("\x03"):
+            text += "\x03"
+    return html.escape(text).replace("\x02", "<b>").replace("\x03", "</b>")
+
+
+def format_search_results(query: str, rows: List[Tuple], offset: int) -> str:
+    """Текст страницы результатов Storage.search_history"""
+    text = f"🔎 <b>Поиск:</b> <i>{html.escape(query[:SNIPPET_LENGTH])}</i>\n\n"
+    for i, (_, timestamp, model, prompt, snippet) in enumerate(rows, offset + 1):
+        text += (
+            f"{i}. <i>{timestamp}</i> • <b>{model.upper()}</b>\n"
+            f"❓ {_highlighted(prompt)}\n"
+            f"💬 {_highlighted(snippet)}\n\n"
+        )
+    return text
+
+
+def search_keyboard(rows: List[Tuple], key: str, offset: int, page_size: int,
+                    has_more: bool) -> InlineKeyboardMarkup:
+    """Кнопки «полный ответ» и навигация по страницам результатов"""
+    keyboard = [
+        [InlineKeyboardButton(text=f"📄 Полный ответ #{i}", callback_data=history_callback(FULL, row[0]))]
+        for i, row in enumerate(rows, offset + 1)
+    ]
+    navigation = []
+    if offset > 0:
+        navigation.append(InlineKeyboardButton(
+            text="◀️ Назад", callback_data=search_callback(max(0, offset - page_size), key)))
+    if has_more:
+        navigation.append(InlineKeyboardButton(text="Далее ▶️", callback_data=search_callback(offset + page_size, key)))
+    if navigation:
+        keyboard.append(navigation)
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
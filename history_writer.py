@@ -0,0 +1,114 @@
+import asyncio
+import logging
+from collections import defaultdict, deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (user_id, timestamp, model, temperature, prompt, response, latency)
+HistoryRow = Tuple[int, str, str, float, str, str, Optional[float]]
+
+
+class HistoryWriter:
+    """Фоновая запись истории пачками.
+
+    Строки складываются в очередь, одна фоновая задача забирает их пачками
+    и записывает одной транзакцией. Пачка сбрасывается, когда набралось
+    batch_size строк или прошло flush_interval секунд с первой строки.
+    Если запись пачки упала (например, база занята), она повторяется
+    с нарастающей паузой до retries раз, и только потом строки теряются.
+    Ещё не записанные строки доступны через pending(), чтобы пользователь
+    сразу видел свои запросы в истории.
+    """
+
+    def __init__(self, write_batch: Callable[[List[HistoryRow]], Awaitable[None]],
+                 batch_size: int = 100, flush_interval: float = 0.5,
+                 retries: int = 5, retry_delay: float = 0.5, max_retry_delay: float = 10.0):
+        self._write_batch = write_batch
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._queue: "asyncio.Queue[HistoryRow]" = asyncio.Queue()
+        self._full = asyncio.Event()
+        self._pending: Dict[int, Deque[HistoryRow]] = defaultdict(deque)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Запустить фоновую задачу записи"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Записать всё, что осталось в очереди, и остановить задачу"""
+        if self._task is None:
+            return
+        await self.flush()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def flush(self):
+        """Дождаться записи всех поставленных в очередь строк"""
+        self._full.set()
+        await self._queue.join()
+
+    def add(self, row: HistoryRow):
+        """Поставить строку в очередь на запись"""
+        self._pending[row[0]].append(row)
+        self._queue.put_nowait(row)
+        if self._queue.qsize() >= self.batch_size:
+            self._full.set()
+
+    def pending(self, user_id: int) -> List[HistoryRow]:
+        """Ещё не записанные строки пользователя, от старых к новым"""
+        return list(self._pending.get(user_id, ()))
+
+    def pending_count(self) -> int:
+        return sum(len(rows) for rows in self._pending.values())
+
+    async def _run(self):
+        while True:
+            first = await self._queue.get()
+            if self._queue.qsize() + 1 < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+            # Сбрасываем сигнал до того, как забрать строки: flush() или add(),
+            # пришедшие во время сбора пачки, уже попадут в неё, а пришедшие
+            # после - останутся взведёнными для следующей пачки
+            self._full.clear()
+            batch = [first]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            try:
+                await self._write_with_retries(batch)
+            finally:
+                for row in batch:
+                    rows = self._pending[row[0]]
+                    rows.popleft()
+                    if not rows:
+                        del self._pending[row[0]]
+                    self._queue.task_done()
+
+    async def _write_with_retries(self, batch: List[HistoryRow]):
+        """Записать пачку, повторяя с нарастающей паузой при ошибках"""
+        delay = self.retry_delay
+        for attempt in range(self.retries + 1):
+            try:
+                await self._write_batch(batch)
+                return
+            except Exception as e:
+                if attempt == self.retries:
+                    logger.error(f"History write failed, dropping {len(batch)} rows: {e}", exc_info=True)
+                    return
+                logger.warning(f"History write error ({len(batch)} rows), retry in {delay:.1f}s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_retry_delay)
@@ -0,0 +1,116 @@
+import json
+import logging
+from typing import Any, AsyncIterator, Dict, Optional
+from urllib.parse import urlparse
+
+import aiohttp
+
+from resilience import ResiliencePolicy
+
+logger = logging.getLogger(__name__)
+
+
+class APIClient:
+    """Общий HTTP-клиент для LLM-провайдеров.
+
+    На каждого провайдера (хост) заводится своя сессия со своим пулом
+    соединений, поэтому медленный провайдер не занимает соединения
+    остальных. Соединения переиспользуются (keep-alive), DNS кэшируется,
+    таймауты на подключение и на чтение задаются отдельно.
+    Если передана policy, запросы идут через неё (повторы, предохранители).
+    """
+
+    def __init__(self, connect_timeout: float = 5, read_timeout: float = 30,
+                 limit_per_provider: int = 20, keepalive_timeout: float = 60,
+                 dns_ttl: int = 300, policy: Optional[ResiliencePolicy] = None):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.limit_per_provider = limit_per_provider
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_ttl = dns_ttl
+        self.policy = policy
+        self._sessions: Dict[str, aiohttp.ClientSession] = {}
+
+    @staticmethod
+    def provider_for(url: str) -> str:
+        """Имя провайдера по URL запроса"""
+        return urlparse(url).netloc
+
+    def session(self, provider: str) -> aiohttp.ClientSession:
+        """Сессия провайдера, создаётся при первом обращении"""
+        session = self._sessions.get(provider)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit_per_provider,
+                keepalive_timeout=self.keepalive_timeout,
+                use_dns_cache=True,
+                ttl_dns_cache=self.dns_ttl
+            )
+            session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(
+                    total=None,
+                    connect=self.connect_timeout,
+                    sock_read=self.read_timeout
+                )
+            )
+            self._sessions[provider] = session
+        return session
+
+    async def post_json(self, url: str, payload: Dict[str, Any],
+                        headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        """POST с JSON-телом, возвращает разобранный JSON ответа.
+
+        При статусе ответа >= 400 выбрасывает aiohttp.ClientResponseError,
+        при разомкнутом предохранителе - resilience.CircuitOpen.
+        """
+        if self.policy:
+            return await self.policy.call(url, lambda: self._post_json(url, payload, headers))
+        return await self._post_json(url, payload, headers)
+
+    async def stream_sse(self, url: str, payload: Dict[str, Any],
+                         headers: Optional[Dict[str, str]] = None) -> AsyncIterator[Dict[str, Any]]:
+        """POST с потоковым ответом (server-sent events).
+
+        Отдаёт разобранный JSON каждого события data: до события [DONE].
+        Если сервер ответил обычным JSON, а не потоком, отдаёт его целиком
+        одним элементом.
+        """
+        if self.policy:
+            stream = self.policy.stream(url, lambda: self._stream_sse(url, payload, headers))
+        else:
+            stream = self._stream_sse(url, payload, headers)
+        async for data in stream:
+            yield data
+
+    async def _post_json(self, url: str, payload: Dict[str, Any],
+                         headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        session = self.session(self.provider_for(url))
+        async with session.post(url, json=payload, headers=headers) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+    async def _stream_sse(self, url: str, payload: Dict[str, Any],
+                          headers: Optional[Dict[str, str]] = None) -> AsyncIterator[Dict[str, Any]]:
+        session = self.session(self.provider_for(url))
+        async with session.post(url, json=payload, headers=headers) as response:
+            response.raise_for_status()
+            if response.content_type != "text/event-stream":
+                yield await response.json(content_type=None)
+                return
+
+            async for raw_line in response.content:
+                line = raw_line.decode("utf-8").strip()
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                yield json.loads(data)
+
+    async def close(self):
+        """Закрыть все сессии"""
+        for session in self._sessions.values():
+            if not session.closed:
+                await session.close()
+        self._sessions.clear()
@@ -0,0 +1,142 @@
+import asyncio
+import csv
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+from typing import Any, Awaitable, Callable, Iterator, List, Optional, Tuple
+
+from database import Database
+
+FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl"}
+MAX_ERRORS_KEPT = 10
+MAX_PRICE = 2 ** 63 - 1  # Больше не помещается в INTEGER SQLite
+
+# (sku, name, description, price, photo)
+ProductRow = Tuple[Optional[str], str, Optional[str], int, Optional[str]]
+# on_progress(обработано строк, загружено, пропущено)
+ProgressCallback = Callable[[int, int, int], Awaitable[None]]
+
+
+class ImportResult:
+    def __init__(self):
+        self.processed = 0
+        self.imported = 0
+        self.skipped = 0
+        self.errors: List[str] = []
+
+    def reject(self, line: int, reason: str):
+        self.skipped += 1
+        if len(self.errors) < MAX_ERRORS_KEPT:
+            self.errors.append(f"строка {line}: {reason}")
+
+
+def detect_format(filename: str) -> Optional[str]:
+    for extension, fmt in FORMATS.items():
+        if filename.lower().endswith(extension):
+            return fmt
+    return None
+
+
+def iter_records(path: str, fmt: str) -> Iterator[Tuple[int, Any]]:
+    """(номер строки, запись) по одной, не читая файл целиком"""
+    with open(path, encoding="utf-8-sig", newline="") as file:
+        if fmt == "csv":
+            reader = csv.DictReader(file)
+            for record in reader:
+                yield reader.line_num, record
+        else:
+            for line_number, line in enumerate(file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_number, json.loads(line)
+                except ValueError as e:
+                    yield line_number, e
+
+
+def validate(record: Any) -> ProductRow:
+    """Строка для Database.upsert_products; ValueError с причиной, если запись негодная"""
+    if isinstance(record, Exception):
+        raise ValueError(f"некорректный JSON ({record})")
+    if not isinstance(record, dict):
+        raise ValueError("ожидался объект")
+
+    def text(field: str) -> Optional[str]:
+        value = record.get(field)
+        value = str(value).strip() if value is not None else ""
+        return value or None
+
+    name = text("name")
+    if name is None:
+        raise ValueError("нет названия")
+    # Decimal, а не float: inf и nan отсекаются, а 12.99 не превращается молча в 12
+    try:
+        price = Decimal(text("price") or "")
+    except InvalidOperation:
+        raise ValueError("цена не число")
+    if not price.is_finite():
+        raise ValueError("цена не число")
+    if price != price.to_integral_value():
+        raise ValueError("цена должна быть целым числом")
+    if price < 0:
+        raise ValueError("отрицательная цена")
+    if price > MAX_PRICE:
+        raise ValueError("слишком большая цена")
+    return text("sku"), name, text("description"), int(price), text("photo")
+
+
+async def import_products(db: Database, path: str, fmt: str, chunk_size: int = 1000,
+                          on_progress: Optional[ProgressCallback] = None,
+                          progress_interval: float = 2.0) -> ImportResult:
+    """Загрузить товары из CSV/JSONL-файла пачками по chunk_size в одной транзакции каждая.
+
+    Поля: name и price обязательны, sku, description и photo - нет. Товары
+    с уже известным sku обновляются. Кэш каталога вызывающий сбрасывает сам,
+    один раз после импорта.
+
+    Разбор файла и запись идут в отдельном потоке, чтобы не останавливать
+    цикл событий. Соединение db привязано к потоку цикла, поэтому поток
+    импорта открывает к той же базе своё.
+    """
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="importer")
+    result = ImportResult()
+    records = iter_records(path, fmt)
+    writer: Optional[Database] = None
+
+    def import_chunk() -> bool:
+        """Разобрать и записать очередную пачку; False, когда файл закончился"""
+        nonlocal writer
+        chunk: List[ProductRow] = []
+        finished = True
+        for line, record in records:
+            result.processed += 1
+            try:
+                chunk.append(validate(record))
+            except ValueError as e:
+                result.reject(line, str(e))
+            if len(chunk) >= chunk_size:
+                finished = False
+                break
+        if chunk:
+            if writer is None:
+                writer = Database(db.db_file)
+            result.imported += writer.upsert_products(chunk)
+        return not finished
+
+    def close():
+        records.close()
+        if writer is not None:
+            writer.connection.close()
+
+    last_progress = time.monotonic()
+    try:
+        while await loop.run_in_executor(executor, import_chunk):
+            if on_progress and time.monotonic() - last_progress >= progress_interval:
+                last_progress = time.monotonic()
+                await on_progress(result.processed, result.imported, result.skipped)
+    finally:
+        await loop.run_in_executor(executor, close)
+        executor.shutdown(wait=False)
+    return result
@@ -1,6 +1,8 @@
+import asyncio
 import logging
+import time
 from aiogram import Bot, Dispatcher, types, F, Router
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.types import (
     Message,
     ReplyKeyboardMarkup,
@@ -11,20 +13,69 @@ from aiogram.types import (
 )
 from aiogram.enums import ParseMode
 from datetime import datetime
-import sqlite3
-import requests
-from typing import Dict, Any
+from typing import AsyncIterator, Callable, Optional, Tuple
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 from aiogram.client.default import DefaultBotProperties
 
+from cache import LRUCache, ResponseCache
+from http_client import APIClient
+from storage import Storage
+from retention import HistoryRetention
+from rollups import PERIODS, UsageRollups, format_usage_report
+from singleflight import SingleFlight
+from providers import AUTO, OpenAIProvider, ProviderRegistry, format_providers_report
+from resilience import ResiliencePolicy
+from scheduler import FairScheduler, QueueFull
+from streaming import StreamingReply, queue_position_updater
+from webhook import WEBHOOK, WebhookServer, run_mode
+from history_view import (
+    FULL, HISTORY_PREFIX, OLDER, SEARCH_PREFIX, format_history_page,
+    format_search_results, history_page_keyboard, parse_history_callback, parse_search_callback,
+    search_key, search_keyboard, send_history_entry
+)
+from sharding import ShardSupervisor
+from ratelimit import RateLimiter, RateLimitMiddleware
+
 DEEPSEEK_URL = "https://www.deepseek.com/chat"
+OPENAI_URL = "https://api.openai.com/v1/chat/completions"
 
 # ====== НАСТРОЙКИ ====== #
 #BOT_TOKEN = ''
 DEEPSEEK_API_KEY = "your_deepseek_api_key"
 OPENAI_API_KEY = ''
 DB_NAME = "bot_history.db"
+HISTORY_PAGE_SIZE = 5  # Записей истории на странице
+SEARCH_PAGE_SIZE = 5  # Результатов поиска на странице
+HISTORY_COMPRESS_THRESHOLD = 1024  # Ответы длиннее (байт) хранятся сжатыми, None - не сжимать
+HISTORY_MAX_ROWS_PER_USER = 1000  # None - без ограничения
+HISTORY_MAX_AGE_DAYS = 365  # None - хранить всегда
+HISTORY_RETENTION_INTERVAL = 3600  # Секунд между проходами очистки
+USAGE_ROLLUP_INTERVAL = 300  # Секунд между обновлениями сводок для /stats
+ADMIN_ID = 521188043
+SETTINGS_CACHE_SIZE = 10000  # Пользователей в кэше настроек
+CONNECT_TIMEOUT = 5  # Секунд
+READ_TIMEOUT = 30  # Секунд
+STREAMING = True  # Показывать ответ по мере генерации
+STREAM_EDIT_INTERVAL = 1.0  # Секунд между редактированиями сообщения
+MAX_RETRIES = 2  # Повторов при сетевых ошибках и 429/5xx
+HEDGE_REQUESTS = False  # Дублировать запрос, если ответ дольше обычного (p95)
+MAX_CONCURRENT_REQUESTS = 8  # Одновременных запросов к API
+MAX_QUEUE_DEPTH = 200  # Запросов в очереди, дальше - отказ
+MAX_QUEUED_PER_USER = 3
+RESPONSE_CACHE = True  # Кэшировать ответы на одинаковые запросы
+RESPONSE_CACHE_TTL = 24 * 3600  # Секунд
+RESPONSE_CACHE_MAX_BYTES = 50 * 1024 * 1024
+RESPONSE_CACHE_MAX_TEMPERATURE = 0.8  # Выше - ответы не кэшируются (None - кэшировать всегда)
+UPDATES_MODE = "polling"  # "polling" или "webhook", переопределяется флагом --webhook/--polling
+WEBHOOK_BASE_URL = ""  # Публичный https-адрес бота
+WEBHOOK_SECRET = ""  # Секрет для заголовка X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_HOST = "0.0.0.0"
+WEBHOOK_PORT = 8080
+WEBHOOK_QUEUE_SIZE = 1000  # Принятых, но ещё не обработанных обновлений
+OUTBOUND_RATE = 28  # Сообщений в секунду от бота всего (на процесс); лимит Telegram - около 30
+OUTBOUND_PER_CHAT_RATE = 1  # Сообщений в секунду в один чат
+WORKERS = 1  # Процессов-обработчиков; больше 1 - обновления распределяются по user_id (только polling)
 
 # Настройка логгирования
 logging.basicConfig(level=logging.INFO)
@@ -35,108 +86,38 @@ bot = Bot(
     #token='',
     default=DefaultBotProperties(parse_mode=ParseMode.HTML)
 )
+bot.session.middleware(RateLimitMiddleware(RateLimiter(OUTBOUND_RATE, per_chat_rate=OUTBOUND_PER_CHAT_RATE)))
 dp = Dispatcher()
 
 # Глобальные переменные
-USER_SETTINGS: Dict[int, Dict[str, Any]] = {}  # {user_id: {"model": str, "temperature": float}}
+USER_SETTINGS = LRUCache(SETTINGS_CACHE_SIZE)  # {user_id: {"model": str, "temperature": float}}
 
 # ====== БАЗА ДАННЫХ ====== #
-def init_db():
-    """Инициализация базы данных с настройками пользователей"""
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        # Таблица истории
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            model TEXT NOT NULL,
-            temperature REAL NOT NULL,
-            prompt TEXT NOT NULL,
-            response TEXT NOT NULL
-        )
-        """)
-        # Таблица настроек
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS user_settings (
-            user_id INTEGER PRIMARY KEY,
-            model TEXT NOT NULL DEFAULT 'deepseek',
-            temperature REAL NOT NULL DEFAULT 0.7
-        )
-        """)
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_history_user_id ON history (user_id)")
-        conn.commit()
-
-def get_user_settings(user_id: int) -> Dict[str, Any]:
-    """Получение настроек пользователя"""
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT model, temperature FROM user_settings WHERE user_id = ?", (user_id,))
-        settings = cursor.fetchone()
-        
-        if settings:
-            return {"model": settings[0], "temperature": settings[1]}
-        
-        # Настройки по умолчанию
-        default_settings = {"model": "deepseek", "temperature": 0.7}
-        cursor.execute(
-            "INSERT INTO user_settings (user_id, model, temperature) VALUES (?, ?, ?)",
-            (user_id, default_settings["model"], default_settings["temperature"])
-        )
-        conn.commit()
-        return default_settings
-
-def update_user_setting(user_id: int, key: str, value: Any):
-    """Обновление настроек пользователя"""
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            f"UPDATE user_settings SET {key} = ? WHERE user_id = ?",
-            (value, user_id)
-        )
-        conn.commit()
-
-def add_to_history(user_id: int, model: str, temperature: float, prompt: str, response: str):
-    """Добавление записи в историю"""
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-        INSERT INTO history (user_id, model, temperature, prompt, response)
-        VALUES (?, ?, ?, ?, ?)
-        """, (user_id, model, temperature, prompt, response))
-        conn.commit()
-
-def get_user_history(user_id: int, limit: int = 5):
-    """Получение истории пользователя"""
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-        SELECT timestamp, model, temperature, prompt, response 
-        FROM history 
-        WHERE user_id = ? 
-        ORDER BY timestamp DESC 
-        LIMIT ?
-        """, (user_id, limit))
-        return cursor.fetchall()
-
-def clear_user_history(user_id: int):
-    """Очистка истории пользователя"""
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM history WHERE user_id = ?", (user_id,))
-        conn.commit()
-        return cursor.rowcount
+storage = Storage(
+    DB_NAME,
+    default_model="deepseek",
+    settings_cache=USER_SETTINGS,
+    compress_threshold=HISTORY_COMPRESS_THRESHOLD
+)
+retention = HistoryRetention(
+    storage,
+    max_rows_per_user=HISTORY_MAX_ROWS_PER_USER,
+    max_age_days=HISTORY_MAX_AGE_DAYS,
+    interval=HISTORY_RETENTION_INTERVAL
+)
+rollups = UsageRollups(storage, interval=USAGE_ROLLUP_INTERVAL)
+search_queries = LRUCache(10000)  # Ключ из callback_data кнопок поиска -> текст запроса
 
 # ====== КЛАВИАТУРЫ ====== #
-def get_main_keyboard(user_id: int):
+async def get_main_keyboard(user_id: int):
     """Основная клавиатура с учётом текущих настроек"""
-    settings = get_user_settings(user_id)
+    settings = await storage.get_user_settings(user_id)
     return ReplyKeyboardMarkup(
         keyboard=[
             [
                 KeyboardButton(text="DeepSeek" if settings["model"] != "deepseek" else "✅ DeepSeek"),
-                KeyboardButton(text="OpenAI GPT" if settings["model"] != "openai" else "✅ OpenAI GPT")
+                KeyboardButton(text="OpenAI GPT" if settings["model"] != "openai" else "✅ OpenAI GPT"),
+                KeyboardButton(text="⚡ Авто" if settings["model"] != "auto" else "✅ ⚡ Авто")
             ],
             [
                 KeyboardButton(text=f"🎨 Креативность: {settings['temperature']}"),
@@ -163,62 +144,149 @@ def get_settings_keyboard():
     )
 
 # ====== ГЕНЕРАЦИЯ ТЕКСТА ====== #
-async def generate_text(user_id: int, prompt: str) -> str:
-    """Генерация текста с учётом настроек пользователя"""
-    settings = get_user_settings(user_id)
-    
-    if settings["model"] == "deepseek":
-        return await generate_with_api(
-            url=DEEPSEEK_URL,
-            api_key=DEEPSEEK_API_KEY,
-            model="deepseek-chat",
-            prompt=prompt,
-            temperature=settings["temperature"]
-        )
-    else:
-        return await generate_with_api(
-            url="https://api.openai.com/v1/chat/completions",
-            api_key=OPENAI_API_KEY,
-            model="gpt-3.5-turbo",
-            prompt=prompt,
-            temperature=settings["temperature"]
-        )
+api_client = APIClient(
+    connect_timeout=CONNECT_TIMEOUT,
+    read_timeout=READ_TIMEOUT,
+    policy=ResiliencePolicy(retries=MAX_RETRIES, hedge=HEDGE_REQUESTS)
+)
+response_cache = ResponseCache(
+    storage,
+    ttl=RESPONSE_CACHE_TTL,
+    max_bytes=RESPONSE_CACHE_MAX_BYTES,
+    max_temperature=RESPONSE_CACHE_MAX_TEMPERATURE
+)
+registry = ProviderRegistry(api_client)
+registry.register(OpenAIProvider("deepseek", DEEPSEEK_URL, DEEPSEEK_API_KEY, "deepseek-chat"))
+registry.register(OpenAIProvider("openai", OPENAI_URL, OPENAI_API_KEY, "gpt-3.5-turbo"))
+flights = SingleFlight()
+scheduler = FairScheduler(
+    max_concurrency=MAX_CONCURRENT_REQUESTS,
+    max_queue=MAX_QUEUE_DEPTH,
+    max_per_user=MAX_QUEUED_PER_USER
+)
+
+def cache_model(preferred: str, answered: str) -> str:
+    """Под какой моделью кэшировать ответ.
+
+    При переключении ответ дал не выбранный провайдер: кэшируем под тем,
+    кто ответил, чтобы не выдавать его потом за ответ выбранной модели.
+    В режиме "auto" подходит ответ любого провайдера.
+    """
+    return AUTO if preferred == AUTO else answered
+
+def report_cached(model: str, on_answer: Optional[Callable[[str], None]]):
+    """Сообщить, кто ответил, для ответа из кэша.
 
-async def generate_with_api(url: str, api_key: str, model: str, prompt: str, temperature: float) -> str:
-    """Общая функция для генерации через API"""
+    Под конкретной моделью в кэше лежат только её ответы; в режиме "auto"
+    провайдер не известен.
+    """
+    if on_answer is not None and model != AUTO:
+        on_answer(model)
+
+async def generate_text(user_id: int, prompt: str,
+                        on_answer: Optional[Callable[[str], None]] = None) -> str:
+    """Генерация текста с учётом настроек пользователя.
+
+    on_answer, если передан, вызывается с именем ответившего провайдера.
+    """
+    settings = await storage.get_user_settings(user_id)
+    model = settings["model"]
+    temperature = settings["temperature"]
+
+    if RESPONSE_CACHE:
+        cached = await response_cache.get(prompt, model, temperature)
+        if cached:
+            report_cached(model, on_answer)
+            return cached
+
+    async def generate() -> Tuple[Optional[str], Optional[str]]:
+        started = time.monotonic()
+        answered = []
+        text = await registry.generate(model, prompt, temperature, on_answer=answered.append)
+        if text and RESPONSE_CACHE:
+            await response_cache.set(
+                prompt, cache_model(model, answered[0]), temperature, text, time.monotonic() - started)
+        return text, answered[0] if answered else None
+
+    # Одинаковые одновременные запросы разных пользователей уходят к API один раз
+    key = ResponseCache.make_key(prompt, model, temperature)
     try:
-        response = requests.post(
-            url,
-            headers={"Authorization": f"Bearer {api_key}"},
-            json={
-                "model": model,
-                "messages": [{"role": "user", "content": prompt}],
-                "temperature": temperature
-            },
-            timeout=30
-        )
-        response.raise_for_status()
-        return response.json()["choices"][0]["message"]["content"]
-    except Exception as e:
-        logger.error(f"API Error ({model}): {e}")
+        text, provider = await flights.do(key, generate, timeout=READ_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.error(f"API Error ({model}): timeout")
         return None
+    if provider and on_answer is not None:
+        on_answer(provider)
+    return text
+
+async def stream_text(user_id: int, prompt: str,
+                      on_answer: Optional[Callable[[str], None]] = None) -> AsyncIterator[str]:
+    """Потоковая генерация текста с учётом настроек пользователя.
+
+    Если генерация оборвалась, выбрасывает исключение после уже отданных фрагментов.
+    on_answer, если передан, вызывается с именем провайдера перед первым фрагментом.
+    """
+    settings = await storage.get_user_settings(user_id)
+    model = settings["model"]
+    temperature = settings["temperature"]
+
+    if RESPONSE_CACHE:
+        cached = await response_cache.get(prompt, model, temperature)
+        if cached:
+            report_cached(model, on_answer)
+            yield cached
+            return
+
+    async def generate() -> AsyncIterator[Tuple[str, str]]:
+        started = time.monotonic()
+        chunks, answered = [], []
+        async for chunk in registry.stream(model, prompt, temperature, on_answer=answered.append):
+            chunks.append(chunk)
+            # Имя провайдера идёт вместе с фрагментом, чтобы его узнали и склеенные запросы
+            yield answered[0], chunk
+
+        text = "".join(chunks)
+        if text and RESPONSE_CACHE:
+            await response_cache.set(
+                prompt, cache_model(model, answered[0]), temperature, text, time.monotonic() - started)
+
+    key = ResponseCache.make_key(prompt, model, temperature)
+    # Ошибку посреди потока не глотаем: вызывающий должен знать, что ответ неполный
+    reported = False
+    async for provider, chunk in flights.stream(key, generate, timeout=READ_TIMEOUT):
+        if not reported and on_answer is not None:
+            on_answer(provider)
+        reported = True
+        yield chunk
 
 # ====== ОБРАБОТЧИКИ ====== #
 @dp.message(Command("start"))
 async def cmd_start(message: Message):
-    settings = get_user_settings(message.from_user.id)
+    settings = await storage.get_user_settings(message.from_user.id)
     await message.answer(
         f"✨ <b>AI-копирайтер</b> готов к работе!\n\n"
         f"Текущие настройки:\n"
         f"• Модель: <b>{settings['model'].upper()}</b>\n"
         f"• Креативность: <b>{settings['temperature']}</b>\n\n"
         "Используй кнопки для управления или просто отправь запрос.",
-        reply_markup=get_main_keyboard(message.from_user.id)
+        reply_markup=await get_main_keyboard(message.from_user.id)
     )
 
+@dp.message(Command("providers"), lambda message: message.from_user.id == ADMIN_ID)
+async def cmd_providers(message: Message):
+    await message.answer(format_providers_report(registry))
+
+@dp.message(Command("stats"), lambda message: message.from_user.id == ADMIN_ID)
+async def cmd_stats(message: Message, command: CommandObject):
+    period = (command.args or "day").strip().lower()
+    if period not in PERIODS:
+        await message.answer(f"Использование: <code>/stats [{'|'.join(PERIODS)}]</code>")
+        return
+    await message.answer(await format_usage_report(storage, period))
+
 @dp.message(F.text == "🛠 Настройки")
 async def show_settings(message: Message):
-    settings = get_user_settings(message.from_user.id)
+    settings = await storage.get_user_settings(message.from_user.id)
     await message.answer(
         f"⚙️ <b>Текущие настройки:</b>\n"
         f"• Модель: <b>{settings['model'].upper()}</b>\n"
@@ -229,7 +297,7 @@ async def show_settings(message: Message):
 
 @dp.message(F.text.startswith("🎨 Креативность:"))
 async def show_creativity_info(message: Message):
-    settings = get_user_settings(message.from_user.id)
+    settings = await storage.get_user_settings(message.from_user.id)
     await message.answer(
         f"🎨 <b>Уровень креативности:</b> {settings['temperature']}\n\n"
         "0.0 - строгий и точный\n"
@@ -241,9 +309,9 @@ async def show_creativity_info(message: Message):
 @dp.callback_query(F.data == "increase_temp")
 async def increase_temperature(callback: CallbackQuery):
     user_id = callback.from_user.id
-    settings = get_user_settings(user_id)
+    settings = await storage.get_user_settings(user_id)
     new_temp = min(1.0, round(settings["temperature"] + 0.1, 1))
-    update_user_setting(user_id, "temperature", new_temp)
+    await storage.update_user_setting(user_id, "temperature", new_temp)
     await callback.message.edit_text(
         f"⚙️ <b>Креативность увеличена до:</b> {new_temp}",
         reply_markup=get_settings_keyboard()
@@ -253,9 +321,9 @@ async def increase_temperature(callback: CallbackQuery):
 @dp.callback_query(F.data == "decrease_temp")
 async def decrease_temperature(callback: CallbackQuery):
     user_id = callback.from_user.id
-    settings = get_user_settings(user_id)
+    settings = await storage.get_user_settings(user_id)
     new_temp = max(0.0, round(settings["temperature"] - 0.1, 1))
-    update_user_setting(user_id, "temperature", new_temp)
+    await storage.update_user_setting(user_id, "temperature", new_temp)
     await callback.message.edit_text(
         f"⚙️ <b>Креативность уменьшена до:</b> {new_temp}",
         reply_markup=get_settings_keyboard()
@@ -265,8 +333,7 @@ async def decrease_temperature(callback: CallbackQuery):
 @dp.callback_query(F.data == "reset_settings")
 async def reset_settings(callback: CallbackQuery):
     user_id = callback.from_user.id
-    update_user_setting(user_id, "model", "deepseek")
-    update_user_setting(user_id, "temperature", 0.7)
+    await storage.reset_user_settings(user_id)
     await callback.message.edit_text(
         "⚙️ <b>Настройки сброшены к значениям по умолчанию:</b>\n"
         "• Модель: DEEPSEEK\n"
@@ -275,73 +342,190 @@ async def reset_settings(callback: CallbackQuery):
     )
     await callback.answer()
 
-@dp.message(F.text.in_(["DeepSeek", "OpenAI GPT"]))
+@dp.message(F.text.in_(["DeepSeek", "OpenAI GPT", "⚡ Авто"]))
 async def change_model(message: Message):
     user_id = message.from_user.id
-    new_model = "deepseek" if message.text == "DeepSeek" else "openai"
-    update_user_setting(user_id, "model", new_model)
+    new_model = {"DeepSeek": "deepseek", "OpenAI GPT": "openai", "⚡ Авто": AUTO}[message.text]
+    await storage.update_user_setting(user_id, "model", new_model)
     await message.answer(
         f"✅ Модель изменена на <b>{new_model.upper()}</b>",
-        reply_markup=get_main_keyboard(user_id)
+        reply_markup=await get_main_keyboard(user_id)
     )
 
 @dp.message(F.text == "📜 История")
 async def show_history(message: Message):
-    history = get_user_history(message.from_user.id)
-    if not history:
+    rows, has_newer, has_older = await storage.get_history_page(message.from_user.id, limit=HISTORY_PAGE_SIZE)
+    if not rows:
         await message.answer("📭 История запросов пуста")
         return
     
-    text = "📜 <b>Последние запросы:</b>\n\n"
-    for i, (timestamp, model, temp, prompt, _) in enumerate(history, 1):
-        text += (
-            f"{i}. <i>{timestamp}</i>\n"
-            f"• Модель: <b>{model.upper()}</b>\n"
-            f"• Креативность: <b>{temp}</b>\n"
-            f"• Запрос: <i>{prompt[:50]}{'...' if len(prompt) > 50 else ''}</i>\n\n"
-        )
+    await message.answer(
+        format_history_page(rows),
+        reply_markup=history_page_keyboard(rows, has_newer, has_older)
+    )
+
+@dp.callback_query(F.data.startswith(f"{HISTORY_PREFIX}:"))
+async def history_page_handler(callback: CallbackQuery):
+    parsed = parse_history_callback(callback.data)
+    if parsed is None:
+        await callback.answer()
+        return
+    action, entry_id = parsed
+    user_id = callback.from_user.id
     
-    await message.answer(text)
+    if action == FULL:
+        entry = await storage.get_history_entry(user_id, entry_id)
+        if entry is None:
+            await callback.answer("Запись не найдена")
+            return
+        await send_history_entry(callback.message, entry)
+        await callback.answer()
+        return
+    
+    if action == OLDER:
+        page = await storage.get_history_page(user_id, before_id=entry_id, limit=HISTORY_PAGE_SIZE)
+    else:
+        page = await storage.get_history_page(user_id, after_id=entry_id, limit=HISTORY_PAGE_SIZE)
+    rows, has_newer, has_older = page
+    if not rows:
+        await callback.answer("Больше записей нет")
+        return
+    await callback.message.edit_text(
+        format_history_page(rows),
+        reply_markup=history_page_keyboard(rows, has_newer, has_older)
+    )
+    await callback.answer()
 
 @dp.callback_query(F.data == "clear_history")
 async def clear_history_handler(callback: CallbackQuery):
-    deleted_count = clear_user_history(callback.from_user.id)
+    deleted_count = await storage.clear_user_history(callback.from_user.id)
     await callback.message.answer(
         f"✅ Удалено {deleted_count} записей из истории" if deleted_count > 0 
         else "📭 История уже пуста"
     )
     await callback.answer()
 
+@dp.message(Command("search"))
+async def cmd_search(message: Message, command: CommandObject):
+    query = (command.args or "").strip()
+    if not query:
+        await message.answer("🔎 Использование: <code>/search текст</code>")
+        return
+    key = search_key(query)
+    search_queries.set(key, query)
+    rows, has_more = await storage.search_history(message.from_user.id, query, limit=SEARCH_PAGE_SIZE)
+    if not rows:
+        await message.answer("🔎 Ничего не найдено")
+        return
+    await message.answer(
+        format_search_results(query, rows, 0),
+        reply_markup=search_keyboard(rows, key, 0, SEARCH_PAGE_SIZE, has_more)
+    )
+
+@dp.callback_query(F.data.startswith(f"{SEARCH_PREFIX}:"))
+async def search_page_handler(callback: CallbackQuery):
+    parsed = parse_search_callback(callback.data)
+    query = search_queries.get(parsed[1]) if parsed else None
+    if query is None:
+        await callback.answer("Поиск устарел, повторите /search")
+        return
+    offset, key = parsed
+    rows, has_more = await storage.search_history(callback.from_user.id, query, offset, SEARCH_PAGE_SIZE)
+    if not rows:
+        await callback.answer("Больше результатов нет")
+        return
+    await callback.message.edit_text(
+        format_search_results(query, rows, offset),
+        reply_markup=search_keyboard(rows, key, offset, SEARCH_PAGE_SIZE, has_more)
+    )
+    await callback.answer()
+
+@dp.message(Command("reindex"), lambda message: message.from_user.id == ADMIN_ID)
+async def cmd_reindex(message: Message):
+    status = await message.answer("🔄 Перестраиваю поисковый индекс...")
+    started = time.monotonic()
+    await storage.rebuild_search_index()
+    await status.edit_text(f"✅ Поисковый индекс перестроен за {time.monotonic() - started:.1f}с")
+
 @dp.message(F.text)
 async def handle_text(message: Message):
-    if message.text in ["DeepSeek", "OpenAI GPT", "🎨 Креативность:", "📜 История", "🛠 Настройки"]:
+    if message.text in ["DeepSeek", "OpenAI GPT", "⚡ Авто", "🎨 Креативность:", "📜 История", "🛠 Настройки"]:
         return
     
     user_id = message.from_user.id
-    await message.answer("🔄 <i>Генерирую текст...</i>")
+    processing_msg = await message.answer("🔄 <i>Генерирую текст...</i>")
     
-    generated_text = await generate_text(user_id, message.text)
+    settings = await storage.get_user_settings(user_id)
+    header = f"📝 <b>Результат ({settings['model'].upper()}, креативность {settings['temperature']}):</b>\n\n"
+    answered = []
+    try:
+        async with scheduler.slot(user_id, on_wait=queue_position_updater(processing_msg)):
+            started = time.monotonic()
+            if STREAMING:
+                reply = StreamingReply(processing_msg, header=header, edit_interval=STREAM_EDIT_INTERVAL)
+                try:
+                    async for chunk in stream_text(user_id, message.text, on_answer=answered.append):
+                        await reply.feed(chunk)
+                except Exception as e:
+                    logger.error(f"API Error ({settings['model']}): {e}")
+                    if reply.text:
+                        # Неполный ответ показываем с пометкой, но в историю не пишем
+                        await reply.abort()
+                        return
+                generated_text = reply.text
+            else:
+                generated_text = await generate_text(user_id, message.text, on_answer=answered.append)
+            latency = time.monotonic() - started
+    except QueueFull:
+        await processing_msg.edit_text("😔 Сейчас слишком много запросов. Попробуйте через минуту.")
+        return
     if not generated_text:
         await message.answer("❌ Ошибка генерации. Попробуйте позже.")
         return
     
-    settings = get_user_settings(user_id)
-    add_to_history(
+    await storage.add_to_history(
         user_id=user_id,
-        model=settings["model"],
+        # В режиме "auto" и при переключении пишем того, кто действительно ответил
+        model=answered[0] if answered else settings["model"],
         temperature=settings["temperature"],
         prompt=message.text,
-        response=generated_text
+        response=generated_text,
+        latency=latency
     )
     
-    await message.answer(
-        f"📝 <b>Результат ({settings['model'].upper()}, креативность {settings['temperature']}):</b>\n\n"
-        f"{generated_text}",
-        reply_markup=get_main_keyboard(user_id)
-    )
+    if STREAMING:
+        await reply.finish()
+    else:
+        await message.answer(
+            f"{header}{generated_text}",
+            reply_markup=await get_main_keyboard(user_id)
+        )
 
 # ====== ЗАПУСК ====== #
-if __name__ == "__main__":
-    init_db()
+async def on_startup(worker_index: int = 0):
+    """Действия при запуске"""
+    await storage.init()
+    # При нескольких процессах фоновое обслуживание базы ведёт только первый
+    if worker_index == 0:
+        retention.start()
+        rollups.start()
     logger.info("Бот запущен! База данных инициализирована.")
-    dp.run_polling(bot)
+
+async def on_shutdown():
+    """Действия при завершении"""
+    await api_client.close()
+    await retention.close()
+    await rollups.close()
+    await storage.close()
+
+dp.startup.register(on_startup)
+dp.shutdown.register(on_shutdown)
+
+if __name__ == "__main__":
+    if WORKERS > 1:
+        asyncio.run(ShardSupervisor("main_bot_copyrater", bot.token, WORKERS, prepare=storage.migrate).run())
+    elif run_mode(UPDATES_MODE) == WEBHOOK:
+        server = WebhookServer(dp, bot, WEBHOOK_SECRET, queue_size=WEBHOOK_QUEUE_SIZE)
+        asyncio.run(server.run(WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_BASE_URL))
+    else:
+        dp.run_polling(bot)
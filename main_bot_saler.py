@@ -1,22 +1,64 @@
+import csv
+import html
 import os
 import logging
+import tempfile
+
+import aiohttp
 from aiogram import Bot, Dispatcher, Router, types, F
-from aiogram.filters import Command
+from aiogram.client.default import DefaultBotProperties
+from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import LabeledPrice, InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from dotenv import load_dotenv
 
+from catalog import CATALOG_PREFIX, PRODUCT_PREFIX, Catalog
+from database import Database
+from fsm_storage import SQLiteStorage
+from importer import detect_format, import_products
+from media import MediaCache
+from product_search import ProductIndex, inline_results
+from ratelimit import RateLimiter, RateLimitMiddleware
+from webhook import WEBHOOK, WebhookServer, run_mode
+
 # Загрузка конфигурации
 #load_dotenv()
 #BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_ID = 521188043
+DB_NAME = "shop.db"
+FSM_STATE_TTL = 24 * 3600  # Секунд; незавершённый ввод товара старше этого сбрасывается
+CATALOG_PAGE_SIZE = 10  # Товаров на странице каталога
+IMPORT_CHUNK_SIZE = 1000  # Товаров в одной транзакции при импорте
+IMPORT_MAX_FILE_SIZE = 20 * 1024 * 1024  # Больше Bot API скачать не даёт
+PHOTO_MAX_SIDE = 1280  # Точек по большей стороне, фото крупнее уменьшаются перед загрузкой
+PHOTO_WARMUP_INTERVAL = 300  # Секунд между проходами предзагрузки фото товаров
+# Служебный канал, куда бот заранее загружает фото товаров (и сразу удаляет
+# сообщения). None - предзагрузки нет, фото загружается при первом показе
+PHOTO_STORAGE_CHAT_ID = None
+INLINE_RESULTS_PER_PAGE = 50  # Результатов inline-поиска за раз, больше Telegram не принимает
+INLINE_CACHE_TIME = 60  # Секунд, которые Telegram хранит ответ на одинаковый inline-запрос
+UPDATES_MODE = "polling"  # "polling" или "webhook", переопределяется флагом --webhook/--polling
+WEBHOOK_BASE_URL = ""  # Публичный https-адрес бота
+WEBHOOK_SECRET = ""  # Секрет для заголовка X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_HOST = "0.0.0.0"
+WEBHOOK_PORT = 8080
+WEBHOOK_QUEUE_SIZE = 1000  # Принятых, но ещё не обработанных обновлений
+OUTBOUND_RATE = 28  # Сообщений в секунду от бота всего (на процесс); лимит Telegram - около 30
+OUTBOUND_PER_CHAT_RATE = 1  # Сообщений в секунду в один чат
 
 # Инициализация бота и диспетчера
-bot = Bot(token='')
-storage = MemoryStorage()
+bot = Bot(token='', default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+bot.session.middleware(RateLimitMiddleware(RateLimiter(OUTBOUND_RATE, per_chat_rate=OUTBOUND_PER_CHAT_RATE)))
+storage = SQLiteStorage(DB_NAME, ttl=FSM_STATE_TTL)
+db = Database(DB_NAME)
+catalog = Catalog(db, page_size=CATALOG_PAGE_SIZE)
+media = MediaCache(bot, db, PHOTO_STORAGE_CHAT_ID, on_cached=catalog.forget, max_side=PHOTO_MAX_SIDE,
+                   interval=PHOTO_WARMUP_INTERVAL)
+search_index = ProductIndex(db)
 dp = Dispatcher(storage=storage)
 router = Router()
 dp.include_router(router)
@@ -32,9 +74,28 @@ class ProductState(StatesGroup):
     price = State()
     photo = State()
 
+class ImportState(StatesGroup):
+    file = State()
+
 # ========== ОБРАБОТЧИКИ КОМАНД ==========
 @router.message(Command("start"))
-async def start_handler(message: types.Message):
+async def start_handler(message: types.Message, command: CommandObject):
+    # Ссылка из inline-поиска: /start product_<id> открывает карточку товара
+    if command.args and command.args.startswith(PRODUCT_PREFIX) and command.args[len(PRODUCT_PREFIX):].isdigit():
+        product_id = int(command.args[len(PRODUCT_PREFIX):])
+        card = catalog.product(product_id)
+        if card is not None:
+            text, photo, keyboard = card
+            if photo:
+                try:
+                    await media.answer_photo(message, product_id, photo, caption=text, reply_markup=keyboard)
+                    return
+                except (OSError, aiohttp.ClientError) as e:
+                    # Фото недоступно - показываем карточку без него
+                    logger.warning(f"Photo for product {product_id} unavailable: {e}")
+            await message.answer(text, reply_markup=keyboard)
+            return
+
     builder = InlineKeyboardBuilder()
     builder.add(
         InlineKeyboardButton(text="🛍️ Каталог", callback_data="show_catalog"),
@@ -46,58 +107,110 @@ async def start_handler(message: types.Message):
     )
 
 # ========== ОБРАБОТЧИКИ CALLBACK ==========
-@router.callback_query(F("show_catalog"))
+async def show_screen(callback: types.CallbackQuery, text: str, reply_markup: InlineKeyboardMarkup):
+    # Сообщение с фото товара нельзя превратить в текстовое, отправляем новое
+    if callback.message.photo:
+        await callback.message.delete()
+        await callback.message.answer(text, reply_markup=reply_markup)
+    else:
+        await callback.message.edit_text(text, reply_markup=reply_markup)
+
+@router.callback_query(F.data == "show_catalog")
 async def show_catalog(callback: types.CallbackQuery):
-    # Здесь должна быть логика загрузки товаров из БД
-    products = [
-        {"id": 1, "name": "Товар 1", "price": 1000},
-        {"id": 2, "name": "Товар 2", "price": 2000}
-    ]
-    
-    builder = InlineKeyboardBuilder()
-    for product in products:
-        builder.button(
-            text=f"{product['name']} - {product['price']}₽",
-            callback_data=f"product_{product['id']}"
-        )
-    builder.adjust(1)
-    
-    await callback.message.edit_text(
-        "📦 Каталог товаров:",
-        reply_markup=builder.as_markup()
-    )
+    text, keyboard = catalog.page(0)
+    await show_screen(callback, text, keyboard)
+    await callback.answer()
+
+@router.callback_query(F.data.startswith(CATALOG_PREFIX))
+async def show_catalog_page(callback: types.CallbackQuery):
+    text, keyboard = catalog.page(int(callback.data[len(CATALOG_PREFIX):]))
+    await show_screen(callback, text, keyboard)
     await callback.answer()
 
-@router.callback_query(F(startswith="product_"))
+@router.callback_query(F.data.startswith(PRODUCT_PREFIX))
 async def show_product(callback: types.CallbackQuery):
-    product_id = callback.data.split("_")[1]
-    # Здесь должна быть логика загрузки товара из БД
-    product = {
-        "name": f"Товар {product_id}",
-        "description": "Отличный товар!",
-        "price": 1000,
-        "photo": None  # Можно добавить file_id фото
-    }
+    product_id = int(callback.data[len(PRODUCT_PREFIX):])
+    card = catalog.product(product_id)
+    if card is None:
+        await callback.answer("Товар не найден", show_alert=True)
+        return
+    text, photo, keyboard = card
     
+    if photo:
+        try:
+            await media.answer_photo(
+                callback.message,
+                product_id,
+                photo,
+                caption=text,
+                reply_markup=keyboard
+            )
+        except (OSError, aiohttp.ClientError) as e:
+            # Фото недоступно - показываем карточку без него
+            logger.warning(f"Photo for product {product_id} unavailable: {e}")
+            await show_screen(callback, text, keyboard)
+        else:
+            await callback.message.delete()
+    else:
+        await show_screen(callback, text, keyboard)
+    await callback.answer()
+
+# ========== INLINE-ПОИСК ==========
+@router.inline_query()
+async def inline_search(query: types.InlineQuery):
+    offset = int(query.offset) if query.offset.isdigit() else 0
+    products, next_offset = search_index.search(query.query, offset, INLINE_RESULTS_PER_PAGE)
+    me = await bot.me()
+    await query.answer(
+        inline_results(products, me.username),
+        cache_time=INLINE_CACHE_TIME,
+        next_offset=str(next_offset) if next_offset is not None else ""
+    )
+
+# ========== КОРЗИНА ==========
+def cart_screen(user_id: int):
+    items = db.get_cart(user_id)
     builder = InlineKeyboardBuilder()
-    builder.button(text="➕ Добавить в корзину", callback_data=f"add_{product_id}")
-    builder.button(text="🔙 Назад", callback_data="show_catalog")
-    builder.adjust(1)
+    if not items:
+        builder.button(text="🛍️ Каталог", callback_data="show_catalog")
+        return "🛒 Корзина пуста", builder.as_markup()
     
-    if product['photo']:
-        await callback.message.delete()
-        await callback.message.answer_photo(
-            photo=product['photo'],
-            caption=f"<b>{product['name']}</b>\n\n{product['description']}\n\n💰 Цена: <b>{product['price']}₽</b>",
-            reply_markup=builder.as_markup()
-        )
-    else:
-        await callback.message.edit_text(
-            f"<b>{product['name']}</b>\n\n{product['description']}\n\n💰 Цена: <b>{product['price']}₽</b>",
-            reply_markup=builder.as_markup()
-        )
+    count, total = db.get_cart_total(user_id)
+    text = "🛒 <b>Корзина:</b>\n\n"
+    for product_id, name, _, price, quantity in items:
+        text += f"• {html.escape(name)} × {quantity} = {price * quantity}₽\n"
+        builder.button(text=f"➖ {name}", callback_data=f"cart_dec_{product_id}")
+    text += f"\nИтого: <b>{count}</b> шт. на <b>{total}₽</b>"
+    builder.button(text="🗑 Очистить", callback_data="cart_clear")
+    builder.button(text="🛍️ Каталог", callback_data="show_catalog")
+    builder.adjust(1)
+    return text, builder.as_markup()
+
+@router.callback_query(F.data.startswith("add_"))
+async def add_to_cart(callback: types.CallbackQuery):
+    db.add_to_cart(callback.from_user.id, int(callback.data[len("add_"):]))
+    await callback.answer("✅ Добавлено в корзину")
+
+@router.callback_query(F.data == "show_cart")
+async def show_cart(callback: types.CallbackQuery):
+    text, keyboard = cart_screen(callback.from_user.id)
+    await show_screen(callback, text, keyboard)
     await callback.answer()
 
+@router.callback_query(F.data.startswith("cart_dec_"))
+async def decrease_cart_item(callback: types.CallbackQuery):
+    db.remove_from_cart(callback.from_user.id, int(callback.data[len("cart_dec_"):]), 1)
+    text, keyboard = cart_screen(callback.from_user.id)
+    await show_screen(callback, text, keyboard)
+    await callback.answer()
+
+@router.callback_query(F.data == "cart_clear")
+async def clear_cart(callback: types.CallbackQuery):
+    db.clear_cart(callback.from_user.id)
+    text, keyboard = cart_screen(callback.from_user.id)
+    await show_screen(callback, text, keyboard)
+    await callback.answer("🗑 Корзина очищена")
+
 # ========== АДМИН ПАНЕЛЬ ==========
 @router.message(Command("add_product"), lambda message: message.from_user.id == ADMIN_ID)
 async def add_product_start(message: types.Message, state: FSMContext):
@@ -110,11 +223,113 @@ async def set_product_name(message: types.Message, state: FSMContext):
     await state.set_state(ProductState.description)
     await message.answer("📝 Введите описание товара:")
 
+@router.message(ProductState.description)
+async def set_product_description(message: types.Message, state: FSMContext):
+    await state.update_data(description=message.text)
+    await state.set_state(ProductState.price)
+    await message.answer("💰 Введите цену в рублях:")
+
+@router.message(ProductState.price)
+async def set_product_price(message: types.Message, state: FSMContext):
+    if not message.text or not message.text.strip().isdigit():
+        await message.answer("⚠️ Цена должна быть целым числом, попробуйте ещё раз:")
+        return
+    await state.update_data(price=int(message.text.strip()))
+    await state.set_state(ProductState.photo)
+    await message.answer("🖼 Отправьте фото товара или /skip, чтобы добавить без фото:")
+
+@router.message(ProductState.photo)
+async def set_product_photo(message: types.Message, state: FSMContext):
+    if message.photo:
+        photo = message.photo[-1].file_id
+    elif message.text == "/skip":
+        photo = None
+    else:
+        await message.answer("🖼 Нужна фотография или /skip:")
+        return
+    data = await state.get_data()
+    product_id = catalog.add_product(data["name"], data["description"], data["price"], photo)
+    search_index.add(product_id)
+    media.schedule()
+    await state.clear()
+    await message.answer(f"✅ Товар #{product_id} добавлен в каталог")
+
+@router.message(Command("import"), lambda message: message.from_user.id == ADMIN_ID)
+async def import_start(message: types.Message, state: FSMContext):
+    await state.set_state(ImportState.file)
+    await message.answer(
+        "📥 Отправьте файл CSV или JSONL с товарами.\n"
+        "Поля: <code>name</code>, <code>price</code>, необязательные "
+        "<code>sku</code>, <code>description</code>, <code>photo</code>.\n"
+        "Товары с уже известным sku будут обновлены."
+    )
+
+@router.message(ImportState.file)
+async def import_file(message: types.Message, state: FSMContext):
+    document = message.document
+    fmt = detect_format(document.file_name or "") if document else None
+    if fmt is None:
+        await message.answer("⚠️ Нужен файл .csv или .jsonl")
+        return
+    if document.file_size and document.file_size > IMPORT_MAX_FILE_SIZE:
+        await message.answer("⚠️ Файл больше 20 МБ, разбейте его на части")
+        return
+    await state.clear()
+    status = await message.answer("⏳ Загружаю файл...")
+
+    async def show_progress(processed: int, imported: int, skipped: int):
+        try:
+            await status.edit_text(f"⏳ Обработано строк: {processed}\n✅ Загружено: {imported}\n⚠️ Пропущено: {skipped}")
+        except TelegramBadRequest:
+            pass
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "import")
+        await bot.download(document, destination=path)
+        try:
+            result = await import_products(db, path, fmt, IMPORT_CHUNK_SIZE, on_progress=show_progress)
+        except (UnicodeDecodeError, OSError) as e:
+            logger.error(f"Import failed: {e}", exc_info=True)
+            await status.edit_text("❌ Не удалось прочитать файл, нужна кодировка UTF-8")
+            return
+        except csv.Error as e:
+            logger.error(f"Import failed: {e}", exc_info=True)
+            await status.edit_text(f"❌ Файл не разобран как CSV: {html.escape(str(e))}")
+            return
+        finally:
+            # Даже после ошибки часть пачек уже записана
+            catalog.invalidate()
+            await search_index.refresh()
+            media.schedule()
+
+    text = (
+        f"✅ Импорт завершён\n\nОбработано строк: {result.processed}\n"
+        f"Загружено: {result.imported}\nПропущено: {result.skipped}"
+    )
+    if result.errors:
+        text += "\n\n" + "\n".join(html.escape(error) for error in result.errors)
+    await status.edit_text(text)
+
 # ========== ЗАПУСК БОТА ==========
+async def on_startup():
+    await search_index.refresh()
+    media.start()
+
+async def on_shutdown():
+    await media.close()
+    await storage.close()
+
+dp.startup.register(on_startup)
+dp.shutdown.register(on_shutdown)
+
 async def main():
     logger.info("Starting bot...")
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    if run_mode(UPDATES_MODE) == WEBHOOK:
+        server = WebhookServer(dp, bot, WEBHOOK_SECRET, queue_size=WEBHOOK_QUEUE_SIZE)
+        await server.run(WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_BASE_URL, drop_pending_updates=True)
+    else:
+        await bot.delete_webhook(drop_pending_updates=True)
+        await dp.start_polling(bot)
 
 if __name__ == "__main__":
     import asyncio
@@ -0,0 +1,193 @@
+import asyncio
+import io
+import logging
+import os
+import re
+from typing import Callable, Optional, Union
+
+import aiohttp
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import BufferedInputFile, Message
+
+from database import Database
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow не обязателен: без него фото загружаются как есть
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# file_id Telegram - base64url без точек и слешей, в отличие от путей и URL
+FILE_ID_RE = re.compile(r"[A-Za-z0-9_-]+")
+
+
+def is_file_id(photo: str) -> bool:
+    """В колонке photo может быть file_id Telegram, URL или путь к файлу"""
+    return FILE_ID_RE.fullmatch(photo) is not None and not os.path.isfile(photo)
+
+
+def shrink_image(data: bytes, max_side: int, compress_over: int, quality: int) -> bytes:
+    """Уменьшить фото до max_side по большей стороне и пережать в JPEG.
+
+    Telegram всё равно хранит фото не больше 1280 точек, поэтому загружать
+    оригинал больше этого - лишний трафик. Маленькие файлы не трогаем.
+    """
+    if Image is None:
+        return data
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if max(image.size) <= max_side and len(data) <= compress_over:
+                return data
+            image.thumbnail((max_side, max_side))
+            output = io.BytesIO()
+            image.convert("RGB").save(output, "JPEG", quality=quality, optimize=True)
+    except Exception as e:
+        logger.warning(f"Could not shrink image: {e}")
+        return data
+    shrunk = output.getvalue()
+    return shrunk if len(shrunk) < len(data) else data
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as file:
+        return file.read()
+
+
+class MediaCache:
+    """Фото товаров через file_id Telegram.
+
+    Фото из URL или локального файла при первой отправке загружается
+    в Telegram (предварительно уменьшенное), полученный file_id
+    сохраняется в products.photo_file_id, и дальше фото отправляется
+    по нему без повторной загрузки.
+
+    Если задан warmup_chat_id, фоновая задача заранее загружает фото
+    новых товаров: отправляет их без звука в этот служебный чат (отдельный
+    канал или группа, где бот может удалять сообщения) и сразу удаляет
+    сообщение. Проход запускается раз в interval секунд или сразу после
+    schedule(). Без служебного чата фото загружаются при первом показе.
+    on_cached(product_id) вызывается, когда у товара появился file_id.
+    """
+
+    def __init__(self, bot: Bot, db: Database, warmup_chat_id: Optional[int] = None,
+                 on_cached: Optional[Callable[[int], None]] = None, max_side: int = 1280,
+                 compress_over: int = 1024 * 1024, quality: int = 85, interval: float = 300,
+                 batch_size: int = 50, upload_delay: float = 1.0, download_timeout: float = 30):
+        self.bot = bot
+        self.db = db
+        self.warmup_chat_id = warmup_chat_id
+        self.on_cached = on_cached
+        self.max_side = max_side
+        self.compress_over = compress_over
+        self.quality = quality
+        self.interval = interval
+        self.batch_size = batch_size
+        self.upload_delay = upload_delay
+        self.download_timeout = download_timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def _read(self, photo: str) -> bytes:
+        if not photo.startswith(("http://", "https://")):
+            # Диск может быть медленным, не держим цикл событий на чтении
+            return await asyncio.get_running_loop().run_in_executor(None, _read_file, photo)
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.download_timeout))
+        async with self._session.get(photo) as response:
+            response.raise_for_status()
+            return await response.read()
+
+    async def input_file(self, photo: str) -> Union[str, BufferedInputFile]:
+        """Что передать в send_photo: сам file_id или уменьшенный файл"""
+        if is_file_id(photo):
+            return photo
+        data = await self._read(photo)
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(
+            None, shrink_image, data, self.max_side, self.compress_over, self.quality
+        )
+        return BufferedInputFile(data, filename=os.path.basename(photo) or "photo.jpg")
+
+    def _store(self, product_id: int, file_id: str):
+        self.db.set_photo_file_id(product_id, file_id)
+        if self.on_cached:
+            self.on_cached(product_id)
+
+    async def answer_photo(self, message: Message, product_id: int, photo: str, **kwargs) -> Message:
+        """message.answer_photo с запоминанием file_id после первой загрузки"""
+        sent = await message.answer_photo(photo=await self.input_file(photo), **kwargs)
+        if not is_file_id(photo):
+            self._store(product_id, sent.photo[-1].file_id)
+        return sent
+
+    async def warm_up(self) -> int:
+        """Загрузить фото всех товаров без file_id, вернуть число загруженных"""
+        uploaded = 0
+        after_id = 0
+        while True:
+            rows = self.db.get_products_to_upload(after_id, self.batch_size)
+            if not rows:
+                return uploaded
+            for product_id, photo in rows:
+                after_id = product_id
+                if is_file_id(photo):
+                    # Фото прислано админом в Telegram, загружать нечего
+                    self._store(product_id, photo)
+                    continue
+                try:
+                    sent = await self.bot.send_photo(
+                        self.warmup_chat_id, await self.input_file(photo), disable_notification=True
+                    )
+                except (OSError, aiohttp.ClientError, TelegramAPIError) as e:
+                    # Остальные товары не ждут, этот попробуем в следующий проход
+                    logger.warning(f"Photo upload for product {product_id} failed: {e}")
+                    continue
+                self._store(product_id, sent.photo[-1].file_id)
+                uploaded += 1
+                try:
+                    await self.bot.delete_message(self.warmup_chat_id, sent.message_id)
+                except TelegramAPIError:
+                    pass
+                await asyncio.sleep(self.upload_delay)
+
+    def schedule(self):
+        """Запустить проход загрузки, не дожидаясь interval"""
+        self._wake.set()
+
+    def start(self):
+        if self.warmup_chat_id is None:
+            logger.info("Photo warm-up disabled: no storage chat configured")
+            return
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
+            try:
+                uploaded = await self.warm_up()
+                if uploaded:
+                    logger.info(f"Uploaded {uploaded} product photos")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Photo warm-up failed: {e}", exc_info=True)
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
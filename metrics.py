@@ -0,0 +1,95 @@
+import time
+from collections import OrderedDict, defaultdict, deque
+from typing import Deque, Dict, Optional
+
+
+class Metrics:
+    """Простейшие метрики процесса: счётчики и распределения значений.
+
+    Для распределений хранится скользящее окно последних значений,
+    по которому считаются перцентили.
+    """
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self._counters: Dict[str, float] = defaultdict(float)
+        self._samples: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=self.window))
+
+    def inc(self, name: str, value: float = 1):
+        """Увеличить счётчик"""
+        self._counters[name] += value
+
+    def observe(self, name: str, value: float):
+        """Записать значение распределения (например, задержку в секундах)"""
+        self._samples[name].append(value)
+        self._counters[f"{name}_count"] += 1
+        self._counters[f"{name}_sum"] += value
+
+    def counter(self, name: str) -> float:
+        return self._counters.get(name, 0)
+
+    def percentile(self, name: str, q: float) -> Optional[float]:
+        """Перцентиль q (0..100) по окну последних значений"""
+        samples = self._samples.get(name)
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def summary(self, name: str) -> Dict[str, Optional[float]]:
+        """Количество, среднее и перцентили распределения"""
+        count = self.counter(f"{name}_count")
+        return {
+            "count": count,
+            "avg": self.counter(f"{name}_sum") / count if count else None,
+            "p50": self.percentile(name, 50),
+            "p95": self.percentile(name, 95),
+            "p99": self.percentile(name, 99),
+        }
+
+    def snapshot(self) -> Dict[str, float]:
+        """Все счётчики"""
+        return dict(self._counters)
+
+
+class ActivityTracker:
+    """Активность за скользящие окна: уникальные пользователи за active_window
+    секунд и число запросов за rate_window секунд. Учёт и чтение - O(1)
+    в среднем: устаревшие записи выбрасываются с начала очереди.
+    """
+
+    def __init__(self, active_window: float = 3600, rate_window: float = 60):
+        self.active_window = active_window
+        self.rate_window = rate_window
+        self._last_seen: "OrderedDict[int, float]" = OrderedDict()
+        self._requests: Deque[float] = deque()
+
+    def touch(self, user_id: int):
+        """Отметить запрос пользователя"""
+        now = time.monotonic()
+        self._last_seen[user_id] = now
+        self._last_seen.move_to_end(user_id)
+        self._requests.append(now)
+        self._expire(now)
+
+    def _expire(self, now: float):
+        while self._last_seen:
+            user_id, seen = next(iter(self._last_seen.items()))
+            if now - seen < self.active_window:
+                break
+            del self._last_seen[user_id]
+        while self._requests and now - self._requests[0] >= self.rate_window:
+            self._requests.popleft()
+
+    def active_users(self) -> int:
+        self._expire(time.monotonic())
+        return len(self._last_seen)
+
+    def requests_per_window(self) -> int:
+        self._expire(time.monotonic())
+        return len(self._requests)
+
+
+# Общий реестр метрик процесса
+metrics = Metrics()
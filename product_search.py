@@ -0,0 +1,253 @@
+import asyncio
+import heapq
+import html
+import re
+from bisect import bisect_left, insort
+from itertools import islice, product
+from typing import Dict, List, Optional, Set, Tuple
+
+from aiogram.types import (InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultArticle,
+                           InputTextMessageContent)
+
+from cache import LRUCache
+from catalog import PRODUCT_PREFIX
+from database import Database
+
+WORD_RE = re.compile(r"\w+")
+DESCRIPTION_PREVIEW = 100
+# При равном счёте выше товары с коротким названием: длина названия и id
+# упакованы в одно число, чтобы сортировать без key-функции
+ID_BITS = 32
+ID_MASK = (1 << ID_BITS) - 1
+
+# (название, описание, цена, фото)
+IndexedProduct = Tuple[str, str, int, Optional[str]]
+
+
+def words(text: str) -> List[str]:
+    return WORD_RE.findall(text.lower().replace("ё", "е"))
+
+
+def trigrams(word: str) -> Set[str]:
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+class ProductIndex:
+    """Поиск товаров для inline-режима по словарю в памяти.
+
+    Для каждого слова из названий и описаний хранятся множества товаров,
+    где оно встречается. Слово запроса ищется по отсортированному словарю
+    как начало слова (бинарный поиск) и, от трёх букв, как его часть
+    через индекс триграмм. Товар должен совпасть со всеми словами
+    запроса; выше те, где совпадение полнее и приходится на название.
+    Кандидаты собираются операциями над множествами, поэтому даже
+    слово из каждого второго товара не перебирается поштучно.
+
+    Индекс строится при первом поиске (или rebuild), новые товары
+    добавляются через add. refresh перестраивает индекс в пуле потоков
+    и подменяет готовым, не останавливая цикл событий: до подмены поиск
+    идёт по старому индексу. Ранжированные id по каждому запросу и
+    совпадения по каждому слову хранятся в LRU-кэшах, которые
+    сбрасываются при изменении индекса.
+    """
+
+    def __init__(self, db: Database, cache_size: int = 1000, max_ranked: int = 200,
+                 max_expansions: int = 500, max_terms: int = 4):
+        self.db = db
+        self.max_ranked = max_ranked
+        self.max_expansions = max_expansions
+        self.max_terms = max_terms
+        self._products: Dict[int, IndexedProduct] = {}
+        self._tiebreak: Dict[int, int] = {}
+        self._in_names: Dict[str, Set[int]] = {}
+        self._in_descriptions: Dict[str, Set[int]] = {}
+        self._vocabulary: List[str] = []
+        self._trigrams: Dict[str, Set[str]] = {}
+        self._results = LRUCache(cache_size)
+        # Уровни по отдельным словам: при наборе запроса первые слова повторяются
+        self._levels = LRUCache(cache_size)
+        self._built = False
+        self._refresh_lock = asyncio.Lock()
+        # Товары, добавленные, пока строится новый индекс: в нём их может не быть
+        self._added_during_refresh: Optional[List[int]] = None
+
+    def rebuild(self):
+        """Перестроить индекс по всей таблице товаров"""
+        self._build(self.db.get_products())
+
+    def _build(self, rows: List[Tuple]):
+        self._products, self._tiebreak, self._trigrams = {}, {}, {}
+        self._in_names, self._in_descriptions = {}, {}
+        vocabulary = []
+        for row in rows:
+            vocabulary += self._index(row)
+        self._vocabulary = sorted(vocabulary)
+        self._results.clear()
+        self._levels.clear()
+        self._built = True
+
+    async def refresh(self):
+        """Перестроить индекс в пуле потоков и подменить старый готовым"""
+        async with self._refresh_lock:
+            # Соединение Database привязано к своему потоку, поэтому читаем здесь,
+            # а в пул уходит только построение словаря
+            rows = self.db.get_products()
+            self._added_during_refresh = []
+            fresh = ProductIndex(self.db, cache_size=1, max_ranked=self.max_ranked,
+                                 max_expansions=self.max_expansions, max_terms=self.max_terms)
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, fresh._build, rows)
+            finally:
+                added, self._added_during_refresh = self._added_during_refresh, None
+            self._products, self._tiebreak, self._trigrams = fresh._products, fresh._tiebreak, fresh._trigrams
+            self._in_names, self._in_descriptions = fresh._in_names, fresh._in_descriptions
+            self._vocabulary = fresh._vocabulary
+            self._results.clear()
+            self._levels.clear()
+            self._built = True
+            for product_id in added:
+                self.add(product_id)
+
+    def add(self, product_id: int):
+        """Добавить в индекс новый товар"""
+        if self._added_during_refresh is not None:
+            self._added_during_refresh.append(product_id)
+        if not self._built:
+            return
+        row = self.db.get_product(product_id)
+        if row is not None:
+            for word in self._index(row):
+                insort(self._vocabulary, word)
+            self._results.clear()
+            self._levels.clear()
+
+    def _index(self, row: Tuple) -> List[str]:
+        # Возвращает слова, которых раньше не было в словаре
+        product_id, name, description, price, photo = row[:5]
+        self._products[product_id] = (name, description or "", price, photo)
+        self._tiebreak[product_id] = min(len(name), 0xFFFF) << ID_BITS | product_id
+        new_words = []
+        for postings, other, text in (
+            (self._in_names, self._in_descriptions, name),
+            (self._in_descriptions, self._in_names, description or ""),
+        ):
+            for word in set(words(text)):
+                ids = postings.get(word)
+                if ids is None:
+                    ids = postings[word] = set()
+                    if word not in other:
+                        new_words.append(word)
+                        for trigram in trigrams(word):
+                            self._trigrams.setdefault(trigram, set()).add(word)
+                ids.add(product_id)
+        return new_words
+
+    def _term_levels(self, term: str) -> List[Tuple[int, Set[int]]]:
+        """Товары, совпавшие со словом запроса, по убыванию счёта совпадения.
+
+        Слово целиком весит больше начала слова, начало - больше середины,
+        совпадение в названии - вдвое больше, чем в описании.
+        """
+        exact_name, exact_description = set(), set()
+        prefix_name, prefix_description = set(), set()
+        infix_name, infix_description = set(), set()
+        in_names, in_descriptions = self._in_names, self._in_descriptions
+        empty: Set[int] = set()
+        vocabulary = self._vocabulary
+        i = bisect_left(vocabulary, term)
+        end = min(i + self.max_expansions, len(vocabulary))
+        while i < end and vocabulary[i].startswith(term):
+            word = vocabulary[i]
+            if word == term:
+                exact_name |= in_names.get(word, empty)
+                exact_description |= in_descriptions.get(word, empty)
+            else:
+                prefix_name |= in_names.get(word, empty)
+                prefix_description |= in_descriptions.get(word, empty)
+            i += 1
+        if len(term) >= 3:
+            # Слова, содержащие все триграммы запроса; начинающиеся с него уже учтены
+            candidates = sorted((self._trigrams.get(t, empty) for t in trigrams(term)), key=len)
+            for word in set.intersection(*candidates):
+                if term in word and not word.startswith(term):
+                    infix_name |= in_names.get(word, empty)
+                    infix_description |= in_descriptions.get(word, empty)
+        return [
+            (6, exact_name), (4, prefix_name), (3, exact_description),
+            (2, prefix_description), (2, infix_name), (1, infix_description),
+        ]
+
+    def _best(self, ids: Set[int], limit: int) -> List[int]:
+        tiebreak = self._tiebreak
+        keys = [tiebreak[product_id] for product_id in ids]
+        return [key & ID_MASK for key in heapq.nsmallest(limit, keys)]
+
+    def _rank(self, query: str) -> List[int]:
+        # Самые длинные слова запроса точнее, остальные не учитываем
+        terms = sorted(set(words(query)), key=len, reverse=True)[:self.max_terms]
+        if not terms:
+            # Пустой запрос - последние добавленные товары
+            return list(islice(reversed(self._products), self.max_ranked))
+
+        per_term = []
+        for term in terms:
+            levels = self._levels.get(term)
+            if levels is None:
+                levels = [(score, ids) for score, ids in self._term_levels(term) if ids]
+                self._levels.set(term, levels)
+            if not levels:
+                return []
+            per_term.append(levels)
+
+        # Счёт товара - сумма счетов сочетания уровней, по одному на слово.
+        # Идём от лучших сочетаний: товар впервые встречается в своём лучшем,
+        # из худших он отбрасывается. Останавливаемся, набрав max_ranked.
+        by_score: Dict[int, List[Tuple]] = {}
+        for combination in product(*per_term):
+            by_score.setdefault(sum(score for score, _ in combination), []).append(combination)
+        ranked: List[int] = []
+        seen: Set[int] = set()
+        for score in sorted(by_score, reverse=True):
+            matched: Set[int] = set()
+            for combination in by_score[score]:
+                matched |= set.intersection(*sorted((ids for _, ids in combination), key=len))
+            matched -= seen
+            best = self._best(matched, self.max_ranked - len(ranked))
+            ranked += best
+            if len(ranked) >= self.max_ranked:
+                break
+            seen.update(best)
+        return ranked
+
+    def search(self, query: str, offset: int = 0, limit: int = 50) -> Tuple[List[Tuple], Optional[int]]:
+        """([(id, название, описание, цена, фото)], смещение следующей страницы или None)"""
+        if not self._built:
+            self.rebuild()
+        key = " ".join(words(query))
+        ranked = self._results.get(key)
+        if ranked is None:
+            ranked = self._rank(query)
+            self._results.set(key, ranked)
+        page = [(product_id, *self._products[product_id]) for product_id in ranked[offset:offset + limit]]
+        next_offset = offset + limit if offset + limit < len(ranked) else None
+        return page, next_offset
+
+
+def inline_results(products: List[Tuple], bot_username: str) -> List[InlineQueryResultArticle]:
+    """Результаты inline-запроса: карточка товара с кнопкой перехода в бота"""
+    results = []
+    for product_id, name, description, price, photo in products:
+        button = InlineKeyboardButton(
+            text="🛍️ Открыть в магазине",
+            url=f"https://t.me/{bot_username}?start={PRODUCT_PREFIX}{product_id}"
+        )
+        text = f"<b>{html.escape(name)}</b>\n\n{html.escape(description)}\n\n💰 Цена: <b>{price}₽</b>"
+        results.append(InlineQueryResultArticle(
+            id=str(product_id),
+            title=f"{name} - {price}₽",
+            description=description[:DESCRIPTION_PREVIEW] or None,
+            thumbnail_url=photo if photo and photo.startswith(("http://", "https://")) else None,
+            input_message_content=InputTextMessageContent(message_text=text),
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=[[button]])
+        ))
+    return results
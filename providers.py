@@ -0,0 +1,261 @@
+import logging
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional, Tuple
+
+from http_client import APIClient
+from resilience import CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+AUTO = "auto"
+LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, float("inf"))  # Секунд
+
+
+class NoProviderAvailable(Exception):
+    """Ни один провайдер не смог ответить"""
+
+
+# ====== СТАТИСТИКА ====== #
+class ProviderStats:
+    """Скользящие показатели провайдера: EWMA задержки и доли ошибок, запросы в полёте.
+
+    Доля ошибок ещё и затухает со временем (вдвое за error_half_life секунд),
+    иначе провайдер, признанный нездоровым, почти не получает запросов и
+    никогда не вернулся бы в строй.
+    """
+
+    def __init__(self, alpha: float = 0.2, error_half_life: float = 60):
+        self.alpha = alpha
+        self.error_half_life = error_half_life
+        self.latency: Optional[float] = None
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.histogram = [0] * len(LATENCY_BUCKETS)
+        self._error_rate = 0.0
+        self._error_rate_at = time.monotonic()
+
+    @property
+    def error_rate(self) -> float:
+        elapsed = time.monotonic() - self._error_rate_at
+        return self._error_rate * 0.5 ** (elapsed / self.error_half_life)
+
+    def record(self, latency: float, ok: bool):
+        self.requests += 1
+        if ok:
+            self.latency = latency if self.latency is None else (
+                self.alpha * latency + (1 - self.alpha) * self.latency)
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if latency <= bound:
+                    self.histogram[i] += 1
+                    break
+        else:
+            self.errors += 1
+        self._error_rate = self.alpha * (0.0 if ok else 1.0) + (1 - self.alpha) * self.error_rate
+        self._error_rate_at = time.monotonic()
+
+
+# ====== ПРОВАЙДЕРЫ ====== #
+class Provider:
+    """LLM-провайдер: как собрать запрос и разобрать ответ"""
+
+    def __init__(self, name: str, url: str, api_key: str, model: str):
+        self.name = name
+        self.url = url
+        self.api_key = api_key
+        self.model = model
+        self.stats = ProviderStats()
+
+    def build_request(self, prompt: str, temperature: float, stream: bool) -> Tuple[Dict[str, Any], Dict[str, str]]:
+        raise NotImplementedError
+
+    def parse_response(self, data: Dict[str, Any]) -> str:
+        raise NotImplementedError
+
+    def parse_chunk(self, data: Dict[str, Any]) -> str:
+        raise NotImplementedError
+
+
+class OpenAIProvider(Provider):
+    """OpenAI-совместимый API (OpenAI, DeepSeek)"""
+
+    def build_request(self, prompt, temperature, stream):
+        payload = {
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": temperature
+        }
+        if stream:
+            payload["stream"] = True
+        return payload, {"Authorization": f"Bearer {self.api_key}"}
+
+    def parse_response(self, data):
+        return data["choices"][0]["message"]["content"]
+
+    def parse_chunk(self, data):
+        choice = data["choices"][0]
+        # В потоке приходят delta-фрагменты, в обычном ответе - message целиком
+        return (choice.get("delta") or choice.get("message") or {}).get("content") or ""
+
+
+class ChadGPTProvider(Provider):
+    """ChadGPT public API"""
+
+    def build_request(self, prompt, temperature, stream):
+        payload = {"message": prompt, "api_key": self.api_key}
+        if stream:
+            payload["stream"] = True
+        return payload, {}
+
+    def parse_response(self, data):
+        if not data.get('is_success', False):
+            raise RuntimeError(data.get('error_message', 'Unknown error'))
+        return data['response']
+
+    def parse_chunk(self, data):
+        # Обычный JSON-ответ приходит целиком с флагом is_success,
+        # события потока содержат очередной фрагмент в поле response
+        if data.get('is_success') is False:
+            raise RuntimeError(data.get('error_message', 'Unknown error'))
+        return data.get('response') or ''
+
+
+# ====== РЕЕСТР ====== #
+class ProviderRegistry:
+    """Реестр провайдеров с выбором по задержке и автоматическим переключением.
+
+    Для режима "auto" провайдеры упорядочиваются по EWMA задержки с учётом
+    запросов в полёте; нездоровые (разомкнут предохранитель или доля ошибок
+    выше max_error_rate) идут последними. Явно выбранный провайдер пробуется
+    первым, остальные - как запасные. Если провайдер не ответил, запрос
+    уходит следующему.
+    """
+
+    def __init__(self, http: APIClient, max_error_rate: float = 0.5, decisions_kept: int = 50):
+        self.http = http
+        self.max_error_rate = max_error_rate
+        self.providers: Dict[str, Provider] = {}
+        self.decisions: Deque[Tuple[float, str, str, str]] = deque(maxlen=decisions_kept)
+
+    def register(self, provider: Provider):
+        self.providers[provider.name] = provider
+
+    def healthy(self, provider: Provider) -> bool:
+        if self.http.policy and self.http.policy.breaker(provider.url).state == CircuitBreaker.OPEN:
+            return False
+        return provider.stats.error_rate <= self.max_error_rate
+
+    def score(self, provider: Provider) -> float:
+        """Ожидаемая задержка; провайдеры без замеров пробуются первыми"""
+        latency = provider.stats.latency or 0.0
+        return latency * (1 + provider.stats.in_flight)
+
+    def route(self, preferred: str) -> List[Provider]:
+        """Провайдеры в порядке попыток"""
+        ranked = sorted(self.providers.values(), key=lambda p: (not self.healthy(p), self.score(p)))
+        chosen = self.providers.get(preferred)
+        if chosen is not None and preferred != AUTO:
+            ranked.remove(chosen)
+            ranked.insert(0, chosen)
+        return ranked
+
+    def _record_decision(self, preferred: str, provider: Provider, attempt: int):
+        reason = "fastest" if preferred == AUTO else "preferred"
+        if attempt:
+            reason = "failover"
+        self.decisions.append((time.time(), preferred, provider.name, reason))
+
+    async def generate(self, preferred: str, prompt: str, temperature: float,
+                       on_answer: Optional[Callable[[str], None]] = None) -> Optional[str]:
+        """Ответ первого успешно ответившего провайдера или None.
+
+        on_answer, если передан, вызывается с именем ответившего провайдера.
+        """
+        for attempt, provider in enumerate(self.route(preferred)):
+            self._record_decision(preferred, provider, attempt)
+            payload, headers = provider.build_request(prompt, temperature, stream=False)
+            provider.stats.in_flight += 1
+            started = time.monotonic()
+            try:
+                text = provider.parse_response(await self.http.post_json(provider.url, payload, headers))
+            except Exception as e:
+                provider.stats.record(time.monotonic() - started, ok=False)
+                logger.error(f"API Error ({provider.name}): {e}")
+                continue
+            finally:
+                provider.stats.in_flight -= 1
+            provider.stats.record(time.monotonic() - started, ok=True)
+            if on_answer is not None:
+                on_answer(provider.name)
+            return text
+        return None
+
+    async def stream(self, preferred: str, prompt: str, temperature: float,
+                     on_answer: Optional[Callable[[str], None]] = None) -> AsyncIterator[str]:
+        """Потоковый ответ; переключение на другого провайдера возможно только до первого фрагмента.
+
+        on_answer, если передан, вызывается с именем провайдера перед его первым фрагментом.
+        """
+        for attempt, provider in enumerate(self.route(preferred)):
+            self._record_decision(preferred, provider, attempt)
+            payload, headers = provider.build_request(prompt, temperature, stream=True)
+            provider.stats.in_flight += 1
+            started = time.monotonic()
+            delivered = False
+            try:
+                async for data in self.http.stream_sse(provider.url, payload, headers):
+                    chunk = provider.parse_chunk(data)
+                    if chunk:
+                        if not delivered and on_answer is not None:
+                            on_answer(provider.name)
+                        delivered = True
+                        yield chunk
+            except Exception as e:
+                provider.stats.record(time.monotonic() - started, ok=False)
+                logger.error(f"API Error ({provider.name}): {e}")
+                if delivered:
+                    raise
+                continue
+            finally:
+                provider.stats.in_flight -= 1
+            provider.stats.record(time.monotonic() - started, ok=True)
+            return
+        raise NoProviderAvailable(preferred)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Показатели всех провайдеров"""
+        return {
+            name: {
+                "healthy": self.healthy(provider),
+                "latency": provider.stats.latency,
+                "error_rate": provider.stats.error_rate,
+                "in_flight": provider.stats.in_flight,
+                "requests": provider.stats.requests,
+                "errors": provider.stats.errors,
+                "histogram": dict(zip(LATENCY_BUCKETS, provider.stats.histogram)),
+            }
+            for name, provider in self.providers.items()
+        }
+
+
+def format_providers_report(registry: ProviderRegistry, decisions: int = 5) -> str:
+    """HTML-отчёт для админ-команды /providers"""
+    text = "🛰 <b>Провайдеры</b>\n\n"
+    for name, stats in registry.stats().items():
+        latency = f"{stats['latency']:.2f}с" if stats['latency'] is not None else "—"
+        histogram = ", ".join(
+            f"≤{bound:g}с: {count}" if bound != float("inf") else f">{LATENCY_BUCKETS[-2]:g}с: {count}"
+            for bound, count in stats['histogram'].items() if count
+        )
+        text += (
+            f"{'🟢' if stats['healthy'] else '🔴'} <b>{name}</b>\n"
+            f"• EWMA задержки: {latency}, ошибки: {stats['error_rate']:.0%}\n"
+            f"• В работе: {stats['in_flight']}, всего: {stats['requests']} (ошибок {stats['errors']})\n"
+            f"• Гистограмма: {histogram or '—'}\n\n"
+        )
+    if registry.decisions:
+        text += "<b>Последние решения:</b>\n"
+        for at, preferred, chosen, reason in list(registry.decisions)[-decisions:]:
+            text += f"• {time.strftime('%H:%M:%S', time.localtime(at))} {preferred} → {chosen} ({reason})\n"
+    return text
@@ -0,0 +1,186 @@
+import asyncio
+import time
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import (
+    CopyMessage, CopyMessages, EditMessageCaption, EditMessageMedia, EditMessageReplyMarkup, EditMessageText,
+    ForwardMessage, ForwardMessages, SendAnimation, SendAudio, SendContact, SendDice, SendDocument,
+    SendInvoice, SendLocation, SendMediaGroup, SendMessage, SendPhoto, SendPoll, SendSticker, SendVenue,
+    SendVideo, SendVideoNote, SendVoice, TelegramMethod
+)
+
+from cache import LRUCache
+from metrics import metrics
+
+# Методы, на которые действуют ограничения Telegram на число сообщений
+EDIT_METHODS = (EditMessageText, EditMessageCaption, EditMessageMedia, EditMessageReplyMarkup)
+LIMITED_METHODS = EDIT_METHODS + (
+    SendMessage, SendPhoto, SendDocument, SendVideo, SendAudio, SendAnimation, SendVoice, SendVideoNote,
+    SendSticker, SendMediaGroup, SendLocation, SendVenue, SendContact, SendPoll, SendDice, SendInvoice,
+    CopyMessage, CopyMessages, ForwardMessage, ForwardMessages,
+)
+
+
+class TokenBucket:
+    """Не больше rate операций в секунду, всплеском до capacity.
+
+    reserve() сразу занимает место в очереди и возвращает, сколько ждать:
+    одновременные вызовы получают разные задержки, а не просыпаются разом.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        self._refill()
+        self.tokens -= 1
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def pause(self, seconds: float):
+        """Ничего нового не пропускать ближайшие seconds секунд"""
+        self._refill()
+        # Следующий reserve() получит задержку seconds; повторные паузы не складываются
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+
+class RateLimiter:
+    """Ограничение исходящих сообщений Telegram: общее и на каждый чат.
+
+    Telegram пропускает около 30 сообщений в секунду на бота и около
+    одного в секунду в один чат, дальше отвечает 429 (RetryAfter).
+    Бакеты чатов хранятся в LRU, давно молчавшие чаты вытесняются.
+    """
+
+    def __init__(self, rate: float = 25, burst: float = 5, per_chat_rate: float = 1,
+                 per_chat_burst: float = 3, max_chats: int = 10000):
+        self.global_bucket = TokenBucket(rate, burst)
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self._chats = LRUCache(max_chats)
+
+    def _chat_bucket(self, chat_id: Hashable) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.per_chat_rate, self.per_chat_burst)
+            self._chats.set(chat_id, bucket)
+        return bucket
+
+    def reserve(self, chat_id: Optional[Hashable] = None) -> float:
+        """Занять место под одно сообщение, вернуть задержку перед отправкой"""
+        delay = self.global_bucket.reserve()
+        if chat_id is not None:
+            delay = max(delay, self._chat_bucket(chat_id).reserve())
+        return delay
+
+    async def acquire(self, chat_id: Optional[Hashable] = None) -> float:
+        """Дождаться разрешения на отправку, вернуть время ожидания"""
+        delay = self.reserve(chat_id)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return delay
+
+    def pause(self, seconds: float, chat_id: Optional[Hashable] = None):
+        """Отложить отправку после RetryAfter: в чат или, без chat_id, все сообщения"""
+        bucket = self._chat_bucket(chat_id) if chat_id is not None else self.global_bucket
+        bucket.pause(seconds)
+
+
+class _PendingEdit:
+    def __init__(self, method: TelegramMethod):
+        self.method = method
+        self.task: Optional[asyncio.Task] = None
+
+
+class RateLimitMiddleware(BaseRequestMiddleware):
+    """Все исходящие сообщения бота через RateLimiter.
+
+    Подключается к сессии бота (bot.session.middleware(...)), поэтому
+    действует на любые message.answer, edit_text и т.п. без изменений
+    в обработчиках. Отправка сообщений ждёт общего и своего для чата
+    бюджета; остальные методы (callback.answer, getUpdates) идут сразу.
+
+    Правки одного сообщения, пришедшие, пока предыдущая ждёт очереди,
+    склеиваются: отправляется только последняя, и все вызвавшие получают
+    её результат. Правки одного сообщения уходят строго по очереди:
+    следующая отправляется только после ответа на предыдущую, иначе
+    старый текст мог бы прийти позже нового и затереть его.
+    На RetryAfter запрос повторяется после указанной паузы (не дольше
+    max_retry_after секунд, до max_retries раз).
+
+    Время ожидания пишется в метрику telegram_queue_wait_seconds, число
+    ответов 429 - в telegram_429, склеенные правки - в telegram_edits_coalesced.
+    """
+
+    def __init__(self, limiter: RateLimiter, max_retries: int = 3, max_retry_after: float = 60):
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.max_retry_after = max_retry_after
+        self._edits: Dict[Tuple, _PendingEdit] = {}
+        # Последняя начатая правка каждого сообщения - следующая ждёт её завершения
+        self._sending: Dict[Tuple, asyncio.Task] = {}
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod) -> Any:
+        if not isinstance(method, LIMITED_METHODS):
+            return await make_request(bot, method)
+        chat_id = getattr(method, "chat_id", None)
+        if not isinstance(method, EDIT_METHODS):
+            await self._acquire(chat_id)
+            return await self._request(make_request, bot, method, chat_id)
+
+        key = (type(method), chat_id, method.message_id, method.inline_message_id)
+        pending = self._edits.get(key)
+        if pending is not None:
+            pending.method = method
+            metrics.inc("telegram_edits_coalesced")
+        else:
+            pending = self._edits[key] = _PendingEdit(method)
+            previous = self._sending.get(key)
+            pending.task = asyncio.create_task(self._edit(key, pending, previous, make_request, bot, chat_id))
+            self._sending[key] = pending.task
+            # Ошибку заберут ждущие; если их всех отменили, она не должна попасть в лог как потерянная
+            pending.task.add_done_callback(lambda task: task.cancelled() or task.exception())
+            pending.task.add_done_callback(lambda task: self._sent(key, task))
+        # Отмена одного из ждущих не должна отменять правку для остальных
+        return await asyncio.shield(pending.task)
+
+    async def _edit(self, key: Tuple, pending: _PendingEdit, previous: Optional[asyncio.Task],
+                    make_request: NextRequestMiddlewareType, bot: Bot, chat_id: Optional[Hashable]) -> Any:
+        try:
+            if previous is not None:
+                # Ошибка предыдущей правки досталась её вызвавшим, здесь важен только порядок
+                await asyncio.wait([previous])
+            await self._acquire(chat_id)
+        finally:
+            # Дальше правки этого сообщения встают в очередь заново
+            del self._edits[key]
+        return await self._request(make_request, bot, pending.method, chat_id)
+
+    def _sent(self, key: Tuple, task: asyncio.Task):
+        if self._sending.get(key) is task:
+            del self._sending[key]
+
+    async def _acquire(self, chat_id: Optional[Hashable]):
+        metrics.observe("telegram_queue_wait_seconds", await self.limiter.acquire(chat_id))
+
+    async def _request(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod,
+                       chat_id: Optional[Hashable]) -> Any:
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                metrics.inc("telegram_429")
+                if attempt == self.max_retries or e.retry_after > self.max_retry_after:
+                    raise
+                self.limiter.pause(e.retry_after, chat_id)
+                await self._acquire(chat_id)
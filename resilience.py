@@ -0,0 +1,212 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Optional
+
+import aiohttp
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+
+class CircuitOpen(Exception):
+    """Провайдер недоступен, запрос отклонён без обращения к нему"""
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Можно ли повторить запрос после такой ошибки"""
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status in RETRYABLE_STATUSES
+    return isinstance(error, (asyncio.TimeoutError, aiohttp.ClientConnectionError))
+
+
+# ====== ПРЕДОХРАНИТЕЛЬ ====== #
+class CircuitBreaker:
+    """Предохранитель для одного адреса API.
+
+    После failure_threshold неудач подряд размыкается и reset_timeout секунд
+    отклоняет запросы сразу. Затем пропускает один пробный запрос: успех
+    замыкает цепь, неудача снова размыкает её.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started_at: Optional[float] = None
+
+    def allow(self) -> bool:
+        """Можно ли отправить запрос сейчас"""
+        if self.state == self.CLOSED:
+            return True
+        now = time.monotonic()
+        if self.state == self.OPEN and now - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self.probe_started_at = None
+        if self.state == self.HALF_OPEN:
+            # Пробный запрос, о котором так и не сообщили (отменён), не держит цепь вечно
+            if self.probe_started_at is None or now - self.probe_started_at >= self.reset_timeout:
+                self.probe_started_at = now
+                return True
+        return False
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.probe_started_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        self.probe_started_at = None
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+# ====== ПОЛИТИКА ПОВТОРОВ ====== #
+class ResiliencePolicy:
+    """Повторы, дублирующие запросы и предохранители для запросов к API.
+
+    - повтор при сетевых ошибках и статусах из RETRYABLE_STATUSES,
+      не больше retries раз, с экспоненциальной задержкой и случайным разбросом;
+    - при hedge=True, если ответ не пришёл за p95 обычного времени ответа,
+      отправляется второй такой же запрос и берётся первый успешный ответ;
+    - отдельный CircuitBreaker на каждый адрес API.
+    """
+
+    def __init__(self, retries: int = 2, backoff_base: float = 0.5, backoff_max: float = 5,
+                 hedge: bool = False, hedge_min_delay: float = 1.0,
+                 failure_threshold: int = 5, reset_timeout: float = 30):
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._latencies: Dict[str, Deque[float]] = {}
+
+    def breaker(self, endpoint: str) -> CircuitBreaker:
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            breaker = self._breakers[endpoint] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+        return breaker
+
+    def backoff(self, attempt: int) -> float:
+        """Задержка перед повтором: экспонента с полным случайным разбросом"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def hedge_delay(self, endpoint: str) -> Optional[float]:
+        """Через сколько секунд отправлять дублирующий запрос (p95 времени ответа).
+
+        Пока замеров мало, возвращает None - дублирующие запросы не отправляются.
+        """
+        latencies = self._latencies.get(endpoint)
+        if not latencies or len(latencies) < 20:
+            return None
+        ordered = sorted(latencies)
+        return max(self.hedge_min_delay, ordered[int(len(ordered) * 0.95) - 1])
+
+    async def call(self, endpoint: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        """Выполнить запрос func() с повторами и предохранителем"""
+        breaker = self._check_breaker(endpoint)
+        for attempt in range(self.retries + 1):
+            try:
+                if self.hedge:
+                    result = await self._hedged(endpoint, func)
+                else:
+                    result = await self._timed(endpoint, func)
+            except Exception as e:
+                if not is_retryable(e):
+                    # Провайдер ответил, просто ответ нам не подошёл
+                    breaker.record_success()
+                    raise
+                if attempt == self.retries:
+                    breaker.record_failure()
+                    raise
+                logger.warning(f"Retrying {endpoint} after error: {e!r}")
+                metrics.inc("llm_retries")
+                await asyncio.sleep(self.backoff(attempt))
+            else:
+                breaker.record_success()
+                return result
+
+    async def stream(self, endpoint: str, func: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """Потоковый вариант call(): повтор возможен только до первого фрагмента"""
+        breaker = self._check_breaker(endpoint)
+        for attempt in range(self.retries + 1):
+            started = False
+            try:
+                async for item in func():
+                    started = True
+                    yield item
+            except Exception as e:
+                if not is_retryable(e):
+                    breaker.record_success()
+                    raise
+                if started or attempt == self.retries:
+                    breaker.record_failure()
+                    raise
+                logger.warning(f"Retrying {endpoint} after error: {e!r}")
+                metrics.inc("llm_retries")
+                await asyncio.sleep(self.backoff(attempt))
+            else:
+                breaker.record_success()
+                return
+
+    def _check_breaker(self, endpoint: str) -> CircuitBreaker:
+        breaker = self.breaker(endpoint)
+        if not breaker.allow():
+            metrics.inc("llm_circuit_rejected")
+            raise CircuitOpen(endpoint)
+        return breaker
+
+    async def _timed(self, endpoint: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        started = time.monotonic()
+        result = await func()
+        self._latencies.setdefault(endpoint, deque(maxlen=200)).append(time.monotonic() - started)
+        return result
+
+    async def _hedged(self, endpoint: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        delay = self.hedge_delay(endpoint)
+        if delay is None:
+            return await self._timed(endpoint, func)
+
+        first = asyncio.ensure_future(self._timed(endpoint, func))
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            return first.result()
+
+        metrics.inc("llm_hedged")
+        pending = {first, asyncio.ensure_future(self._timed(endpoint, func))}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Состояние предохранителей по адресам"""
+        return {
+            endpoint: {"state": breaker.state, "failures": breaker.failures}
+            for endpoint, breaker in self._breakers.items()
+        }
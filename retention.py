@@ -0,0 +1,89 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Optional
+
+from metrics import metrics
+from storage import Storage
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryRetention:
+    """Фоновая очистка истории по сроку и лимитам записей.
+
+    Раз в interval секунд удаляет записи старше max_age_days, сверх
+    max_rows_per_user у каждого пользователя и сверх max_rows во всей
+    истории (None - ограничения нет). Удаление идёт пачками по batch_size
+    строк отдельными транзакциями, между пачками обработчики успевают
+    обратиться к базе. Освободившиеся страницы возвращаются системе
+    через incremental_vacuum такими же небольшими порциями.
+    """
+
+    def __init__(self, storage: Storage, max_rows_per_user: Optional[int] = None,
+                 max_rows: Optional[int] = None, max_age_days: Optional[float] = None,
+                 interval: float = 3600, batch_size: int = 500, vacuum_pages: int = 1000):
+        self.storage = storage
+        self.max_rows_per_user = max_rows_per_user
+        self.max_rows = max_rows
+        self.max_age_days = max_age_days
+        self.interval = interval
+        self.batch_size = batch_size
+        self.vacuum_pages = vacuum_pages
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _delete_batches(self, delete: Callable[[], Awaitable[int]]) -> int:
+        total = 0
+        while True:
+            deleted = await delete()
+            total += deleted
+            if deleted < self.batch_size:
+                return total
+            await asyncio.sleep(0)
+
+    async def run_once(self) -> int:
+        """Один проход очистки, возвращает число удалённых записей"""
+        deleted = 0
+        if self.max_age_days is not None:
+            cutoff = (datetime.now(timezone.utc) - timedelta(days=self.max_age_days)).strftime("%Y-%m-%d %H:%M:%S")
+            deleted += await self._delete_batches(
+                lambda: self.storage.delete_history_older(cutoff, self.batch_size))
+        if self.max_rows_per_user is not None:
+            for user_id in await self.storage.users_over_history_limit(self.max_rows_per_user):
+                deleted += await self._delete_batches(
+                    lambda: self.storage.delete_user_history_over(user_id, self.max_rows_per_user, self.batch_size))
+        if self.max_rows is not None:
+            deleted += await self._delete_batches(
+                lambda: self.storage.delete_history_over_total(self.max_rows, self.batch_size))
+
+        # Свободные страницы остаются и после clear_user_history, поэтому сжимаем всегда
+        while await self.storage.incremental_vacuum(self.vacuum_pages):
+            await asyncio.sleep(0)
+
+        if deleted:
+            metrics.inc("history_rows_expired", deleted)
+            logger.info(f"History retention: deleted {deleted} rows")
+        return deleted
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"History retention failed: {e}", exc_info=True)
+            await asyncio.sleep(self.interval)
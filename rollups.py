@@ -0,0 +1,103 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+
+from storage import ROLLUP_LATENCY_BUCKETS, Storage
+
+logger = logging.getLogger(__name__)
+
+# Период отчёта /stats: (часовые сводки или дневные, длительность)
+PERIODS = {
+    "day": (True, timedelta(days=1)),
+    "week": (False, timedelta(days=7)),
+    "month": (False, timedelta(days=30)),
+}
+
+
+class UsageRollups:
+    """Фоновое наполнение сводок использования.
+
+    Раз в interval секунд переносит новые записи истории в часовые
+    и дневные сводки пачками по batch_size. Что уже учтено, хранится
+    в базе вместе со сводками, поэтому после перезапуска работа
+    продолжается с того же места.
+    """
+
+    def __init__(self, storage: Storage, interval: float = 300, batch_size: int = 10000):
+        self.storage = storage
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run_once(self) -> int:
+        """Учесть все новые записи, вернуть их число"""
+        total = 0
+        while True:
+            added = await self.storage.rollup_history(self.batch_size)
+            total += added
+            if not added:
+                return total
+            await asyncio.sleep(0)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Usage rollup failed: {e}", exc_info=True)
+            await asyncio.sleep(self.interval)
+
+
+def _histogram_percentile(counts: List[int], q: float) -> Optional[str]:
+    total = sum(counts)
+    if not total:
+        return None
+    threshold = total * q / 100
+    seen = 0
+    for i, count in enumerate(counts):
+        seen += count
+        if seen >= threshold:
+            if i < len(ROLLUP_LATENCY_BUCKETS):
+                return f"≤{ROLLUP_LATENCY_BUCKETS[i]:g}с"
+            return f">{ROLLUP_LATENCY_BUCKETS[-1]:g}с"
+    return None
+
+
+async def format_usage_report(storage: Storage, period: str) -> str:
+    """HTML-отчёт для админ-команды /stats по данным сводок"""
+    hourly, length = PERIODS[period]
+    since = datetime.now(timezone.utc) - length
+    bucket = since.strftime("%Y-%m-%d %H:00") if hourly else since.strftime("%Y-%m-%d")
+    rows: List[Tuple] = await storage.get_usage(hourly, bucket)
+    if not rows:
+        return f"📊 <b>Статистика ({period})</b>\n\nЗа период запросов нет"
+
+    text = f"📊 <b>Статистика ({period})</b>\n\n"
+    for model, requests, prompt_chars, response_chars, latency_sum, latency_count, *buckets in rows:
+        text += (
+            f"<b>{model.upper()}</b>: {requests} запросов\n"
+            f"• Средний запрос: {prompt_chars / requests:.0f} симв., ответ: {response_chars / requests:.0f} симв.\n"
+        )
+        if latency_count:
+            text += (
+                f"• Время ответа: среднее {latency_sum / latency_count:.1f}с, "
+                f"p50 {_histogram_percentile(buckets, 50)}, p95 {_histogram_percentile(buckets, 95)}\n"
+            )
+        text += "\n"
+    return text
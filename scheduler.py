@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Deque, Optional
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# on_wait(позиция в очереди, ожидаемое ожидание в секундах)
+WaitCallback = Callable[[int, float], Awaitable[None]]
+
+
+class QueueFull(Exception):
+    """Очередь переполнена, запрос отклонён"""
+
+
+class FairScheduler:
+    """Ограничение числа одновременных запросов к LLM с честной очередью.
+
+    Одновременно выполняется не больше max_concurrency запросов. Остальные
+    ждут в очередях по пользователям, которые обслуживаются по кругу: один
+    пользователь с десятком запросов не задерживает остальных дольше,
+    чем на один свой запрос. Если в очереди больше max_queue запросов
+    (или у пользователя больше max_per_user), новый запрос отклоняется.
+    """
+
+    def __init__(self, max_concurrency: int = 8, max_queue: int = 200, max_per_user: int = 3,
+                 update_interval: float = 3.0):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        self.update_interval = update_interval
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._queues: "OrderedDict[int, Deque[asyncio.Future]]" = OrderedDict()
+        self._durations: Deque[float] = deque(maxlen=100)
+
+    @asynccontextmanager
+    async def slot(self, user_id: int, on_wait: Optional[WaitCallback] = None) -> AsyncIterator[None]:
+        """Занять место на время запроса. Выбрасывает QueueFull при перегрузке."""
+        await self._acquire(user_id, on_wait)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - started)
+
+    def estimate_wait(self, position: int) -> float:
+        """Ожидаемое время ожидания для позиции в очереди, секунд"""
+        if not self._durations:
+            return 0.0
+        average = sum(self._durations) / len(self._durations)
+        return average * position / self.max_concurrency
+
+    def position(self, user_id: int, future: asyncio.Future) -> int:
+        """Позиция запроса в очереди с учётом обхода пользователей по кругу"""
+        queue = self._queues.get(user_id)
+        if not queue or future not in queue:
+            return 0
+        index = queue.index(future)
+        # До нашего круга каждый пользователь успеет получить до index мест,
+        # в нашем круге - ещё по одному те, кто стоит в обходе раньше нас
+        position = 1
+        before_us = True
+        for other_id, other in self._queues.items():
+            if other_id == user_id:
+                before_us = False
+            position += min(len(other), index)
+            if before_us and len(other) > index:
+                position += 1
+        return position
+
+    async def _acquire(self, user_id: int, on_wait: Optional[WaitCallback]):
+        if self.active < self.max_concurrency and not self.waiting:
+            self.active += 1
+            return
+
+        queue = self._queues.get(user_id)
+        if self.waiting >= self.max_queue or (queue and len(queue) >= self.max_per_user):
+            self.rejected += 1
+            metrics.inc("scheduler_rejected")
+            raise QueueFull()
+
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(user_id, deque()).append(future)
+        self.waiting += 1
+        queued_at = time.monotonic()
+        try:
+            last_position = None
+            while not future.done():
+                position = self.position(user_id, future)
+                if on_wait and position != last_position:
+                    last_position = position
+                    try:
+                        await on_wait(position, self.estimate_wait(position))
+                    except Exception as e:
+                        # Не удалось показать позицию (сеть, флуд-контроль) -
+                        # это не повод терять место в очереди
+                        logger.warning(f"Queue position callback failed: {e}")
+                try:
+                    await asyncio.wait_for(asyncio.shield(future), self.update_interval)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            if future.done() and not future.cancelled():
+                # Место уже выдано, но запрос отменили - возвращаем его
+                self._release(None)
+            else:
+                future.cancel()
+                self._discard(user_id, future)
+            raise
+        metrics.observe("scheduler_wait_seconds", time.monotonic() - queued_at)
+
+    def _discard(self, user_id: int, future: asyncio.Future):
+        queue = self._queues.get(user_id)
+        if queue and future in queue:
+            queue.remove(future)
+            self.waiting -= 1
+            if not queue:
+                del self._queues[user_id]
+
+    def _release(self, duration: Optional[float]):
+        self.active -= 1
+        if duration is not None:
+            self._durations.append(duration)
+        while self.active < self.max_concurrency and self._queues:
+            user_id, queue = next(iter(self._queues.items()))
+            future = queue.popleft()
+            self.waiting -= 1
+            if queue:
+                self._queues.move_to_end(user_id)
+            else:
+                del self._queues[user_id]
+            if not future.done():
+                self.active += 1
+                future.set_result(None)
+
+    def stats(self):
+        """Текущая загрузка планировщика"""
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "users_waiting": len(self._queues),
+        }
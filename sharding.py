@@ -0,0 +1,238 @@
+import asyncio
+import importlib
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import time
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import aiohttp
+from aiogram.types import Update
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_API = "https://api.telegram.org/bot{token}/{method}"
+
+
+def update_user_id(data: Dict[str, Any]) -> int:
+    """id отправителя из сырого обновления без полного разбора"""
+    for key, value in data.items():
+        if isinstance(value, dict):
+            sender = value.get("from") or value.get("user") or value.get("chat") or {}
+            return sender.get("id", 0)
+    return 0
+
+
+# ====== РАБОЧИЙ ПРОЦЕСС ====== #
+def _load_bot_module(module_name: str):
+    # При запуске через spawn модуль бота уже выполнен как __mp_main__,
+    # повторный импорт создал бы второй набор bot/dp/storage
+    main = sys.modules.get("__mp_main__")
+    if main is not None and os.path.splitext(os.path.basename(getattr(main, "__file__", "")))[0] == module_name:
+        return main
+    return importlib.import_module(module_name)
+
+
+def _worker_main(module_name: str, index: int, updates, queued, processing):
+    logging.basicConfig(level=logging.INFO)
+    module = _load_bot_module(module_name)
+    try:
+        asyncio.run(_worker_loop(module.dp, module.bot, index, updates, queued, processing))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _worker_loop(dp, bot, index: int, updates, queued, processing):
+    loop = asyncio.get_running_loop()
+    tasks = set()
+
+    async def feed(update: Update):
+        try:
+            await dp.feed_update(bot, update)
+        except Exception as e:
+            logger.error(f"Worker {index}: error processing update: {e}", exc_info=True)
+        finally:
+            with processing.get_lock():
+                processing.value -= 1
+
+    # worker_index позволяет обработчикам запуска делать разовую работу только в одном процессе
+    await dp.emit_startup(bot=bot, dispatcher=dp, worker_index=index)
+    logger.info(f"Worker {index} started (pid {os.getpid()})")
+    try:
+        while True:
+            data = await loop.run_in_executor(None, updates.get)
+            if data is None:
+                break
+            with queued.get_lock():
+                queued.value -= 1
+            with processing.get_lock():
+                processing.value += 1
+            update = Update.model_validate(data, context={"bot": bot})
+            # Обновления пользователя приходят в один процесс и запускаются
+            # в порядке поступления, как при обычном polling
+            task = asyncio.create_task(feed(update))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    finally:
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await bot.session.close()
+
+
+# ====== СУПЕРВИЗОР ====== #
+class _Shard:
+    def __init__(self, ctx, queue_size: int):
+        self.updates = ctx.Queue(maxsize=queue_size)
+        self.queued = ctx.Value("i", 0)
+        self.processing = ctx.Value("i", 0)
+        self.process: Optional[multiprocessing.Process] = None
+        self.restarts = 0
+
+
+class ShardSupervisor:
+    """Распределение обновлений по нескольким процессам.
+
+    Супервизор сам получает обновления через getUpdates, не разбирая их,
+    и раскладывает по workers процессам по user_id отправителя. Каждый
+    процесс импортирует модуль бота module_name и обрабатывает свою долю
+    обновлений тем же диспетчером и обработчиками. Все обновления одного
+    пользователя попадают в один процесс, поэтому их порядок сохраняется,
+    а кэш настроек пользователя в процессе остаётся согласованным с базой.
+    SQLite работает в режиме WAL, так что процессы делят базу безопасно.
+    Упавший процесс перезапускается. prepare, если передан, выполняется один
+    раз до запуска процессов - например, миграция базы, которую иначе
+    начали бы все процессы разом.
+    """
+
+    def __init__(self, module_name: str, token: str, workers: int = 0, queue_size: int = 1000,
+                 poll_timeout: int = 30, restart_delay: float = 1.0, report_interval: float = 60,
+                 prepare: Optional[Callable[[], Awaitable[Any]]] = None):
+        self.module_name = module_name
+        self.prepare = prepare
+        self.token = token
+        self.workers = workers or os.cpu_count() or 1
+        self.poll_timeout = poll_timeout
+        self.restart_delay = restart_delay
+        self.report_interval = report_interval
+        self._ctx = multiprocessing.get_context("spawn")
+        self._shards: List[_Shard] = [_Shard(self._ctx, queue_size) for _ in range(self.workers)]
+
+    def shard(self, user_id: int) -> int:
+        return user_id % self.workers
+
+    def _start(self, index: int):
+        shard = self._shards[index]
+        shard.process = self._ctx.Process(
+            target=_worker_main,
+            args=(self.module_name, index, shard.updates, shard.queued, shard.processing),
+            name=f"{self.module_name}-worker-{index}",
+            daemon=True
+        )
+        shard.process.start()
+
+    async def _api(self, session: aiohttp.ClientSession, method: str, **params) -> Any:
+        url = TELEGRAM_API.format(token=self.token, method=method)
+        async with session.post(url, json=params) as response:
+            data = await response.json()
+        if not data.get("ok"):
+            raise RuntimeError(data.get("description", "Telegram API error"))
+        return data["result"]
+
+    async def _dispatch(self, data: Dict[str, Any]):
+        shard = self._shards[self.shard(update_user_id(data))]
+        with shard.queued.get_lock():
+            shard.queued.value += 1
+        # Если процесс не успевает, put блокируется - это притормаживает опрос.
+        # Ждём короткими отрезками, чтобы остановка не повисла на полной очереди
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, partial(shard.updates.put, data, timeout=1))
+                return
+            except queue.Full:
+                continue
+
+    async def _poll(self):
+        timeout = aiohttp.ClientTimeout(total=self.poll_timeout + 10)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            await self._api(session, "deleteWebhook")
+            offset = None
+            while True:
+                try:
+                    updates = await self._api(session, "getUpdates", offset=offset, timeout=self.poll_timeout)
+                except (aiohttp.ClientError, asyncio.TimeoutError, RuntimeError) as e:
+                    logger.error(f"getUpdates failed: {e}")
+                    await asyncio.sleep(1)
+                    continue
+                for data in updates:
+                    offset = data["update_id"] + 1
+                    metrics.inc("shard_updates")
+                    await self._dispatch(data)
+
+    async def _monitor(self):
+        last_report = time.monotonic()
+        while True:
+            await asyncio.sleep(self.restart_delay)
+            for index, shard in enumerate(self._shards):
+                if not shard.process.is_alive():
+                    logger.error(f"Worker {index} exited with code {shard.process.exitcode}, restarting")
+                    shard.restarts += 1
+                    metrics.inc("shard_restarts")
+                    # Обновления, которые процесс обрабатывал, потеряны вместе с ним
+                    with shard.processing.get_lock():
+                        shard.processing.value = 0
+                    self._start(index)
+            if time.monotonic() - last_report >= self.report_interval:
+                last_report = time.monotonic()
+                logger.info("Shards: " + ", ".join(
+                    f"#{s['worker']} queued={s['queued']} processing={s['processing']}"
+                    for s in self.stats()
+                ))
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Очередь и состояние каждого процесса"""
+        return [
+            {
+                "worker": index,
+                "pid": shard.process.pid if shard.process else None,
+                "alive": bool(shard.process and shard.process.is_alive()),
+                "queued": shard.queued.value,
+                "processing": shard.processing.value,
+                "restarts": shard.restarts,
+            }
+            for index, shard in enumerate(self._shards)
+        ]
+
+    async def run(self):
+        """Запустить процессы и опрашивать Telegram до отмены"""
+        if self.prepare is not None:
+            await self.prepare()
+        for index in range(self.workers):
+            self._start(index)
+        logger.info(f"Started {self.workers} workers for {self.module_name}")
+        monitor = asyncio.create_task(self._monitor())
+        try:
+            await self._poll()
+        finally:
+            monitor.cancel()
+            for shard in self._shards:
+                try:
+                    shard.updates.put_nowait(None)
+                except queue.Full:
+                    # Процесс не разбирает очередь - ниже он будет остановлен принудительно
+                    pass
+            loop = asyncio.get_running_loop()
+            for index, shard in enumerate(self._shards):
+                await loop.run_in_executor(None, shard.process.join, 30)
+                if shard.process.is_alive():
+                    logger.warning(f"Worker {index} did not stop in time, terminating")
+                    shard.process.terminate()
+                    await loop.run_in_executor(None, shard.process.join)
+                # Недоставленные в очередь обновления не должны задерживать выход
+                shard.updates.cancel_join_thread()
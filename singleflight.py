@@ -0,0 +1,115 @@
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional
+
+from metrics import metrics
+
+
+class _SharedStream:
+    """Поток фрагментов, который читает один источник и раздаёт всем подписчикам.
+
+    Источник читает отдельная задача, поэтому таймаут или отмена одного
+    подписчика прерывают только его ожидание, а не общий поток.
+    """
+
+    def __init__(self, source: AsyncIterator[Any]):
+        self.chunks: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._changed = asyncio.Event()
+        self.task = asyncio.create_task(self._pump(source))
+
+    def _notify(self):
+        # Будим всех, кто ждёт сейчас; следующие ждут уже новое событие
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def _pump(self, source: AsyncIterator[Any]):
+        try:
+            async for chunk in source:
+                self.chunks.append(chunk)
+                self._notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+
+    async def iterate(self, timeout: Optional[float] = None) -> AsyncIterator[Any]:
+        """Фрагменты с начала потока; timeout - сколько ждать каждый следующий"""
+        position = 0
+        while True:
+            if position < len(self.chunks):
+                chunk = self.chunks[position]
+                position += 1
+                yield chunk
+                continue
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await asyncio.wait_for(self._changed.wait(), timeout)
+
+
+class SingleFlight:
+    """Склейка одинаковых одновременных запросов.
+
+    Пока запрос с ключом key выполняется, повторные вызовы с тем же ключом
+    не создают новый запрос, а ждут результата первого. Ожидание каждого
+    вызывающего защищено shield: таймаут или отмена одного ожидающего
+    не прерывают общий запрос для остальных.
+    """
+
+    def __init__(self):
+        self.leaders = 0
+        self.coalesced = 0
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self._streams: Dict[Hashable, _SharedStream] = {}
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]],
+                 timeout: Optional[float] = None) -> Any:
+        """Выполнить func() один раз на все одновременные вызовы с ключом key"""
+        task = self._calls.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(self._calls, key, done))
+        else:
+            self.coalesced += 1
+            metrics.inc("llm_coalesced")
+        return await asyncio.wait_for(asyncio.shield(task), timeout)
+
+    async def stream(self, key: Hashable, func: Callable[[], AsyncIterator[Any]],
+                     timeout: Optional[float] = None) -> AsyncIterator[Any]:
+        """Потоковый вариант do(): все подписчики получают одни и те же фрагменты с начала.
+
+        Если очередной фрагмент не пришёл за timeout секунд, у этого подписчика
+        выбрасывается asyncio.TimeoutError; общий поток продолжает работать.
+        """
+        shared = self._streams.get(key)
+        if shared is None:
+            self.leaders += 1
+            shared = _SharedStream(func())
+            self._streams[key] = shared
+            shared.task.add_done_callback(lambda done: self._forget(self._streams, key, shared))
+        else:
+            self.coalesced += 1
+            metrics.inc("llm_coalesced")
+        async for chunk in shared.iterate(timeout):
+            yield chunk
+
+    @staticmethod
+    def _forget(calls: Dict[Hashable, Any], key: Hashable, call: Any):
+        if calls.get(key) is call:
+            del calls[key]
+        if isinstance(call, asyncio.Task) and not call.cancelled():
+            # Ошибку забирают ожидающие; если их не осталось, не шумим в лог
+            call.exception()
+
+    def stats(self) -> Dict[str, int]:
+        """Число исходящих запросов, склеенных вызовов и запросов в полёте"""
+        return {
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._calls) + len(self._streams),
+        }
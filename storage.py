@@ -0,0 +1,851 @@
+import asyncio
+import logging
+import re
+import sqlite3
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional, Tuple
+
+from cache import LRUCache
+from history_writer import HistoryRow, HistoryWriter
+
+logger = logging.getLogger(__name__)
+
+# ====== SQL ====== #
+# Запросы держим константами: sqlite3 кэширует подготовленные выражения
+# по тексту запроса, поэтому одинаковые строки переиспользуются между вызовами.
+SQL_SELECT_SETTINGS = "SELECT model, temperature FROM user_settings WHERE user_id = ?"
+SQL_INSERT_SETTINGS = "INSERT OR IGNORE INTO user_settings (user_id, model, temperature) VALUES (?, ?, ?)"
+SQL_UPDATE_SETTING = {
+    "model": "UPDATE user_settings SET model = ? WHERE user_id = ?",
+    "temperature": "UPDATE user_settings SET temperature = ? WHERE user_id = ?",
+}
+SQL_RESET_SETTINGS = "UPDATE user_settings SET model = ?, temperature = ? WHERE user_id = ?"
+SQL_INSERT_HISTORY = """
+INSERT INTO history (user_id, timestamp, model, temperature, prompt, response, response_length, latency)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+SQL_SELECT_HISTORY = """
+SELECT timestamp, model, temperature, prompt, response
+FROM history
+WHERE user_id = ?
+ORDER BY id DESC
+LIMIT ?
+"""
+# Постраничный просмотр по ключу: страница стоит одинаково независимо от её номера.
+# В списке ответ не нужен целиком, поэтому берём только длину.
+SQL_SELECT_HISTORY_OLDER = """
+SELECT id, timestamp, model, temperature, prompt, COALESCE(response_length, length(response))
+FROM history
+WHERE user_id = ? AND id < ?
+ORDER BY id DESC
+LIMIT ?
+"""
+SQL_SELECT_HISTORY_NEWER = """
+SELECT id, timestamp, model, temperature, prompt, COALESCE(response_length, length(response))
+FROM history
+WHERE user_id = ? AND id > ?
+ORDER BY id ASC
+LIMIT ?
+"""
+SQL_SELECT_HISTORY_ENTRY = """
+SELECT id, timestamp, model, temperature, prompt, response
+FROM history
+WHERE user_id = ? AND id = ?
+"""
+SQL_DELETE_HISTORY = "DELETE FROM history WHERE user_id = ?"
+# Удаление по сроку и лимитам идёт небольшими пачками, чтобы не держать запись долго
+SQL_DELETE_HISTORY_OLDER = """
+DELETE FROM history WHERE id IN (
+    SELECT id FROM history WHERE timestamp < ? ORDER BY id LIMIT ?
+)
+"""
+SQL_HISTORY_NTH_NEWEST = "SELECT id FROM history ORDER BY id DESC LIMIT 1 OFFSET ?"
+SQL_DELETE_HISTORY_UPTO = """
+DELETE FROM history WHERE id IN (
+    SELECT id FROM history WHERE id <= ? ORDER BY id LIMIT ?
+)
+"""
+SQL_USERS_OVER_HISTORY_LIMIT = "SELECT user_id FROM history GROUP BY user_id HAVING COUNT(*) > ?"
+SQL_USER_HISTORY_NTH_NEWEST = "SELECT id FROM history WHERE user_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?"
+SQL_DELETE_USER_HISTORY_UPTO = """
+DELETE FROM history WHERE id IN (
+    SELECT id FROM history WHERE user_id = ? AND id <= ? ORDER BY id LIMIT ?
+)
+"""
+SQL_ADD_COUNTER = """
+INSERT INTO counters (name, value) VALUES (?, ?)
+ON CONFLICT (name) DO UPDATE SET value = value + excluded.value
+"""
+SQL_SELECT_COUNTERS = "SELECT name, value FROM counters"
+SQL_SELECT_CACHED_RESPONSE = "SELECT response, created_at, latency FROM response_cache WHERE key = ?"
+SQL_SELECT_CACHED_RESPONSE_SIZE = "SELECT size FROM response_cache WHERE key = ?"
+SQL_TOUCH_CACHED_RESPONSE = "UPDATE response_cache SET last_access = ? WHERE key = ?"
+SQL_UPSERT_CACHED_RESPONSE = """
+INSERT OR REPLACE INTO response_cache (key, response, size, latency, created_at, last_access)
+VALUES (?, ?, ?, ?, ?, ?)
+"""
+SQL_DELETE_CACHED_RESPONSE = "DELETE FROM response_cache WHERE key = ?"
+SQL_DELETE_EXPIRED_RESPONSES = "DELETE FROM response_cache WHERE created_at < ?"
+SQL_SIZE_CACHED_RESPONSES = "SELECT COALESCE(SUM(size), 0) FROM response_cache"
+SQL_OLDEST_CACHED_RESPONSES = "SELECT key, size FROM response_cache ORDER BY last_access"
+# Поиск: пользователь задаётся токеном владельца в отдельной колонке, так FTS5
+# пересекает списки документов сам и не ранжирует чужие записи
+SQL_SEARCH_HISTORY = """
+SELECT f.rowid, h.timestamp, h.model,
+       snippet(history_fts, 1, char(2), char(3), '…', 16),
+       snippet(history_fts, 2, char(2), char(3), '…', 16)
+FROM history_fts AS f
+JOIN history AS h ON h.id = f.rowid
+WHERE history_fts MATCH ?
+ORDER BY bm25(history_fts, 0.0, 2.0, 1.0)
+LIMIT ? OFFSET ?
+"""
+SQL_REBUILD_SEARCH = "INSERT INTO history_fts (history_fts) VALUES ('rebuild')"
+# Сводки: новые строки истории (id > последнего учтённого) группируются по часу
+# и модели и добавляются к часовым и дневным итогам одной транзакцией вместе
+# с новым значением курсора, поэтому повторный запуск ничего не задваивает
+ROLLUP_LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30)  # Верхние границы, секунд; последняя корзина - больше
+_ROLLUP_BUCKET_COLUMNS = [f"latency_b{i}" for i in range(len(ROLLUP_LATENCY_BUCKETS) + 1)]
+_ROLLUP_BUCKET_SUMS = [
+    f"SUM(latency <= {bound})" if i == 0 else
+    f"SUM(latency > {ROLLUP_LATENCY_BUCKETS[i - 1]} AND latency <= {bound})"
+    for i, bound in enumerate(ROLLUP_LATENCY_BUCKETS)
+] + [f"SUM(latency > {ROLLUP_LATENCY_BUCKETS[-1]})"]
+_ROLLUP_VALUE_COLUMNS = ["requests", "prompt_chars", "response_chars", "latency_sum", "latency_count"] + _ROLLUP_BUCKET_COLUMNS
+SQL_ROLLUP_NEXT_ID = "SELECT MAX(id) FROM (SELECT id FROM history WHERE id > ? ORDER BY id LIMIT ?)"
+SQL_ROLLUP_AGGREGATE = f"""
+SELECT strftime('%Y-%m-%d %H:00', timestamp), model, COUNT(*),
+       SUM(length(prompt)), SUM(COALESCE(response_length, length(response))),
+       COALESCE(SUM(latency), 0), COUNT(latency),
+       {", ".join(f"COALESCE({column}, 0)" for column in _ROLLUP_BUCKET_SUMS)}
+FROM history
+WHERE id > ? AND id <= ?
+GROUP BY 1, 2
+"""
+SQL_ROLLUP_UPSERT = {
+    table: f"""
+    INSERT INTO {table} (bucket, model, {", ".join(_ROLLUP_VALUE_COLUMNS)})
+    VALUES (?, ?, {", ".join("?" for _ in _ROLLUP_VALUE_COLUMNS)})
+    ON CONFLICT (bucket, model) DO UPDATE SET
+    {", ".join(f"{column} = {column} + excluded.{column}" for column in _ROLLUP_VALUE_COLUMNS)}
+    """
+    for table in ("usage_hourly", "usage_daily")
+}
+SQL_SELECT_USAGE = {
+    table: f"""
+    SELECT model, {", ".join(f"SUM({column})" for column in _ROLLUP_VALUE_COLUMNS)}
+    FROM {table}
+    WHERE bucket >= ?
+    GROUP BY model
+    ORDER BY 2 DESC
+    """
+    for table in ("usage_hourly", "usage_daily")
+}
+SQL_SET_COUNTER = "INSERT OR REPLACE INTO counters (name, value) VALUES (?, ?)"
+SQL_SELECT_USERS = "SELECT DISTINCT user_id FROM user_settings"
+SQL_SELECT_COUNTER = "SELECT value FROM counters WHERE name = ?"
+# Рассылки: получатели читаются по возрастанию user_id порциями после курсора,
+# результаты порции и новый курсор пишутся одной транзакцией
+SQL_INSERT_BROADCAST = """
+INSERT INTO broadcasts (from_chat_id, message_id, status_chat_id, status_message_id, status, created_at)
+VALUES (?, ?, ?, ?, 'running', ?)
+"""
+_BROADCAST_COLUMNS = "id, from_chat_id, message_id, status_chat_id, status_message_id, status, cursor, sent, failed"
+SQL_SELECT_BROADCAST = f"SELECT {_BROADCAST_COLUMNS} FROM broadcasts WHERE id = ?"
+SQL_SELECT_RUNNING_BROADCASTS = f"SELECT {_BROADCAST_COLUMNS} FROM broadcasts WHERE status = 'running' ORDER BY id"
+SQL_SELECT_LAST_BROADCAST = f"SELECT {_BROADCAST_COLUMNS} FROM broadcasts ORDER BY id DESC LIMIT 1"
+SQL_SET_BROADCAST_STATUS = "UPDATE broadcasts SET status = ? WHERE id = ?"
+SQL_SELECT_RECIPIENTS = "SELECT user_id FROM user_settings WHERE user_id > ? ORDER BY user_id LIMIT ?"
+SQL_COUNT_RECIPIENTS = "SELECT COUNT(*) FROM user_settings WHERE user_id > ?"
+SQL_INSERT_RECIPIENT = """
+INSERT OR REPLACE INTO broadcast_recipients (broadcast_id, user_id, status, error) VALUES (?, ?, ?, ?)
+"""
+SQL_ADVANCE_BROADCAST = "UPDATE broadcasts SET cursor = ?, sent = sent + ?, failed = failed + ? WHERE id = ?"
+
+# ====== МИГРАЦИИ ====== #
+# Версия схемы хранится в PRAGMA user_version. Миграция с номером N
+# переводит базу с версии N - 1 на N; новые миграции добавляются в конец.
+MIGRATIONS = [
+    # 1: история пользователя читается от новых записей к старым по id
+    [
+        "CREATE INDEX IF NOT EXISTS idx_history_user_id_id ON history (user_id, id DESC)",
+        "DROP INDEX IF EXISTS idx_history_user_id",
+    ],
+    # 2: длина ответа (сам ответ может храниться сжатым), счётчики,
+    # постепенное освобождение места. VACUUM нужен, чтобы включить
+    # auto_vacuum в существующей базе, и выполняется один раз после
+    # фиксации шага (внутри транзакции VACUUM невозможен).
+    [
+        "ALTER TABLE history ADD COLUMN response_length INTEGER",
+        "CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL DEFAULT 0)",
+        "PRAGMA auto_vacuum = INCREMENTAL",
+        "VACUUM",
+    ],
+    # 3: полнотекстовый поиск по истории. Ответы могут быть сжаты, поэтому
+    # индекс читает текст через представление с функцией unpack_response.
+    [
+        """
+        CREATE VIEW IF NOT EXISTS history_text AS
+        SELECT id, 'u' || user_id AS owner, prompt, unpack_response(response) AS response
+        FROM history
+        """,
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(
+            owner, prompt, response,
+            content='history_text', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS history_fts_insert AFTER INSERT ON history BEGIN
+            INSERT INTO history_fts (rowid, owner, prompt, response)
+            VALUES (new.id, 'u' || new.user_id, new.prompt, unpack_response(new.response));
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS history_fts_delete AFTER DELETE ON history BEGIN
+            INSERT INTO history_fts (history_fts, rowid, owner, prompt, response)
+            VALUES ('delete', old.id, 'u' || old.user_id, old.prompt, unpack_response(old.response));
+        END
+        """,
+        SQL_REBUILD_SEARCH,
+    ],
+    # 4: счётчики пользователей и запросов для /status поддерживают триггеры,
+    # так они верны и при нескольких процессах, работающих с одной базой
+    [
+        "INSERT OR REPLACE INTO counters (name, value) VALUES ('users', (SELECT COUNT(*) FROM user_settings))",
+        """
+        INSERT OR REPLACE INTO counters (name, value)
+        VALUES ('requests_total', (SELECT COUNT(*) FROM history)
+                + COALESCE((SELECT value FROM counters WHERE name = 'history_rows_expired'), 0))
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS counters_users AFTER INSERT ON user_settings BEGIN
+            UPDATE counters SET value = value + 1 WHERE name = 'users';
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS counters_requests AFTER INSERT ON history BEGIN
+            UPDATE counters SET value = value + 1 WHERE name = 'requests_total';
+        END
+        """,
+    ],
+    # 5: время ответа и почасовые/подневные сводки использования
+    ["ALTER TABLE history ADD COLUMN latency REAL"] + [
+        f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            bucket TEXT NOT NULL,
+            model TEXT NOT NULL,
+            requests INTEGER NOT NULL,
+            prompt_chars INTEGER NOT NULL,
+            response_chars INTEGER NOT NULL,
+            latency_sum REAL NOT NULL,
+            latency_count INTEGER NOT NULL,
+            {", ".join(f"{column} INTEGER NOT NULL" for column in _ROLLUP_BUCKET_COLUMNS)},
+            PRIMARY KEY (bucket, model)
+        )
+        """
+        for table in ("usage_hourly", "usage_daily")
+    ],
+    # 6: рассылки и результат отправки каждому получателю
+    [
+        """
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            from_chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            status_chat_id INTEGER,
+            status_message_id INTEGER,
+            status TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            cursor INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS broadcast_recipients (
+            broadcast_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            error TEXT,
+            PRIMARY KEY (broadcast_id, user_id)
+        ) WITHOUT ROWID
+        """,
+    ],
+]
+# Выполняются после фиксации своего шага миграции
+MIGRATION_OUTSIDE_TRANSACTION = {"VACUUM"}
+
+
+def fts_query(user_id: int, text: str) -> Optional[str]:
+    """Запрос FTS5 из пользовательского текста: все слова, с поиском по началу слова.
+
+    Короткие слова ищутся целиком: их префикс совпадает с слишком многими словами.
+    """
+    words = re.findall(r"\w+", text.lower())[:10]
+    if not words:
+        return None
+    terms = [f'"{word}"*' if len(word) >= 3 else f'"{word}"' for word in words]
+    return f"owner:u{user_id} AND " + " AND ".join(terms)
+
+
+class Storage:
+    """Асинхронное хранилище истории и настроек.
+
+    Все обращения к SQLite выполняются в одном выделенном потоке через
+    одно долгоживущее соединение в режиме WAL, поэтому обработчики
+    не блокируют цикл событий на время записи на диск.
+    Настройки пользователей читаются через LRU-кэш со сквозной записью,
+    история пишется пачками через HistoryWriter. Ответы длиннее
+    compress_threshold байт хранятся сжатыми zlib и распаковываются при чтении.
+    """
+
+    def __init__(self, db_name: str, default_model: str, default_temperature: float = 0.7,
+                 settings_cache: Optional[LRUCache] = None,
+                 history_batch_size: int = 100, history_flush_interval: float = 0.5,
+                 compress_threshold: Optional[int] = 1024):
+        self.db_name = db_name
+        self.compress_threshold = compress_threshold
+        self.default_model = default_model
+        self.default_temperature = default_temperature
+        self.settings_cache = settings_cache if settings_cache is not None else LRUCache()
+        # Число начатых изменений настроек: чтение при промахе кэша сверяется с ним
+        self._settings_writes = 0
+        self.history_writer = HistoryWriter(
+            self._write_history_batch,
+            batch_size=history_batch_size,
+            flush_interval=history_flush_interval
+        )
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="storage")
+        self._conn: Optional[sqlite3.Connection] = None
+
+    # ====== СЛУЖЕБНОЕ ====== #
+    async def _run(self, func, *args):
+        """Выполнить функцию в потоке базы данных"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_name, check_same_thread=False, cached_statements=256)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        # Нужна триггерам и представлению поискового индекса
+        conn.create_function("unpack_response", 1, self._decode_response, deterministic=True)
+        return conn
+
+    def _init_db(self):
+        self._conn = self._connect()
+        cursor = self._conn.cursor()
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            model TEXT NOT NULL,
+            temperature REAL NOT NULL,
+            prompt TEXT NOT NULL,
+            response TEXT NOT NULL
+        )
+        """)
+        cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS user_settings (
+            user_id INTEGER PRIMARY KEY,
+            model TEXT NOT NULL DEFAULT '{self.default_model}',
+            temperature REAL NOT NULL DEFAULT {self.default_temperature}
+        )
+        """)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS response_cache (
+            key TEXT PRIMARY KEY,
+            response TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            latency REAL NOT NULL,
+            created_at REAL NOT NULL,
+            last_access REAL NOT NULL
+        )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_last_access ON response_cache (last_access)")
+        self._conn.commit()
+        self._migrate()
+
+    @contextmanager
+    def _transaction(self):
+        """Явная транзакция с блокировкой записи с самого начала.
+
+        В отличие от with self._conn, откатывается и DDL, а чтения внутри
+        видят состояние, которое никто не изменит до фиксации.
+        """
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._conn.rollback()
+            raise
+        else:
+            self._conn.commit()
+
+    def _migrate(self):
+        # Каждый шаг вместе с новой версией схемы - одна транзакция: после сбоя
+        # база остаётся на предыдущей версии, а не между ними. Версия
+        # перечитывается под блокировкой, так что шаг выполняет только один процесс
+        while True:
+            with self._transaction():
+                version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+                if version >= len(MIGRATIONS):
+                    return
+                statements = MIGRATIONS[version]
+                for statement in statements:
+                    if statement not in MIGRATION_OUTSIDE_TRANSACTION:
+                        self._conn.execute(statement)
+                self._conn.execute(f"PRAGMA user_version = {version + 1}")
+            for statement in statements:
+                if statement in MIGRATION_OUTSIDE_TRANSACTION:
+                    self._conn.execute(statement)
+            logger.info(f"Database migrated to schema version {version + 1}")
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _encode_response(self, response: str) -> Tuple[Any, int]:
+        """Значение для колонки response и сэкономленные сжатием байты"""
+        raw = response.encode("utf-8")
+        if self.compress_threshold is None or len(raw) < self.compress_threshold:
+            return response, 0
+        packed = zlib.compress(raw, 6)
+        if len(packed) >= len(raw):
+            return response, 0
+        return packed, len(raw) - len(packed)
+
+    @staticmethod
+    def _decode_response(value: Any) -> str:
+        if isinstance(value, bytes):
+            return zlib.decompress(value).decode("utf-8")
+        return value
+
+    def _add_counters(self, **values: int):
+        self._conn.executemany(SQL_ADD_COUNTER, [(name, value) for name, value in values.items() if value])
+
+    # ====== ЖИЗНЕННЫЙ ЦИКЛ ====== #
+    async def init(self):
+        """Открыть соединение и создать таблицы"""
+        await self._run(self._init_db)
+        self.history_writer.start()
+
+    async def migrate(self):
+        """Создать таблицы и применить миграции, не оставляя соединение открытым.
+
+        Для запуска в родительском процессе до старта рабочих процессов.
+        """
+        await self._run(self._init_db)
+        await self._run(self._close)
+
+    async def close(self):
+        """Дописать очередь истории, закрыть соединение и остановить поток базы данных"""
+        await self.history_writer.close()
+        await self._run(self._close)
+        self._executor.shutdown(wait=True)
+
+    # ====== НАСТРОЙКИ ====== #
+    def _get_user_settings(self, user_id: int) -> Dict[str, Any]:
+        row = self._conn.execute(SQL_SELECT_SETTINGS, (user_id,)).fetchone()
+        if row:
+            return {"model": row[0], "temperature": row[1]}
+
+        default_settings = {"model": self.default_model, "temperature": self.default_temperature}
+        self._conn.execute(
+            SQL_INSERT_SETTINGS,
+            (user_id, default_settings["model"], default_settings["temperature"])
+        )
+        self._conn.commit()
+        return default_settings
+
+    def _update_user_setting(self, user_id: int, key: str, value: Any):
+        self._conn.execute(SQL_UPDATE_SETTING[key], (value, user_id))
+        self._conn.commit()
+
+    def _reset_user_settings(self, user_id: int):
+        self._conn.execute(SQL_RESET_SETTINGS, (self.default_model, self.default_temperature, user_id))
+        self._conn.commit()
+
+    async def get_user_settings(self, user_id: int) -> Dict[str, Any]:
+        """Получение настроек пользователя"""
+        settings = self.settings_cache.get(user_id)
+        if settings is None:
+            writes = self._settings_writes
+            settings = await self._run(self._get_user_settings, user_id)
+            # Изменение, начатое во время чтения, могло закончиться раньше нас:
+            # прочитанное тогда устарело и в кэш не попадает
+            if self._settings_writes == writes:
+                self.settings_cache.set(user_id, settings)
+        return dict(settings)
+
+    async def update_user_setting(self, user_id: int, key: str, value: Any):
+        """Обновление настроек пользователя"""
+        if key not in SQL_UPDATE_SETTING:
+            raise ValueError(f"Unknown setting: {key}")
+        self._settings_writes += 1
+        await self._run(self._update_user_setting, user_id, key, value)
+        cached = self.settings_cache.pop(user_id)
+        if cached is not None:
+            self.settings_cache.set(user_id, {**cached, key: value})
+
+    async def reset_user_settings(self, user_id: int):
+        """Сброс настроек пользователя к значениям по умолчанию"""
+        self._settings_writes += 1
+        await self._run(self._reset_user_settings, user_id)
+        self.settings_cache.set(user_id, {"model": self.default_model, "temperature": self.default_temperature})
+
+    # ====== ИСТОРИЯ ====== #
+    def _add_history_batch(self, rows: List[HistoryRow]):
+        encoded = []
+        saved = 0
+        for row in rows:
+            response, row_saved = self._encode_response(row[5])
+            encoded.append(row[:5] + (response, len(row[5]), row[6]))
+            saved += row_saved
+        with self._conn:
+            self._conn.executemany(SQL_INSERT_HISTORY, encoded)
+            self._add_counters(history_bytes_saved=saved)
+
+    def _get_user_history(self, user_id: int, limit: int) -> List[Tuple]:
+        rows = self._conn.execute(SQL_SELECT_HISTORY, (user_id, limit)).fetchall()
+        return [row[:4] + (self._decode_response(row[4]),) for row in rows]
+
+    def _get_history_page(self, user_id: int, before_id: Optional[int], after_id: Optional[int],
+                          limit: int) -> Tuple[List[Tuple], bool, bool]:
+        if after_id is not None:
+            rows = self._conn.execute(SQL_SELECT_HISTORY_NEWER, (user_id, after_id, limit + 1)).fetchall()
+            has_newer = len(rows) > limit
+            rows = rows[:limit][::-1]
+            has_older = True
+        else:
+            cursor = before_id if before_id is not None else 2 ** 63 - 1
+            rows = self._conn.execute(SQL_SELECT_HISTORY_OLDER, (user_id, cursor, limit + 1)).fetchall()
+            has_older = len(rows) > limit
+            rows = rows[:limit]
+            has_newer = before_id is not None
+        return rows, has_newer, has_older
+
+    def _get_history_entry(self, user_id: int, entry_id: int) -> Optional[Tuple]:
+        row = self._conn.execute(SQL_SELECT_HISTORY_ENTRY, (user_id, entry_id)).fetchone()
+        return row[:5] + (self._decode_response(row[5]),) if row else None
+
+    def _clear_user_history(self, user_id: int) -> int:
+        cursor = self._conn.execute(SQL_DELETE_HISTORY, (user_id,))
+        self._conn.commit()
+        return cursor.rowcount
+
+    async def _write_history_batch(self, rows: List[HistoryRow]):
+        await self._run(self._add_history_batch, rows)
+
+    async def add_to_history(self, user_id: int, model: str, temperature: float, prompt: str, response: str,
+                             latency: Optional[float] = None):
+        """Добавление записи в историю (запись на диск происходит в фоне)"""
+        timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        self.history_writer.add((user_id, timestamp, model, temperature, prompt, response, latency))
+
+    async def get_user_history(self, user_id: int, limit: int = 5) -> List[Tuple]:
+        """Получение истории пользователя, включая ещё не записанные строки"""
+        rows = await self._run(self._get_user_history, user_id, limit)
+        # Очередь читаем после запроса: строка, записанная во время запроса,
+        # к этому моменту уже убрана из очереди и не задвоится
+        pending = [row[1:6] for row in reversed(self.history_writer.pending(user_id))]
+        return (pending + rows)[:limit]
+
+    async def get_history_page(self, user_id: int, before_id: Optional[int] = None,
+                               after_id: Optional[int] = None,
+                               limit: int = 5) -> Tuple[List[Tuple], bool, bool]:
+        """Страница истории от новых записей к старым.
+
+        Без курсора - самые новые записи; before_id - записи старше указанной,
+        after_id - новее указанной. Строки: (id, timestamp, model, temperature,
+        prompt, длина ответа). Возвращает (строки, есть_новее, есть_старше).
+        """
+        if self.history_writer.pending(user_id):
+            # У строк в очереди ещё нет id, записываем их до выборки
+            await self.history_writer.flush()
+        return await self._run(self._get_history_page, user_id, before_id, after_id, limit)
+
+    async def get_history_entry(self, user_id: int, entry_id: int) -> Optional[Tuple]:
+        """Запись истории целиком: (id, timestamp, model, temperature, prompt, response)"""
+        return await self._run(self._get_history_entry, user_id, entry_id)
+
+    async def clear_user_history(self, user_id: int) -> int:
+        """Очистка истории пользователя"""
+        await self.history_writer.flush()
+        return await self._run(self._clear_user_history, user_id)
+
+    # ====== ХРАНЕНИЕ ИСТОРИИ ====== #
+    def _delete_history(self, sql: str, params: Tuple) -> int:
+        with self._conn:
+            deleted = self._conn.execute(sql, params).rowcount
+            self._add_counters(history_rows_expired=deleted)
+        return deleted
+
+    def _delete_history_older(self, cutoff: str, limit: int) -> int:
+        return self._delete_history(SQL_DELETE_HISTORY_OLDER, (cutoff, limit))
+
+    def _delete_history_over_total(self, max_rows: int, limit: int) -> int:
+        row = self._conn.execute(SQL_HISTORY_NTH_NEWEST, (max_rows,)).fetchone()
+        return self._delete_history(SQL_DELETE_HISTORY_UPTO, (row[0], limit)) if row else 0
+
+    def _users_over_history_limit(self, max_rows: int) -> List[int]:
+        return [row[0] for row in self._conn.execute(SQL_USERS_OVER_HISTORY_LIMIT, (max_rows,))]
+
+    def _delete_user_history_over(self, user_id: int, max_rows: int, limit: int) -> int:
+        row = self._conn.execute(SQL_USER_HISTORY_NTH_NEWEST, (user_id, max_rows)).fetchone()
+        return self._delete_history(SQL_DELETE_USER_HISTORY_UPTO, (user_id, row[0], limit)) if row else 0
+
+    def _incremental_vacuum(self, pages: int) -> int:
+        self._conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+        return self._conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+    def _get_storage_stats(self) -> Dict[str, int]:
+        page_size = self._conn.execute("PRAGMA page_size").fetchone()[0]
+        pages = self._conn.execute("PRAGMA page_count").fetchone()[0]
+        free = self._conn.execute("PRAGMA freelist_count").fetchone()[0]
+        stats = {"db_bytes": pages * page_size, "free_bytes": free * page_size,
+                 "history_bytes_saved": 0, "history_rows_expired": 0}
+        stats.update(self._conn.execute(SQL_SELECT_COUNTERS).fetchall())
+        return stats
+
+    async def delete_history_older(self, cutoff: str, limit: int) -> int:
+        """Удалить до limit самых старых записей с timestamp раньше cutoff"""
+        return await self._run(self._delete_history_older, cutoff, limit)
+
+    async def delete_history_over_total(self, max_rows: int, limit: int) -> int:
+        """Удалить до limit самых старых записей сверх max_rows во всей истории"""
+        return await self._run(self._delete_history_over_total, max_rows, limit)
+
+    async def users_over_history_limit(self, max_rows: int) -> List[int]:
+        """Пользователи, у которых в истории больше max_rows записей"""
+        return await self._run(self._users_over_history_limit, max_rows)
+
+    async def delete_user_history_over(self, user_id: int, max_rows: int, limit: int) -> int:
+        """Удалить до limit самых старых записей пользователя сверх max_rows"""
+        return await self._run(self._delete_user_history_over, user_id, max_rows, limit)
+
+    async def incremental_vacuum(self, pages: int) -> int:
+        """Вернуть системе до pages свободных страниц, вернуть число оставшихся"""
+        return await self._run(self._incremental_vacuum, pages)
+
+    async def get_storage_stats(self) -> Dict[str, int]:
+        """Размер базы, свободное место и накопленные счётчики хранения"""
+        return await self._run(self._get_storage_stats)
+
+    # ====== ПОИСК ====== #
+    def _search_history(self, query: str, offset: int, limit: int) -> List[Tuple]:
+        return self._conn.execute(SQL_SEARCH_HISTORY, (query, limit, offset)).fetchall()
+
+    def _rebuild_search_index(self):
+        with self._conn:
+            self._conn.execute(SQL_REBUILD_SEARCH)
+
+    async def search_history(self, user_id: int, text: str, offset: int = 0,
+                             limit: int = 5) -> Tuple[List[Tuple], bool]:
+        """Поиск по запросам и ответам пользователя, лучшие совпадения первыми.
+
+        Строки: (id, timestamp, model, запрос, фрагмент ответа), найденные
+        слова обрамлены символами \x02 и \x03. Возвращает (строки, есть_ещё).
+        """
+        query = fts_query(user_id, text)
+        if query is None:
+            return [], False
+        if self.history_writer.pending(user_id):
+            await self.history_writer.flush()
+        rows = await self._run(self._search_history, query, offset, limit + 1)
+        return rows[:limit], len(rows) > limit
+
+    async def rebuild_search_index(self):
+        """Перестроить поисковый индекс по всей истории"""
+        await self.history_writer.flush()
+        await self._run(self._rebuild_search_index)
+
+    # ====== СВОДКИ ====== #
+    def _rollup_history(self, batch_size: int) -> int:
+        # Курсор читается под блокировкой записи: другой процесс не сможет
+        # учесть те же строки между чтением курсора и его сдвигом
+        with self._transaction():
+            last_id = self._get_counter("rollup_last_id")
+            next_id = self._conn.execute(SQL_ROLLUP_NEXT_ID, (last_id, batch_size)).fetchone()[0]
+            if next_id is None:
+                return 0
+            hourly = self._conn.execute(SQL_ROLLUP_AGGREGATE, (last_id, next_id)).fetchall()
+            daily: Dict[Tuple[str, str], List] = {}
+            for bucket, model, *values in hourly:
+                totals = daily.setdefault((bucket[:10], model), [0] * len(values))
+                for i, value in enumerate(values):
+                    totals[i] += value
+            self._conn.executemany(SQL_ROLLUP_UPSERT["usage_hourly"], hourly)
+            self._conn.executemany(
+                SQL_ROLLUP_UPSERT["usage_daily"],
+                [(day, model, *values) for (day, model), values in daily.items()]
+            )
+            self._conn.execute(SQL_SET_COUNTER, ("rollup_last_id", next_id))
+        return sum(row[2] for row in hourly)
+
+    def _get_usage(self, table: str, since: str) -> List[Tuple]:
+        return self._conn.execute(SQL_SELECT_USAGE[table], (since,)).fetchall()
+
+    async def rollup_history(self, batch_size: int = 10000) -> int:
+        """Добавить к сводкам до batch_size новых записей истории, вернуть их число"""
+        return await self._run(self._rollup_history, batch_size)
+
+    async def get_usage(self, hourly: bool, since: str) -> List[Tuple]:
+        """Итоги по моделям из сводок начиная с корзины since.
+
+        Строки: (model, requests, prompt_chars, response_chars, latency_sum,
+        latency_count, затем счётчики корзин ROLLUP_LATENCY_BUCKETS).
+        """
+        return await self._run(self._get_usage, "usage_hourly" if hourly else "usage_daily", since)
+
+    # ====== РАССЫЛКИ ====== #
+    def _create_broadcast(self, from_chat_id: int, message_id: int, status_chat_id: Optional[int],
+                          status_message_id: Optional[int]) -> int:
+        with self._conn:
+            cursor = self._conn.execute(
+                SQL_INSERT_BROADCAST, (from_chat_id, message_id, status_chat_id, status_message_id, time.time())
+            )
+        return cursor.lastrowid
+
+    def _get_broadcast(self, broadcast_id: Optional[int]) -> Optional[Tuple]:
+        if broadcast_id is None:
+            return self._conn.execute(SQL_SELECT_LAST_BROADCAST).fetchone()
+        return self._conn.execute(SQL_SELECT_BROADCAST, (broadcast_id,)).fetchone()
+
+    def _get_running_broadcasts(self) -> List[Tuple]:
+        return self._conn.execute(SQL_SELECT_RUNNING_BROADCASTS).fetchall()
+
+    def _set_broadcast_status(self, broadcast_id: int, status: str):
+        with self._conn:
+            self._conn.execute(SQL_SET_BROADCAST_STATUS, (status, broadcast_id))
+
+    def _get_broadcast_recipients(self, after_user_id: int, limit: int) -> List[int]:
+        return [row[0] for row in self._conn.execute(SQL_SELECT_RECIPIENTS, (after_user_id, limit))]
+
+    def _count_broadcast_recipients(self, after_user_id: int) -> int:
+        return self._conn.execute(SQL_COUNT_RECIPIENTS, (after_user_id,)).fetchone()[0]
+
+    def _record_broadcast_batch(self, broadcast_id: int, cursor: int, results: List[Tuple[int, str, Optional[str]]]):
+        sent = sum(1 for _, status, _ in results if status == "sent")
+        with self._conn:
+            self._conn.executemany(
+                SQL_INSERT_RECIPIENT, [(broadcast_id, user_id, status, error) for user_id, status, error in results]
+            )
+            self._conn.execute(SQL_ADVANCE_BROADCAST, (cursor, sent, len(results) - sent, broadcast_id))
+
+    async def create_broadcast(self, from_chat_id: int, message_id: int, status_chat_id: Optional[int] = None,
+                               status_message_id: Optional[int] = None) -> int:
+        """Завести рассылку сообщения message_id из чата from_chat_id, вернуть её id"""
+        return await self._run(self._create_broadcast, from_chat_id, message_id, status_chat_id, status_message_id)
+
+    async def get_broadcast(self, broadcast_id: Optional[int] = None) -> Optional[Tuple]:
+        """Рассылка по id (без id - последняя): (id, from_chat_id, message_id,
+        status_chat_id, status_message_id, status, cursor, sent, failed)"""
+        return await self._run(self._get_broadcast, broadcast_id)
+
+    async def get_running_broadcasts(self) -> List[Tuple]:
+        """Незавершённые рассылки, в том же формате, что get_broadcast"""
+        return await self._run(self._get_running_broadcasts)
+
+    async def set_broadcast_status(self, broadcast_id: int, status: str):
+        await self._run(self._set_broadcast_status, broadcast_id, status)
+
+    async def get_broadcast_recipients(self, after_user_id: int, limit: int) -> List[int]:
+        """Следующие limit пользователей с user_id больше after_user_id"""
+        return await self._run(self._get_broadcast_recipients, after_user_id, limit)
+
+    async def count_broadcast_recipients(self, after_user_id: int) -> int:
+        """Сколько пользователей осталось после after_user_id"""
+        return await self._run(self._count_broadcast_recipients, after_user_id)
+
+    async def record_broadcast_batch(self, broadcast_id: int, cursor: int,
+                                     results: List[Tuple[int, str, Optional[str]]]):
+        """Сохранить результаты порции [(user_id, статус, ошибка)] и сдвинуть курсор"""
+        await self._run(self._record_broadcast_batch, broadcast_id, cursor, results)
+
+    # ====== КЭШ ОТВЕТОВ ====== #
+    def _get_cached_response(self, key: str) -> Optional[Tuple[str, float, float]]:
+        return self._conn.execute(SQL_SELECT_CACHED_RESPONSE, (key,)).fetchone()
+
+    def _touch_cached_responses(self, touches: List[Tuple[float, str]]):
+        with self._conn:
+            self._conn.executemany(SQL_TOUCH_CACHED_RESPONSE, touches)
+
+    def _put_cached_response(self, key: str, response: str, size: int, latency: float, now: float) -> int:
+        with self._conn:
+            row = self._conn.execute(SQL_SELECT_CACHED_RESPONSE_SIZE, (key,)).fetchone()
+            self._conn.execute(SQL_UPSERT_CACHED_RESPONSE, (key, response, size, latency, now, now))
+        return size - (row[0] if row else 0)
+
+    def _delete_cached_response(self, key: str):
+        self._conn.execute(SQL_DELETE_CACHED_RESPONSE, (key,))
+        self._conn.commit()
+
+    def _get_cached_responses_size(self) -> int:
+        return self._conn.execute(SQL_SIZE_CACHED_RESPONSES).fetchone()[0]
+
+    def _evict_cached_responses(self, expired_before: float, max_bytes: int) -> int:
+        with self._conn:
+            self._conn.execute(SQL_DELETE_EXPIRED_RESPONSES, (expired_before,))
+            total = self._get_cached_responses_size()
+            keys = []
+            for key, size in self._conn.execute(SQL_OLDEST_CACHED_RESPONSES):
+                if total <= max_bytes:
+                    break
+                keys.append((key,))
+                total -= size
+            self._conn.executemany(SQL_DELETE_CACHED_RESPONSE, keys)
+        return total
+
+    async def get_cached_response(self, key: str) -> Optional[Tuple[str, float, float]]:
+        """Ответ из кэша: (response, created_at, latency) или None"""
+        return await self._run(self._get_cached_response, key)
+
+    async def touch_cached_responses(self, touches: List[Tuple[float, str]]):
+        """Обновить время последнего обращения [(last_access, key)] одной транзакцией"""
+        await self._run(self._touch_cached_responses, touches)
+
+    async def put_cached_response(self, key: str, response: str, size: int, latency: float, now: float) -> int:
+        """Сохранить ответ в кэш, вернуть изменение общего размера кэша в байтах"""
+        return await self._run(self._put_cached_response, key, response, size, latency, now)
+
+    async def delete_cached_response(self, key: str):
+        """Удалить ответ из кэша"""
+        await self._run(self._delete_cached_response, key)
+
+    async def get_cached_responses_size(self) -> int:
+        """Суммарный размер кэша ответов в байтах"""
+        return await self._run(self._get_cached_responses_size)
+
+    async def evict_cached_responses(self, expired_before: float, max_bytes: int) -> int:
+        """Удалить просроченные и самые старые ответы, вернуть оставшийся размер"""
+        return await self._run(self._evict_cached_responses, expired_before, max_bytes)
+
+    # ====== СТАТИСТИКА ====== #
+    def _get_all_users(self) -> List[Tuple]:
+        return self._conn.execute(SQL_SELECT_USERS).fetchall()
+
+    def _get_counter(self, name: str) -> int:
+        row = self._conn.execute(SQL_SELECT_COUNTER, (name,)).fetchone()
+        return row[0] if row else 0
+
+    async def get_all_users(self) -> List[Tuple]:
+        """Получить список всех пользователей"""
+        return await self._run(self._get_all_users)
+
+    async def get_users_count(self) -> int:
+        """Количество пользователей (из счётчика, без обхода таблицы)"""
+        return await self._run(self._get_counter, "users")
+
+    async def get_total_requests(self) -> int:
+        """Получить общее количество запросов, включая удалённые из истории"""
+        return await self._run(self._get_counter, "requests_total") + self.history_writer.pending_count()
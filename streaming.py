@@ -0,0 +1,194 @@
+import asyncio
+import html
+import logging
+import re
+from typing import Awaitable, Callable, List, Tuple
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_LIMIT = 4096  # Максимальная длина сообщения Telegram
+INTERRUPTED_NOTE = "\n\n⚠️ <i>Ответ оборвался из-за ошибки сервиса, попробуйте повторить запрос.</i>"
+
+_TOKEN_RE = re.compile(r"(<[^<>]*>|&#?\w+;)")
+_TAG_RE = re.compile(r"<(/?)([a-zA-Z][\w-]*)[^>]*>")
+_INCOMPLETE_TAIL_RE = re.compile(r"(<[^<>]*|&#?\w*)$")
+
+
+# ====== РАЗБИЕНИЕ HTML ====== #
+def _closing_tags(open_tags: List[Tuple[str, str]]) -> str:
+    return "".join(f"</{name}>" for name, _ in reversed(open_tags))
+
+
+def _update_open_tags(open_tags: List[Tuple[str, str]], token: str):
+    match = _TAG_RE.fullmatch(token)
+    if not match:
+        return
+    closing, name = match.group(1), match.group(2).lower()
+    if not closing:
+        open_tags.append((name, token))
+        return
+    for i in range(len(open_tags) - 1, -1, -1):
+        if open_tags[i][0] == name:
+            del open_tags[i:]
+            break
+
+
+def _break_position(text: str, room: int) -> int:
+    """Место разрыва текста не дальше room символов, по возможности на границе строки или слова"""
+    for separator in ("\n", " "):
+        position = text.rfind(separator, 0, room)
+        if position > room // 2:
+            return position + 1
+    return room
+
+
+def split_html(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """Разбить HTML-текст на части не длиннее limit.
+
+    Теги и сущности не разрываются, открытые теги закрываются в конце
+    части и открываются заново в начале следующей.
+    """
+    parts: List[str] = []
+    open_tags: List[Tuple[str, str]] = []
+    current = prefix = ""
+
+    def flush():
+        nonlocal current, prefix
+        parts.append(current + _closing_tags(open_tags))
+        current = prefix = "".join(tag for _, tag in open_tags)
+
+    for token in _TOKEN_RE.split(text):
+        if not token:
+            continue
+        if _TOKEN_RE.fullmatch(token):
+            match = _TAG_RE.fullmatch(token)
+            own_closing = len(f"</{match.group(2)}>") if match and not match.group(1) else 0
+            reserve = len(_closing_tags(open_tags)) + len(token) + own_closing
+            if len(current) + reserve > limit and current != prefix:
+                flush()
+            current += token
+            _update_open_tags(open_tags, token)
+            continue
+
+        while token:
+            room = limit - len(current) - len(_closing_tags(open_tags))
+            if len(token) <= room:
+                current += token
+                break
+            if room <= 0 and current != prefix:
+                flush()
+                continue
+            room = max(room, 1)
+            position = _break_position(token, room)
+            current += token[:position]
+            token = token[position:]
+            flush()
+
+    if current or not parts:
+        parts.append(current + _closing_tags(open_tags))
+    return parts
+
+
+def close_partial_html(text: str) -> str:
+    """Обрезать недописанный тег или сущность в конце текста"""
+    return _INCOMPLETE_TAIL_RE.sub("", text)
+
+
+def close_open_tags(text: str) -> str:
+    """Дописать закрывающие теги для тегов, оставшихся открытыми в конце текста"""
+    open_tags: List[Tuple[str, str]] = []
+    for token in _TOKEN_RE.findall(text):
+        _update_open_tags(open_tags, token)
+    return text + _closing_tags(open_tags)
+
+
+# ====== ОЧЕРЕДЬ ====== #
+def queue_position_updater(message: Message) -> Callable[[int, float], Awaitable[None]]:
+    """Колбэк для FairScheduler: показывает позицию в очереди в сообщении"""
+    async def update(position: int, eta: float):
+        text = f"⏳ Вы в очереди: <b>{position}</b>"
+        if eta >= 1:
+            text += f", ожидание около {eta:.0f} с"
+        try:
+            await message.edit_text(text)
+        except TelegramBadRequest as e:
+            logger.warning(f"Queue position edit failed: {e}")
+    return update
+
+
+# ====== ПОТОКОВЫЙ ОТВЕТ ====== #
+class StreamingReply:
+    """Постепенное обновление ответа по мере генерации.
+
+    Сообщение редактируется не чаще одного раза в edit_interval секунд,
+    чтобы не упираться в лимиты Telegram на редактирование. Когда текст
+    перерастает одно сообщение, продолжение отправляется новыми сообщениями.
+    Если окончательный текст Telegram не принимает как HTML, он показывается
+    обычным текстом.
+    Время до первого фрагмента пишется в метрику llm_ttft_seconds.
+    """
+
+    def __init__(self, message: Message, header: str = "", edit_interval: float = 1.0,
+                 limit: int = MESSAGE_LIMIT):
+        self.messages: List[Message] = [message]
+        self.header = header
+        self.edit_interval = edit_interval
+        self.limit = limit
+        self.text = ""
+        self._rendered: List[str] = [message.html_text or ""]
+        self._loop = asyncio.get_running_loop()
+        self._started = self._loop.time()
+        self._last_edit = 0.0
+
+    async def feed(self, chunk: str):
+        """Добавить фрагмент ответа"""
+        if not chunk:
+            return
+        if not self.text:
+            metrics.observe("llm_ttft_seconds", self._loop.time() - self._started)
+        self.text += chunk
+        if self._loop.time() - self._last_edit >= self.edit_interval:
+            await self._render(close_partial_html(self.text))
+
+    async def finish(self) -> str:
+        """Показать окончательный текст, вернуть полный ответ"""
+        await self._show(self.text)
+        return self.text
+
+    async def abort(self, note: str = INTERRUPTED_NOTE):
+        """Генерация оборвалась: оставить полученную часть и дописать пометку note"""
+        await self._show(close_open_tags(close_partial_html(self.text)), note)
+
+    async def _show(self, body: str, note: str = ""):
+        try:
+            await self._render(body + note, strict=True)
+        except TelegramBadRequest as e:
+            # Ответ модели - не валидный HTML для Telegram: показываем его как есть, текстом
+            logger.warning(f"Streaming reply rejected as HTML, showing plain text: {e}")
+            await self._render(html.escape(body) + note)
+
+    async def _render(self, body: str, strict: bool = False):
+        self._last_edit = self._loop.time()
+        for i, part in enumerate(split_html(self.header + body, self.limit)):
+            try:
+                if i < len(self.messages):
+                    if self._rendered[i] != part:
+                        await self.messages[i].edit_text(part)
+                        self._rendered[i] = part
+                else:
+                    self.messages.append(await self.messages[-1].answer(part))
+                    self._rendered.append(part)
+            except TelegramBadRequest as e:
+                if "message is not modified" in e.message:
+                    self._rendered[i] = part
+                    continue
+                if strict:
+                    raise
+                # Промежуточный текст ещё может стать валидным, ждём следующих фрагментов
+                logger.warning(f"Streaming edit failed: {e}")
+                return
@@ -0,0 +1,67 @@
+import asyncio
+import json
+from collections import deque
+from typing import Deque, Optional, Tuple
+
+from aiohttp import web
+
+PATH = "/v1/chat/completions"
+
+
+class FakeProvider:
+    """Локальный OpenAI-совместимый провайдер для тестов.
+
+    Каждый ответ ждёт delay секунд и возвращает 200. Через script можно
+    задать поведение следующих запросов: (задержка, статус) по одному
+    на запрос, после чего снова действует delay. Запросы с "stream": true
+    получают ответ потоком server-sent events по словам.
+    """
+
+    def __init__(self, delay: float = 0.0, answer: str = "готово"):
+        self.delay = delay
+        self.answer = answer
+        self.script: Deque[Tuple[float, int]] = deque()
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.url = ""
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_post(PATH, self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}{PATH}"
+        return self.url
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _handle(self, request: web.Request) -> web.StreamResponse:
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            delay, status = self.script.popleft() if self.script else (self.delay, 200)
+            payload = await request.json()
+            await asyncio.sleep(delay)
+            if status != 200:
+                return web.json_response({"error": "injected"}, status=status)
+            if not payload.get("stream"):
+                return web.json_response({"choices": [{"message": {"content": self.answer}}]})
+
+            response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+            await response.prepare(request)
+            for word in self.answer.split(" "):
+                chunk = {"choices": [{"delta": {"content": word + " "}}]}
+                await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            await response.write(b"data: [DONE]\n\n")
+            await response.write_eof()
+            return response
+        finally:
+            self.in_flight -= 1
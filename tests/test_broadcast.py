@@ -0,0 +1,64 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+try:
+    from broadcast import DONE, FAILED, SENT, Broadcaster
+    from storage import Storage
+except ImportError as e:  # aiogram не установлен
+    raise unittest.SkipTest(str(e))
+
+
+class FlakyBot:
+    """Бот, у которого копирование сообщения части получателей падает неожиданной ошибкой"""
+
+    def __init__(self, broken):
+        self.broken = set(broken)
+        self.copied = []
+
+    async def copy_message(self, chat_id, from_chat_id, message_id):
+        if chat_id in self.broken:
+            raise RuntimeError("неожиданная ошибка")
+        self.copied.append(chat_id)
+
+    async def edit_message_text(self, *args, **kwargs):
+        pass
+
+
+class BroadcasterTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.storage = Storage(os.path.join(self.directory.name, "bot.db"), default_model="chadai")
+        await self.storage.init()
+        for user_id in range(1, 11):
+            await self.storage.get_user_settings(user_id)
+
+    async def asyncTearDown(self):
+        await self.storage.close()
+        self.directory.cleanup()
+
+    async def test_unexpected_error_marks_recipient_failed(self):
+        bot = FlakyBot(broken={3, 7})
+        broadcaster = Broadcaster(bot, self.storage, batch_size=4)
+
+        broadcast_id = await broadcaster.start(from_chat_id=1, message_id=100)
+        while broadcaster.active():
+            await asyncio.sleep(0.01)
+
+        progress = await broadcaster.progress(broadcast_id)
+        self.assertEqual(progress.status, DONE)
+        self.assertEqual((progress.sent, progress.failed), (8, 2))
+        self.assertEqual(sorted(bot.copied), [1, 2, 4, 5, 6, 8, 9, 10])
+
+    async def test_send_reports_error_text(self):
+        broadcaster = Broadcaster(FlakyBot(broken={5}), self.storage)
+
+        self.assertEqual(await broadcaster._send(4, 1, 100), (4, SENT, None))
+        user_id, status, error = await broadcaster._send(5, 1, 100)
+        self.assertEqual((user_id, status), (5, FAILED))
+        self.assertIn("неожиданная ошибка", error)
+
+
+if __name__ == "__main__":
+    unittest.main()
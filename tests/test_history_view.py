@@ -0,0 +1,55 @@
+import unittest
+
+try:
+    from aiogram.exceptions import TelegramBadRequest
+    from history_view import SNIPPET_LENGTH, format_search_results, send_history_entry
+except ImportError as e:  # aiogram не установлен
+    raise unittest.SkipTest(str(e))
+
+from streaming import MESSAGE_LIMIT
+
+
+class SearchResultsTest(unittest.TestCase):
+    def test_long_snippets_fit_in_one_message(self):
+        word = "\x02искомое\x03" + "x" * 5000
+        rows = [(i, "2024-01-01 00:00:00", "chadai", word, word) for i in range(5)]
+
+        text = format_search_results("искомое", rows, 0)
+
+        self.assertLess(len(text), MESSAGE_LIMIT)
+
+    def test_cut_highlight_is_closed(self):
+        prompt = "a" * (SNIPPET_LENGTH - 3) + "\x02искомое\x03"
+        rows = [(1, "2024-01-01 00:00:00", "chadai", prompt, "<ответ>")]
+
+        text = format_search_results("искомое", rows, 0)
+
+        self.assertEqual(text.count("<b>"), text.count("</b>"))
+        self.assertIn("&lt;ответ&gt;", text)
+
+
+class StrictMessage:
+    """Сообщение, которое, как Telegram, не принимает голый "<" в HTML"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def answer(self, text):
+        if "< " in text:
+            raise TelegramBadRequest(method=None, message="can't parse entities")
+        self.sent.append(text)
+
+
+class SendHistoryEntryTest(unittest.IsolatedAsyncioTestCase):
+    async def test_invalid_html_is_sent_as_text(self):
+        message = StrictMessage()
+        entry = (1, "2024-01-01 00:00:00", "chadai", 0.7, "сравни", "a < b & c")
+
+        await send_history_entry(message, entry)
+
+        self.assertEqual(len(message.sent), 1)
+        self.assertIn("a &lt; b &amp; c", message.sent[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import asyncio
+import unittest
+
+from history_writer import HistoryWriter
+
+
+def make_row(user_id: int, prompt: str):
+    return user_id, "2024-01-01 00:00:00", "chadai", 0.7, prompt, "ответ", None
+
+
+class HistoryWriterTest(unittest.IsolatedAsyncioTestCase):
+    async def test_failed_batch_is_retried(self):
+        written = []
+        failures = 2
+
+        async def write_batch(rows):
+            nonlocal failures
+            if failures:
+                failures -= 1
+                raise RuntimeError("database is locked")
+            written.extend(rows)
+
+        writer = HistoryWriter(write_batch, flush_interval=0.01, retry_delay=0.01)
+        writer.start()
+        writer.add(make_row(1, "раз"))
+        writer.add(make_row(1, "два"))
+        await asyncio.wait_for(writer.close(), 1)
+
+        self.assertEqual([row[4] for row in written], ["раз", "два"])
+        self.assertEqual(writer.pending_count(), 0)
+
+    async def test_rows_stay_pending_while_retrying(self):
+        attempts = 0
+
+        async def write_batch(rows):
+            nonlocal attempts
+            attempts += 1
+            raise RuntimeError("database is locked")
+
+        writer = HistoryWriter(write_batch, flush_interval=0.01, retries=2, retry_delay=0.05)
+        writer.start()
+        writer.add(make_row(1, "раз"))
+        await asyncio.sleep(0.04)
+        self.assertEqual([row[4] for row in writer.pending(1)], ["раз"])
+
+        await asyncio.wait_for(writer.close(), 1)
+        self.assertEqual(attempts, 3)
+        self.assertEqual(writer.pending_count(), 0)
+
+    async def test_flush_during_collection_is_not_lost(self):
+        batches = []
+
+        async def write_batch(rows):
+            batches.append(len(rows))
+
+        writer = HistoryWriter(write_batch, flush_interval=10)
+        writer.start()
+        writer.add(make_row(1, "раз"))
+        await asyncio.wait_for(writer.flush(), 1)
+        writer.add(make_row(1, "два"))
+        await asyncio.wait_for(writer.flush(), 1)
+        await writer.close()
+
+        self.assertEqual(batches, [1, 1])
@@ -0,0 +1,74 @@
+import asyncio
+import time
+import unittest
+
+try:
+    from http_client import APIClient
+    from providers import OpenAIProvider, ProviderRegistry
+    from tests.fake_provider import FakeProvider
+except ImportError as e:  # aiohttp не установлен
+    raise unittest.SkipTest(str(e))
+
+DELAY = 0.3
+
+
+class APIClientConcurrencyTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.provider = FakeProvider(delay=DELAY)
+        self.url = await self.provider.start()
+        self.client = APIClient(connect_timeout=1, read_timeout=5, limit_per_provider=20)
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        await self.provider.close()
+
+    async def test_parallel_requests_take_about_one_request_time(self):
+        started = time.monotonic()
+        results = await asyncio.gather(*(
+            self.client.post_json(self.url, {"messages": []}) for _ in range(20)
+        ))
+        elapsed = time.monotonic() - started
+
+        self.assertEqual(len(results), 20)
+        self.assertEqual(self.provider.max_in_flight, 20)
+        # Последовательно это заняло бы 20 * DELAY
+        self.assertLess(elapsed, DELAY * 2)
+
+    async def test_pool_limit_queues_extra_requests(self):
+        client = APIClient(limit_per_provider=5)
+        try:
+            started = time.monotonic()
+            await asyncio.gather(*(client.post_json(self.url, {"messages": []}) for _ in range(10)))
+            elapsed = time.monotonic() - started
+        finally:
+            await client.close()
+
+        self.assertEqual(self.provider.max_in_flight, 5)
+        self.assertGreaterEqual(elapsed, DELAY * 2)
+
+    async def test_read_timeout(self):
+        client = APIClient(read_timeout=0.05)
+        try:
+            with self.assertRaises(asyncio.TimeoutError):
+                await client.post_json(self.url, {"messages": []})
+        finally:
+            await client.close()
+
+    async def test_parallel_streams_through_registry(self):
+        self.provider.answer = "раз два три"
+        registry = ProviderRegistry(self.client)
+        registry.register(OpenAIProvider("fake", self.url, "key", "fake-model"))
+
+        async def collect() -> str:
+            return "".join([chunk async for chunk in registry.stream("fake", "привет", 0.5)])
+
+        started = time.monotonic()
+        answers = await asyncio.gather(*(collect() for _ in range(10)))
+        elapsed = time.monotonic() - started
+
+        self.assertEqual(answers, ["раз два три "] * 10)
+        self.assertLess(elapsed, DELAY * 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+import os
+import tempfile
+import unittest
+
+from importer import import_products, validate
+from database import Database
+
+
+class ValidateTest(unittest.TestCase):
+    def test_integral_prices(self):
+        for raw, expected in (("12", 12), ("12.00", 12), (" 7 ", 7), (15, 15), ("1e3", 1000)):
+            self.assertEqual(validate({"name": "Товар", "price": raw})[3], expected)
+
+    def test_rejected_prices(self):
+        for raw, reason in (
+            ("12.99", "цена должна быть целым числом"),
+            ("inf", "цена не число"),
+            ("nan", "цена не число"),
+            ("sNaN", "цена не число"),
+            ("abc", "цена не число"),
+            ("", "цена не число"),
+            ("-5", "отрицательная цена"),
+            ("1e30", "слишком большая цена"),
+        ):
+            with self.subTest(raw=raw):
+                with self.assertRaisesRegex(ValueError, reason):
+                    validate({"name": "Товар", "price": raw})
+
+
+class ImportProductsTest(unittest.IsolatedAsyncioTestCase):
+    async def test_bad_rows_are_skipped(self):
+        with tempfile.TemporaryDirectory() as directory:
+            db = Database(os.path.join(directory, "shop.db"))
+            path = os.path.join(directory, "import.csv")
+            with open(path, "w", encoding="utf-8") as file:
+                file.write("sku,name,price\na1,Чай,100\na2,Кофе,inf\na3,Сок,12.99\na4,Вода,50\n")
+
+            result = await import_products(db, path, "csv")
+            db.connection.close()
+
+        self.assertEqual((result.processed, result.imported, result.skipped), (4, 2, 2))
+        self.assertEqual(len(result.errors), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
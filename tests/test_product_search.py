@@ -0,0 +1,54 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+try:
+    from product_search import ProductIndex
+except ImportError as e:  # aiogram не установлен
+    raise unittest.SkipTest(str(e))
+
+from database import Database
+
+
+class ProductIndexRefreshTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db = Database(os.path.join(self.directory.name, "shop.db"))
+        for i in range(500):
+            self.db.add_product(f"Чай зелёный {i}", "листовой", 100, None)
+        self.index = ProductIndex(self.db)
+
+    async def asyncTearDown(self):
+        self.db.connection.close()
+        self.directory.cleanup()
+
+    async def test_refresh_builds_index(self):
+        await self.index.refresh()
+
+        products, _ = self.index.search("чай", limit=10)
+        self.assertEqual(len(products), 10)
+
+    async def test_search_uses_old_index_until_swap(self):
+        await self.index.refresh()
+        self.db.add_product("Кофе арабика", "зерно", 300, None)
+
+        refreshing = asyncio.create_task(self.index.refresh())
+        await asyncio.sleep(0)
+        self.assertEqual(self.index.search("кофе")[0], [])
+        await refreshing
+
+        self.assertEqual([row[1] for row in self.index.search("кофе")[0]], ["Кофе арабика"])
+
+    async def test_product_added_during_refresh_is_kept(self):
+        refreshing = asyncio.create_task(self.index.refresh())
+        await asyncio.sleep(0)
+        product_id = self.db.add_product("Какао", "порошок", 200, None)
+        self.index.add(product_id)
+        await refreshing
+
+        self.assertEqual([row[0] for row in self.index.search("какао")[0]], [product_id])
+
+
+if __name__ == "__main__":
+    unittest.main()
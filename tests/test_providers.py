@@ -0,0 +1,63 @@
+import time
+import unittest
+
+try:
+    from http_client import APIClient
+    from providers import AUTO, OpenAIProvider, ProviderRegistry, ProviderStats
+    from tests.fake_provider import FakeProvider
+except ImportError as e:  # aiohttp не установлен
+    raise unittest.SkipTest(str(e))
+
+
+class ProviderStatsTest(unittest.TestCase):
+    def test_error_rate_decays_over_time(self):
+        stats = ProviderStats(alpha=0.5, error_half_life=0.05)
+        for _ in range(4):
+            stats.record(0.1, ok=False)
+        self.assertGreater(stats.error_rate, 0.9)
+
+        time.sleep(0.1)
+        self.assertLess(stats.error_rate, 0.25)
+
+    def test_success_after_decay_starts_from_decayed_rate(self):
+        stats = ProviderStats(alpha=0.5, error_half_life=0.05)
+        stats.record(0.1, ok=False)
+        time.sleep(0.1)
+        stats.record(0.1, ok=True)
+        self.assertLess(stats.error_rate, 0.1)
+
+
+class ProviderFailoverTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.broken, self.working = FakeProvider(), FakeProvider(answer="запасной ответ")
+        self.client = APIClient()
+        self.registry = ProviderRegistry(self.client)
+        self.registry.register(OpenAIProvider("broken", await self.broken.start(), "key", "m"))
+        self.registry.register(OpenAIProvider("working", await self.working.start(), "key", "m"))
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        await self.broken.close()
+        await self.working.close()
+
+    async def test_reports_provider_that_answered(self):
+        self.broken.script.append((0, 500))
+        answered = []
+
+        text = await self.registry.generate("broken", "привет", 0.5, on_answer=answered.append)
+
+        self.assertEqual(text, "запасной ответ")
+        self.assertEqual(answered, ["working"])
+
+    async def test_stream_reports_provider_that_answered(self):
+        self.broken.script.append((0, 500))
+        answered = []
+
+        chunks = [c async for c in self.registry.stream(AUTO, "привет", 0.5, on_answer=answered.append)]
+
+        self.assertTrue(chunks)
+        self.assertEqual(len(answered), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+import asyncio
+import unittest
+
+try:
+    from aiogram.methods import EditMessageText
+    from ratelimit import RateLimiter, RateLimitMiddleware
+except ImportError as e:  # aiogram не установлен
+    raise unittest.SkipTest(str(e))
+
+
+class RateLimitMiddlewareTest(unittest.IsolatedAsyncioTestCase):
+    async def test_edits_of_one_message_do_not_overtake(self):
+        middleware = RateLimitMiddleware(RateLimiter(rate=1000, burst=1000, per_chat_rate=1000, per_chat_burst=1000))
+        in_flight = 0
+        delivered = []
+
+        async def make_request(bot, method):
+            nonlocal in_flight
+            in_flight += 1
+            self.assertEqual(in_flight, 1)
+            # Первая правка идёт дольше: без очереди вторая пришла бы раньше неё
+            await asyncio.sleep(0.05 if method.text == "раз" else 0.0)
+            delivered.append(method.text)
+            in_flight -= 1
+            return True
+
+        def edit(text):
+            return middleware(make_request, None, EditMessageText(chat_id=1, message_id=10, text=text))
+
+        first = asyncio.create_task(edit("раз"))
+        await asyncio.sleep(0.01)
+        results = await asyncio.gather(first, edit("два"), edit("три"))
+
+        self.assertEqual(results, [True, True, True])
+        # "два" и "три" склеились, пока "раз" был в пути
+        self.assertEqual(delivered, ["раз", "три"])
+        self.assertEqual(middleware._sending, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,176 @@
+import asyncio
+import time
+import unittest
+
+try:
+    import aiohttp
+
+    from http_client import APIClient
+    from resilience import CircuitBreaker, CircuitOpen, ResiliencePolicy
+    from tests.fake_provider import FakeProvider
+except ImportError as e:  # aiohttp не установлен
+    raise unittest.SkipTest(str(e))
+
+
+class ResiliencePolicyTest(unittest.IsolatedAsyncioTestCase):
+    """Повторы, дублирующие запросы и предохранитель против локального провайдера с ошибками"""
+
+    async def asyncSetUp(self):
+        self.provider = FakeProvider(delay=0.01)
+        self.url = await self.provider.start()
+        self.clients = []
+
+    async def asyncTearDown(self):
+        for client in self.clients:
+            await client.close()
+        await self.provider.close()
+
+    def client(self, read_timeout: float = 5, **policy) -> APIClient:
+        client = APIClient(read_timeout=read_timeout, policy=ResiliencePolicy(backoff_base=0.01, **policy))
+        self.clients.append(client)
+        return client
+
+    async def test_retries_server_errors_until_success(self):
+        client = self.client(retries=2)
+        self.provider.script.extend([(0, 503), (0, 503)])
+
+        data = await client.post_json(self.url, {"messages": []})
+
+        self.assertEqual(data["choices"][0]["message"]["content"], "готово")
+        self.assertEqual(self.provider.requests, 3)
+        self.assertEqual(client.policy.breaker(self.url).state, CircuitBreaker.CLOSED)
+
+    async def test_gives_up_after_retries(self):
+        client = self.client(retries=1)
+        self.provider.script.extend([(0, 502)] * 3)
+
+        with self.assertRaises(aiohttp.ClientResponseError) as raised:
+            await client.post_json(self.url, {"messages": []})
+
+        self.assertEqual(raised.exception.status, 502)
+        self.assertEqual(self.provider.requests, 2)
+        self.assertEqual(client.policy.breaker(self.url).failures, 1)
+
+    async def test_client_error_is_not_retried(self):
+        client = self.client(retries=2)
+        self.provider.script.append((0, 400))
+
+        with self.assertRaises(aiohttp.ClientResponseError):
+            await client.post_json(self.url, {"messages": []})
+
+        self.assertEqual(self.provider.requests, 1)
+        # Провайдер жив, просто запрос плохой - предохранитель это не считает
+        self.assertEqual(client.policy.breaker(self.url).failures, 0)
+
+    async def test_retries_read_timeout(self):
+        client = self.client(read_timeout=0.1, retries=1)
+        self.provider.script.append((0.3, 200))
+
+        data = await client.post_json(self.url, {"messages": []})
+
+        self.assertEqual(data["choices"][0]["message"]["content"], "готово")
+        self.assertEqual(self.provider.requests, 2)
+
+    async def test_stream_retried_before_first_chunk(self):
+        client = self.client(retries=1)
+        self.provider.answer = "раз два"
+        self.provider.script.append((0, 503))
+
+        chunks = [data async for data in client.stream_sse(self.url, {"stream": True})]
+
+        self.assertEqual([c["choices"][0]["delta"]["content"] for c in chunks], ["раз ", "два "])
+        self.assertEqual(self.provider.requests, 2)
+
+    async def test_hedged_request_wins_over_slow_one(self):
+        client = self.client(retries=0, hedge=True, hedge_min_delay=0.05)
+        for _ in range(20):
+            await client.post_json(self.url, {"messages": []})
+        self.assertIsNotNone(client.policy.hedge_delay(self.url))
+
+        self.provider.script.append((0.5, 200))
+        started = time.monotonic()
+        data = await client.post_json(self.url, {"messages": []})
+        elapsed = time.monotonic() - started
+
+        self.assertEqual(data["choices"][0]["message"]["content"], "готово")
+        self.assertLess(elapsed, 0.3)
+        self.assertEqual(self.provider.requests, 22)
+
+    async def test_no_hedging_without_latency_history(self):
+        client = self.client(retries=0, hedge=True, hedge_min_delay=0.05)
+        self.provider.script.append((0.2, 200))
+
+        await client.post_json(self.url, {"messages": []})
+
+        self.assertEqual(self.provider.requests, 1)
+
+    async def test_circuit_opens_and_recovers(self):
+        client = self.client(retries=0, failure_threshold=2, reset_timeout=0.2)
+        breaker = client.policy.breaker(self.url)
+        self.provider.script.extend([(0, 503), (0, 503)])
+
+        for _ in range(2):
+            with self.assertRaises(aiohttp.ClientResponseError):
+                await client.post_json(self.url, {"messages": []})
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+        # Пока цепь разомкнута, провайдер не получает запросов
+        with self.assertRaises(CircuitOpen):
+            await client.post_json(self.url, {"messages": []})
+        self.assertEqual(self.provider.requests, 2)
+
+        await asyncio.sleep(0.25)
+        await client.post_json(self.url, {"messages": []})
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(self.provider.requests, 3)
+
+    async def test_failed_probe_reopens_circuit(self):
+        client = self.client(retries=0, failure_threshold=1, reset_timeout=0.2)
+        breaker = client.policy.breaker(self.url)
+        self.provider.script.extend([(0, 500), (0, 500)])
+
+        with self.assertRaises(aiohttp.ClientResponseError):
+            await client.post_json(self.url, {"messages": []})
+        await asyncio.sleep(0.25)
+        with self.assertRaises(aiohttp.ClientResponseError):
+            await client.post_json(self.url, {"messages": []})
+
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpen):
+            await client.post_json(self.url, {"messages": []})
+        self.assertEqual(self.provider.requests, 2)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def test_opens_after_threshold(self):
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+        for _ in range(2):
+            breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+
+    def test_success_resets_failures(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_half_open_allows_single_probe(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+        breaker.record_failure()
+        time.sleep(0.06)
+
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(breaker.allow())
+
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(breaker.allow())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+import asyncio
+import unittest
+
+from scheduler import FairScheduler
+
+
+class FairSchedulerTest(unittest.IsolatedAsyncioTestCase):
+    async def test_failing_wait_callback_keeps_place_in_queue(self):
+        scheduler = FairScheduler(max_concurrency=1, update_interval=0.01)
+        calls = 0
+
+        async def on_wait(position, eta):
+            nonlocal calls
+            calls += 1
+            raise ConnectionError("сеть недоступна")
+
+        release = asyncio.Event()
+
+        async def busy():
+            async with scheduler.slot(1):
+                await release.wait()
+
+        async def queued():
+            async with scheduler.slot(2, on_wait):
+                return "готово"
+
+        holder = asyncio.create_task(busy())
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(queued())
+        await asyncio.sleep(0.05)
+        self.assertEqual(scheduler.waiting, 1)
+
+        release.set()
+        self.assertEqual(await asyncio.wait_for(waiter, 1), "готово")
+        await holder
+        self.assertEqual(calls, 1)
+        self.assertEqual(scheduler.stats()["active"], 0)
@@ -0,0 +1,86 @@
+import asyncio
+import unittest
+
+from singleflight import SingleFlight
+
+
+async def slow_words(delay: float, words=("раз", "два", "три")):
+    for word in words:
+        await asyncio.sleep(delay)
+        yield word
+
+
+class SingleFlightStreamTest(unittest.IsolatedAsyncioTestCase):
+    async def test_followers_share_one_stream(self):
+        flights = SingleFlight()
+        calls = 0
+
+        def source():
+            nonlocal calls
+            calls += 1
+            return slow_words(0.01)
+
+        async def collect():
+            return [chunk async for chunk in flights.stream("key", source)]
+
+        results = await asyncio.gather(*(collect() for _ in range(5)))
+        self.assertEqual(results, [["раз", "два", "три"]] * 5)
+        self.assertEqual(calls, 1)
+        self.assertEqual(flights.coalesced, 4)
+
+    async def test_waiter_timeout_does_not_stop_shared_stream(self):
+        flights = SingleFlight()
+
+        async def impatient():
+            return [chunk async for chunk in flights.stream("key", lambda: slow_words(0.1), timeout=0.02)]
+
+        async def patient():
+            return [chunk async for chunk in flights.stream("key", lambda: slow_words(0.1))]
+
+        first, second = await asyncio.gather(impatient(), patient(), return_exceptions=True)
+        self.assertIsInstance(first, asyncio.TimeoutError)
+        self.assertEqual(second, ["раз", "два", "три"])
+
+    async def test_cancelled_follower_detaches(self):
+        flights = SingleFlight()
+        received = []
+
+        async def follower():
+            async for chunk in flights.stream("key", lambda: slow_words(0.05)):
+                received.append(chunk)
+
+        task = asyncio.create_task(follower())
+        await asyncio.sleep(0.07)
+        other = asyncio.create_task(
+            asyncio.wait_for(self._collect(flights), timeout=1))
+        await asyncio.sleep(0)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+
+        self.assertEqual(received, ["раз"])
+        self.assertEqual(await other, ["раз", "два", "три"])
+
+    @staticmethod
+    async def _collect(flights: SingleFlight):
+        return [chunk async for chunk in flights.stream("key", lambda: slow_words(0.05))]
+
+    async def test_source_error_reaches_every_subscriber(self):
+        flights = SingleFlight()
+
+        async def broken():
+            yield "раз"
+            raise RuntimeError("обрыв")
+
+        async def collect():
+            chunks = []
+            with self.assertRaises(RuntimeError):
+                async for chunk in flights.stream("key", broken):
+                    chunks.append(chunk)
+            return chunks
+
+        self.assertEqual(await asyncio.gather(collect(), collect()), [["раз"], ["раз"]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import sys
+import time
+from typing import Optional, Set
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+POLLING = "polling"
+WEBHOOK = "webhook"
+
+
+def run_mode(default: str = POLLING) -> str:
+    """Режим получения обновлений: флаг --webhook/--polling в командной строке или default"""
+    if "--webhook" in sys.argv:
+        return WEBHOOK
+    if "--polling" in sys.argv:
+        return POLLING
+    return default
+
+
+class WebhookServer:
+    """Приём обновлений от Telegram через вебхук.
+
+    HTTP-обработчик только проверяет секретный заголовок и кладёт тело
+    запроса в ограниченную очередь, после чего сразу отвечает 200.
+    Разбор и обработка обновлений идут в фоне, одновременно не больше
+    max_concurrent_updates. Если очередь переполнена, отвечаем 503 -
+    Telegram доставит обновление повторно. Пустой secret_token отключает
+    проверку заголовка (например, за прокси, который проверяет сам).
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, secret_token: str, path: str = "/webhook",
+                 queue_size: int = 1000, max_concurrent_updates: int = 100):
+        self.dp = dp
+        self.bot = bot
+        self.secret_token = secret_token
+        self.path = path
+        self.queue: "asyncio.Queue" = asyncio.Queue(maxsize=queue_size)
+        self.max_concurrent_updates = max_concurrent_updates
+        self._tasks: Set[asyncio.Task] = set()
+        self._consumer: Optional[asyncio.Task] = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret_token and request.headers.get(SECRET_HEADER) != self.secret_token:
+            metrics.inc("webhook_forbidden")
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        try:
+            self.queue.put_nowait((time.monotonic(), data))
+        except asyncio.QueueFull:
+            metrics.inc("webhook_rejected")
+            return web.Response(status=503)
+        metrics.inc("webhook_received")
+        return web.Response()
+
+    async def _consume(self):
+        limit = asyncio.Semaphore(self.max_concurrent_updates)
+        while True:
+            received, data = await self.queue.get()
+            await limit.acquire()
+            task = asyncio.create_task(self._process(received, data))
+            self._tasks.add(task)
+            task.add_done_callback(lambda done: (self._tasks.discard(done), limit.release()))
+
+    async def _process(self, received: float, data: dict):
+        try:
+            update = Update.model_validate(data, context={"bot": self.bot})
+            metrics.observe("webhook_queue_seconds", time.monotonic() - received)
+            await self.dp.feed_update(self.bot, update)
+        except Exception as e:
+            logger.error(f"Error processing update: {e}", exc_info=True)
+        finally:
+            self.queue.task_done()
+
+    def stats(self):
+        return {"queued": self.queue.qsize(), "processing": len(self._tasks)}
+
+    async def run(self, host: str, port: int, base_url: str, drop_pending_updates: bool = False):
+        """Поднять HTTP-сервер, зарегистрировать вебхук и работать до отмены"""
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        runner = web.AppRunner(app)
+
+        if not self.secret_token:
+            logger.warning("Webhook secret token is empty, updates are accepted without verification")
+        await self.dp.emit_startup(bot=self.bot, dispatcher=self.dp)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        self._consumer = asyncio.create_task(self._consume())
+        await self.bot.set_webhook(
+            base_url.rstrip("/") + self.path,
+            secret_token=self.secret_token or None,
+            drop_pending_updates=drop_pending_updates
+        )
+        logger.info(f"Webhook server listening on {host}:{port}{self.path}")
+
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+            # Дорабатываем уже принятые обновления
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout=30)
+            except asyncio.TimeoutError:
+                logger.warning(f"Webhook shutdown: {self.queue.qsize()} updates left unprocessed")
+            self._consumer.cancel()
+            try:
+                await self.dp.emit_shutdown(bot=self.bot, dispatcher=self.dp)
+            finally:
+                await self.bot.session.close()